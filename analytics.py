@@ -0,0 +1,147 @@
+﻿import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from cluster_stats import read_cluster_totals, summarize_cluster_totals
+from inference import FEATURE_NAMES
+
+# ================== АНАЛІТИКА ДАШБОРДУ ==================
+#
+# Агрегати дашборду адміна рахуються в SQL на кожному шарді (групування
+# реєстрацій за днем або тижнем users.created_at прямо в GROUP BY, без
+# вивантаження рядків у Python) і зводяться додаванням. Середні фіч
+# кластерів беруться з центроїдів моделі, без звернення до БД.
+#
+# Результат кешується на ANALYTICS_CACHE_TTL секунд. Запис кешу
+# прив'язаний до версії даних (версія моделі та версії знімків шардів, які
+# змінюються після записів, див. snapshot.py): після нових записів
+# дашборд отримує свіжі агрегати, а без записів повторні запити не
+# торкаються БД.
+
+ANALYTICS_CACHE_TTL = float(os.environ.get('ANALYTICS_CACHE_TTL', 60))
+
+DEFAULT_ANALYTICS_DAYS = 90
+MAX_ANALYTICS_DAYS = 730
+
+# Початок інтервалу для users.created_at: день або понеділок тижня
+BUCKETS = {
+    'day': "date(u.created_at)",
+    'week': "date(u.created_at, 'weekday 0', '-6 days')"
+}
+
+
+def analytics_params(args):
+    """(bucket, days) з параметрів запиту; некоректні — ValueError"""
+    bucket = args.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        raise ValueError(f'bucket має бути одним з: {", ".join(BUCKETS)}')
+    try:
+        days = int(args.get('days', DEFAULT_ANALYTICS_DAYS))
+    except ValueError:
+        raise ValueError('days має бути цілим числом')
+    if not 1 <= days <= MAX_ANALYTICS_DAYS:
+        raise ValueError(f'days має бути від 1 до {MAX_ANALYTICS_DAYS}')
+    return bucket, days
+
+
+# Запити агрегатів (їхні плани перевіряє migrations.py)
+TOTAL_CLIENTS_SQL = "SELECT COUNT(*) FROM users WHERE role = 'client'"
+COMPLETED_SQL = 'SELECT COUNT(*) FROM client_profiles WHERE cluster_id IS NOT NULL'
+
+
+def analytics_counts_query(bucket, days):
+    """Групування реєстрацій за інтервалами та кластерами: (sql, params)"""
+    # Профіль є в кожного клієнта, тож одне групування дає і реєстрації
+    # (разом з cluster_name IS NULL), і склад кластерів. users стоїть першою
+    # в CROSS JOIN (SQLite не змінює такий порядок): вікно дат вибирає
+    # idx_users_created, а не сканування профілів, яке планувальник обирає
+    # за статистикою sqlite_stat1
+    return f'''
+        SELECT {BUCKETS[bucket]} AS bucket, p.cluster_name, COUNT(*)
+        FROM users u
+        CROSS JOIN client_profiles p ON p.user_id = u.id
+        WHERE u.created_at >= date('now', ?)
+        GROUP BY bucket, p.cluster_name
+    ''', (f'-{days - 1} days',)
+
+
+def read_analytics(conn, bucket, days):
+    """Агрегати одного шарда за останні days днів"""
+    total = conn.execute(TOTAL_CLIENTS_SQL).fetchone()[0]
+    completed = conn.execute(COMPLETED_SQL).fetchone()[0]
+    counts = conn.execute(*analytics_counts_query(bucket, days)).fetchall()
+
+    return {
+        'total': total,
+        'completed': completed,
+        'counts': counts,
+        'clusters': read_cluster_totals(conn)
+    }
+
+
+def merge_analytics(shards):
+    """Зведення агрегатів шардів у відповідь ендпоінта"""
+    registrations, mix = {}, {}
+    for shard in shards:
+        for bucket, cluster_name, count in shard['counts']:
+            registrations[bucket] = registrations.get(bucket, 0) + count
+            if cluster_name is not None:
+                mix[bucket, cluster_name] = mix.get((bucket, cluster_name), 0) + count
+
+    return {
+        'summary': {
+            'total_clients': sum(shard['total'] for shard in shards),
+            'completed_questionnaires': sum(shard['completed'] for shard in shards),
+            'kaggle_dataset_size': 2240
+        },
+        'registrations': [{'bucket': bucket, 'count': registrations[bucket]}
+                          for bucket in sorted(registrations)],
+        'cluster_mix': [{'bucket': bucket, 'cluster_name': cluster_name, 'count': mix[bucket, cluster_name]}
+                        for bucket, cluster_name in sorted(mix)],
+        'clusters': summarize_cluster_totals(shard['clusters'] for shard in shards)
+    }
+
+
+def cluster_feature_means(model, cluster_profiles):
+    """Середні значення фіч кластерів: центроїди, повернуті з масштабованого простору"""
+    means = np.asarray(model.centers, dtype=float) * model.scale + model.mean
+    return [{
+        'cluster_id': cluster_id,
+        'cluster_name': cluster_profiles.get(cluster_id, {}).get('name', f'Кластер {cluster_id}'),
+        'features': dict(zip(FEATURE_NAMES, row.tolist()))
+    } for cluster_id, row in enumerate(means)]
+
+
+class AnalyticsCache:
+    """Кеш агрегатів з TTL; запис недійсний, щойно змінилась версія даних"""
+
+    def __init__(self, ttl=ANALYTICS_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, key, version, compute):
+        """(значення, чи взято з кешу); compute() рахує значення при промаху"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                self.stats['hits'] += 1
+                return entry[2], True
+            self.stats['misses'] += 1
+
+        value = dict(compute(), generated_at=datetime.now(timezone.utc).isoformat())
+        with self._lock:
+            # Записи старих версій більше не знадобляться
+            self._entries = {cached_key: entry for cached_key, entry in self._entries.items()
+                             if entry[0] == version}
+            self._entries[key] = (version, now + self.ttl, value)
+        return value, False
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, ttl=self.ttl, entries=len(self._entries))
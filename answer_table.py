@@ -0,0 +1,128 @@
+﻿import os
+import numpy as np
+
+from inference import answers_to_features
+
+# ================== ТАБЛИЦЯ ВСІХ ВІДПОВІДЕЙ ==================
+#
+# Фічі моделі залежать лише від доходу (4 рівні), вікової групи (5),
+# наявності дітей (2) та шести слайдерів 1-10, тобто простір відповідей
+# містить 4 × 5 × 2 × 10^6 = 40 млн комбінацій. Таблиця зберігає мітку
+# кластера (uint8) та квантовану впевненість (uint16) для кожної
+# комбінації у файлах .npy, які відкриваються через mmap і спільно
+# використовуються всіма процесами через page cache ОС.
+
+ANSWER_TABLE_DIR = os.environ.get('ANSWER_TABLE_DIR', 'answer_tables')
+
+N_SLIDERS = 6
+SLIDER_LEVELS = 10
+BLOCK_SIZE = SLIDER_LEVELS ** N_SLIDERS
+CHUNK_SIZE = 250000
+
+CONFIDENCE_MIN = 0.7
+CONFIDENCE_SPAN = 0.27
+CONFIDENCE_LEVELS = np.iinfo(np.uint16).max
+
+
+def encode_confidence(confidence):
+    """Квантування впевненості 0.7-0.97 у uint16"""
+    q = np.rint((np.asarray(confidence) - CONFIDENCE_MIN) / CONFIDENCE_SPAN * CONFIDENCE_LEVELS)
+    return np.clip(q, 0, CONFIDENCE_LEVELS).astype(np.uint16)
+
+
+def decode_confidence(code):
+    """Відновлення впевненості з uint16"""
+    return CONFIDENCE_MIN + float(code) / CONFIDENCE_LEVELS * CONFIDENCE_SPAN
+
+
+def table_paths(fingerprint, directory=ANSWER_TABLE_DIR):
+    """Шляхи до файлів таблиці для версії моделі"""
+    base = os.path.join(directory, f'answers_{fingerprint}')
+    return base + '.labels.npy', base + '.confidence.npy'
+
+
+def build_answer_table(kernel, income_values, age_values, directory=ANSWER_TABLE_DIR):
+    """Оцінка всього простору відповідей та запис таблиці для моделі.
+
+    income_values та age_values — числові значення категорій у порядку,
+    в якому вони кодуються в індекс (див. AnswerTable.index).
+    """
+    os.makedirs(directory, exist_ok=True)
+    labels_path, confidence_path = table_paths(kernel.fingerprint, directory)
+    shape = (len(income_values) * len(age_values) * 2 * BLOCK_SIZE,)
+
+    # Запис у тимчасові файли та атомарна публікація
+    labels_tmp = labels_path + '.tmp'
+    confidence_tmp = confidence_path + '.tmp'
+    labels = np.lib.format.open_memmap(labels_tmp, mode='w+', dtype=np.uint8, shape=shape)
+    confidence = np.lib.format.open_memmap(confidence_tmp, mode='w+', dtype=np.uint16, shape=shape)
+
+    # Усі комбінації слайдерів 1-10 у порядку індексу (перший слайдер — старший розряд)
+    sliders = (np.indices((SLIDER_LEVELS,) * N_SLIDERS).reshape(N_SLIDERS, -1).T + 1).astype(np.int8)
+
+    offset = 0
+    for income in income_values:
+        for age in age_values:
+            for has_children in (0, 1):
+                for start in range(0, BLOCK_SIZE, CHUNK_SIZE):
+                    chunk = sliders[start:start + CHUNK_SIZE]
+                    features = answers_to_features(income, age, has_children, chunk)
+                    chunk_labels, chunk_confidence = kernel.predict(features)
+                    end = offset + start + len(chunk)
+                    labels[offset + start:end] = chunk_labels
+                    confidence[offset + start:end] = encode_confidence(chunk_confidence)
+                offset += BLOCK_SIZE
+
+    labels.flush()
+    confidence.flush()
+    del labels, confidence
+    os.replace(labels_tmp, labels_path)
+    os.replace(confidence_tmp, confidence_path)
+    return labels_path, confidence_path
+
+
+class AnswerTable:
+    """Memory-mapped таблиця кластерів для всіх комбінацій відповідей"""
+
+    def __init__(self, labels, confidence, fingerprint, n_income, n_age):
+        self.labels = labels
+        self.confidence = confidence
+        self.fingerprint = fingerprint
+        self.n_income = n_income
+        self.n_age = n_age
+
+    @classmethod
+    def open(cls, fingerprint, n_income, n_age, directory=ANSWER_TABLE_DIR):
+        """Відкриття таблиці для версії моделі або None, якщо її не побудовано"""
+        labels_path, confidence_path = table_paths(fingerprint, directory)
+        if not (os.path.exists(labels_path) and os.path.exists(confidence_path)):
+            return None
+
+        labels = np.load(labels_path, mmap_mode='r')
+        confidence = np.load(confidence_path, mmap_mode='r')
+        expected = n_income * n_age * 2 * BLOCK_SIZE
+        if labels.shape != (expected,) or confidence.shape != (expected,):
+            return None
+        return cls(labels, confidence, fingerprint, n_income, n_age)
+
+    def index(self, income_idx, age_idx, has_children, sliders):
+        """Позиція комбінації в таблиці або None, якщо слайдери поза сіткою 1-10"""
+        position = (income_idx * self.n_age + age_idx) * 2 + int(has_children)
+        for value in sliders:
+            if not 1 <= value <= SLIDER_LEVELS or value != int(value):
+                return None
+            position = position * SLIDER_LEVELS + int(value) - 1
+        return position
+
+    def lookup(self, position):
+        """Мітка кластера та впевненість для позиції"""
+        return int(self.labels[position]), decode_confidence(self.confidence[position])
+
+
+if __name__ == '__main__':
+    import server
+
+    server.warmup()
+    print("🔄 Побудова таблиці відповідей...")
+    paths = server.segmentation.build_answer_table()
+    print(f"✅ Таблицю збережено: {', '.join(paths)}")
@@ -0,0 +1,118 @@
+﻿import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# ================== БЕНЧМАРК З'ЄДНАНЬ З БД ==================
+#
+# Запити за секунду до типових ендпоінтів з пулом налаштованих з'єднань
+# (WAL, synchronous=NORMAL, кеш сторінок та підготовлених запитів) та
+# без нього (DB_POOL_SIZE=0 — нове з'єднання на кожен запит, як раніше).
+# Кожен замір — окремий процес з новою БД: спочатку реєструються клієнти
+# та заповнюються їхні анкети, потім кілька потоків протягом заданого часу
+# по колу виконують: перевірку анкети, профіль, рекомендації, кластери
+# (адмін) та реєстрацію нового клієнта (запис).
+#
+# Запуск: python bench_db.py [секунди] [потоки] [повтори]
+
+PROBE = r'''
+import json, sys, threading, time
+import server
+
+duration, threads = float(sys.argv[1]), int(sys.argv[2])
+server.warmup()
+client = server.app.test_client()
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+answers = {
+    'age_group': '25-34', 'income_level': 'medium', 'education': 'bachelor',
+    'marital_status': 'single', 'has_children': False, 'price_sensitivity': 6,
+    'online_shopping': 7, 'brand_loyalty': 5, 'innovation': 6,
+    'social_influence': 4, 'quality_importance': 7
+}
+tokens = []
+for i in range(200):
+    token = client.post('/api/register', json={
+        'email': f'bench{i}@example.com', 'password': 'bench', 'name': f'Bench {i}'
+    }).get_json()['token']
+    client.post('/api/questionnaire', json=answers, headers=auth(token))
+    tokens.append(token)
+admin = client.post('/api/login', json={
+    'email': 'admin@system.ua', 'password': 'admin123'
+}).get_json()['token']
+
+counts, errors = [0] * threads, [0] * threads
+deadline = time.perf_counter() + duration
+
+def worker(index):
+    local = server.app.test_client()
+    token = tokens[index]
+    i = 0
+    while time.perf_counter() < deadline:
+        step = i % 5
+        if step == 0:
+            response = local.get('/api/check-questionnaire', headers=auth(token))
+        elif step == 1:
+            response = local.get('/api/my-profile', headers=auth(token))
+        elif step == 2:
+            response = local.get('/api/recommendations', headers=auth(token))
+        elif step == 3:
+            response = local.get('/api/admin/clusters', headers=auth(admin))
+        else:
+            response = local.post('/api/register', json={
+                'email': f'load{index}-{i}@example.com', 'password': 'bench', 'name': 'Load'
+            })
+        counts[index] += 1
+        errors[index] += response.status_code != 200
+        i += 1
+
+start = time.perf_counter()
+workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+for thread in workers:
+    thread.start()
+for thread in workers:
+    thread.join()
+elapsed = time.perf_counter() - start
+
+print(json.dumps({
+    'rps': sum(counts) / elapsed,
+    'errors': sum(errors),
+    'pool': server.storage.health()
+}))
+'''
+
+
+def measure(pool_size, duration, threads, repeats):
+    """Медіана запитів за секунду для розміру пулу"""
+    runs = []
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DB_POOL_SIZE=str(pool_size),
+                       DB_PATH=os.path.join(tmp, 'bench.db'))
+            output = subprocess.run(
+                [sys.executable, '-c', PROBE, str(duration), str(threads)], env=env,
+                capture_output=True, text=True, check=True
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        'rps': statistics.median(r['rps'] for r in runs),
+        'errors': sum(r['errors'] for r in runs),
+        'pool': runs[-1]['pool']
+    }
+
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    print(f"{'режим':<24} {'запитів/с':>10} {'помилок':>8}  журнал")
+    for label, pool_size in (('без пулу', 0), (f'пул, розмір {threads}', threads)):
+        result = measure(pool_size, duration, threads, repeats)
+        print(f"{label:<24} {result['rps']:>10.1f} {result['errors']:>8}  "
+              f"{result['pool']['journal_mode']}")
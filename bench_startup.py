@@ -0,0 +1,65 @@
+﻿import json
+import os
+import statistics
+import subprocess
+import sys
+
+# ================== БЕНЧМАРК ЗАПУСКУ СЕРВЕРА ==================
+#
+# Кожен замір — окремий процес Python (холодний імпорт). Для режимів
+# 'eager' та 'lazy' вимірюються:
+#   import_ms  — імпорт server.py;
+#   warm_ms    — warmup() (у режимі eager вже виконано під час імпорту);
+#   first_ms   — перший запит /api/ready після warmup;
+#   modules    — чи були імпортовані важкі бібліотеки.
+#
+# Запуск: python bench_startup.py [кількість повторів]
+
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+server.warmup()
+warmed = time.perf_counter()
+client = server.app.test_client()
+response = client.get('/api/ready')
+done = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'warm_ms': (warmed - imported) * 1000,
+    'first_ms': (done - warmed) * 1000,
+    'status': response.status_code,
+    'modules': {name: name in sys.modules for name in ('pandas', 'sklearn', 'scipy', 'joblib')}
+}))
+'''
+
+
+def measure(mode, repeats):
+    """Медіани часів запуску для режиму"""
+    env = dict(os.environ, STARTUP_MODE=mode)
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE], env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        'import_ms': statistics.median(r['import_ms'] for r in runs),
+        'warm_ms': statistics.median(r['warm_ms'] for r in runs),
+        'first_ms': statistics.median(r['first_ms'] for r in runs),
+        'modules': runs[-1]['modules']
+    }
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print(f"{'режим':<8} {'імпорт, мс':>12} {'warmup, мс':>12} {'1-й запит, мс':>15}  важкі модулі")
+    for mode in ('eager', 'lazy'):
+        result = measure(mode, repeats)
+        loaded = ', '.join(name for name, present in result['modules'].items() if present) or '—'
+        print(f"{mode:<8} {result['import_ms']:>12.1f} {result['warm_ms']:>12.1f} "
+              f"{result['first_ms']:>15.1f}  {loaded}")
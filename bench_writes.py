@@ -0,0 +1,99 @@
+﻿import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# ================== БЕНЧМАРК ЗБЕРЕЖЕННЯ АНКЕТ ==================
+#
+# Кілька потоків одночасно надсилають анкети нових клієнтів (як після
+# розсилки кампанії) у кожному режимі WRITE_ACK: 'direct' (транзакція в
+# обробнику, як раніше) та групові коміти з підтвердженням 'commit',
+# 'fsync' і 'queued'. Кожен замір — окремий процес з новою БД.
+# Вимірюються анкети за секунду, медіана та 99-й перцентиль часу
+# відповіді, помилки та середній розмір групи коміту.
+#
+# Запуск: python bench_writes.py [анкет] [потоки] [повтори]
+# (з SHARD_COUNT=4 у середовищі — те саме на 4 шардах, див. sharding.py)
+
+PROBE = r'''
+import json, sys, threading, time
+import server
+
+total, threads = int(sys.argv[1]), int(sys.argv[2])
+server.warmup()
+client = server.app.test_client()
+
+answers = {
+    'age_group': '25-34', 'income_level': 'medium', 'education': 'bachelor',
+    'marital_status': 'single', 'has_children': False, 'price_sensitivity': 6,
+    'online_shopping': 7, 'brand_loyalty': 5, 'innovation': 6,
+    'social_influence': 4, 'quality_importance': 7
+}
+tokens = [client.post('/api/register', json={
+    'email': f'campaign{i}@example.com', 'password': 'bench', 'name': f'Client {i}'
+}).get_json()['token'] for i in range(total)]
+
+latencies, errors = [], [0]
+
+def worker(index):
+    local = server.app.test_client()
+    for token in tokens[index::threads]:
+        start = time.perf_counter()
+        response = local.post('/api/questionnaire', json=answers,
+                              headers={'Authorization': f'Bearer {token}'})
+        latencies.append((time.perf_counter() - start) * 1000)
+        errors[0] += response.status_code != 200
+
+start = time.perf_counter()
+workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+for thread in workers:
+    thread.start()
+for thread in workers:
+    thread.join()
+for writer in server.write_queues or ():
+    writer.flush()
+elapsed = time.perf_counter() - start
+
+latencies.sort()
+infos = [writer.info() for writer in server.write_queues or ()]
+batches = sum(info['batches'] for info in infos)
+print(json.dumps({
+    'per_second': total / elapsed,
+    'p50_ms': latencies[len(latencies) // 2],
+    'p99_ms': latencies[int(len(latencies) * 0.99)],
+    'errors': errors[0],
+    'avg_batch': sum(info['committed'] for info in infos) / batches if batches else 1.0
+}))
+'''
+
+
+def measure(ack, total, threads, repeats):
+    """Медіани показників для режиму підтвердження"""
+    runs = []
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, WRITE_ACK=ack, DB_PATH=os.path.join(tmp, 'bench.db'))
+            output = subprocess.run(
+                [sys.executable, '-c', PROBE, str(total), str(threads)], env=env,
+                capture_output=True, text=True, check=True
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    result = {name: statistics.median(r[name] for r in runs)
+              for name in ('per_second', 'p50_ms', 'p99_ms', 'avg_batch')}
+    result['errors'] = sum(r['errors'] for r in runs)
+    return result
+
+
+if __name__ == '__main__':
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    print(f"{'режим':<8} {'анкет/с':>9} {'p50, мс':>9} {'p99, мс':>9} {'група':>7} {'помилок':>8}")
+    for ack in ('direct', 'commit', 'fsync', 'queued'):
+        result = measure(ack, total, threads, repeats)
+        print(f"{ack:<8} {result['per_second']:>9.1f} {result['p50_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f} {result['avg_batch']:>7.1f} {result['errors']:>8}")
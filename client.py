@@ -153,7 +153,7 @@ if 'logged_in' not in st.session_state:
 
 # ================== ФУНКЦІЇ API ==================
 
-def make_request(method, endpoint, json_data=None):
+def make_request(method, endpoint, json_data=None, params=None):
     """Універсальна функція для API запитів з токеном"""
     url = f"{API_URL}{endpoint}"
     
@@ -163,7 +163,7 @@ def make_request(method, endpoint, json_data=None):
     
     try:
         if method == 'GET':
-            response = requests.get(url, headers=headers)
+            response = requests.get(url, headers=headers, params=params)
         elif method == 'POST':
             response = requests.post(url, json=json_data, headers=headers)
         
@@ -836,26 +836,57 @@ elif st.session_state.role == 'admin':
         if st.button("🚪", use_container_width=True, help="Вийти"):
             logout()
     
+    # Адмін-сторінки читають знімок БД: показуємо, наскільки він застарів
+    snapshot_response = make_request('GET', '/admin/snapshot')
+    if snapshot_response and snapshot_response.status_code == 200:
+        snapshot = snapshot_response.json()
+        if snapshot['enabled'] and snapshot['taken_at']:
+            taken_at = datetime.fromisoformat(snapshot['taken_at']).astimezone()
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.caption(f"🕒 Дані станом на {taken_at.strftime('%H:%M:%S')} "
+                           f"({snapshot['age_seconds']:.0f} с тому, "
+                           f"нових записів: {snapshot['writes_since']})")
+            with col2:
+                if st.button("🔄 Оновити дані", use_container_width=True):
+                    make_request('POST', '/admin/snapshot')
+                    st.rerun()
+    
     st.divider()
     
     # ДАШБОРД
     if st.session_state.get('admin_page', 'dashboard') == 'dashboard':
         st.title("📊 Адміністративний дашборд")
         
-        response = make_request('GET', '/admin/analytics')
+        col1, col2 = st.columns(2)
+        with col1:
+            bucket = st.selectbox("Інтервал", ['day', 'week'],
+                                  format_func={'day': 'По днях', 'week': 'По тижнях'}.get)
+        with col2:
+            days = st.selectbox("Період", [30, 90, 180, 365], index=1,
+                                format_func=lambda n: f"Останні {n} днів")
+        
+        # Усі агрегати дашборду рахує сервер одним запитом
+        response = make_request('GET', '/admin/analytics', params={'bucket': bucket, 'days': days})
         if response and response.status_code == 200:
             data = response.json()
+            summary = data['summary']
+            registered = sum(row['count'] for row in data['registrations'])
             
             # Метрики
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("👥 Всього клієнтів", data['summary']['total_clients'], "↑ 12%")
+                st.metric("👥 Всього клієнтів", summary['total_clients'],
+                          f"+{registered} за {days} днів")
             with col2:
-                st.metric("📊 Kaggle датасет", f"{data['summary'].get('kaggle_dataset_size', 2240)} записів")
+                completion = (summary['completed_questionnaires'] / summary['total_clients']
+                              if summary['total_clients'] else 0)
+                st.metric("📝 Пройшли опитування", summary['completed_questionnaires'],
+                          f"{completion:.0%}")
             with col3:
-                st.metric("🎯 Кластерів", "5", "K-Means")
+                st.metric("🎯 Кластерів", len(data['cluster_features']), "K-Means")
             with col4:
-                st.metric("📈 Точність моделі", "87.3%", "↑ 2.1%")
+                st.metric("📊 Kaggle датасет", f"{summary.get('kaggle_dataset_size', 2240)} записів")
             
             st.divider()
             
@@ -864,62 +895,78 @@ elif st.session_state.role == 'admin':
             
             with col1:
                 # Розподіл по кластерах
-                cluster_data = pd.DataFrame({
-                    'Кластер': ['Преміум', 'Економні', 'Молоді', 'Сімейні', 'Випадкові'],
-                    'Кількість': [403, 694, 493, 426, 224],
-                    'Відсоток': [18, 31, 22, 19, 10]
-                })
-                
-                fig = px.pie(cluster_data, values='Кількість', names='Кластер',
-                           title='Розподіл клієнтів по кластерах (Kaggle Dataset)',
-                           color_discrete_map={
-                               'Преміум': '#59253A',
-                               'Економні': '#0877A1',
-                               'Молоді': '#2D4159',
-                               'Сімейні': '#895061',
-                               'Випадкові': '#78244C'
-                           })
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color='white')
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                if data['clusters']:
+                    cluster_data = pd.DataFrame(data['clusters'])
+                    
+                    fig = px.pie(cluster_data, values='count', names='name',
+                               title='Розподіл клієнтів по кластерах',
+                               color_discrete_sequence=['#59253A', '#0877A1', '#2D4159', '#895061', '#78244C'])
+                    fig.update_layout(
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)',
+                        font=dict(color='white')
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("Ще ніхто не пройшов опитування")
             
             with col2:
                 # Динаміка реєстрацій
-                dates = pd.date_range(start='2024-01-01', periods=30, freq='D')
-                registrations = np.random.poisson(5, 30).cumsum()
+                if data['registrations']:
+                    registrations = pd.DataFrame(data['registrations'])
+                    
+                    fig = px.line(registrations, x='bucket', y='count',
+                                title='Динаміка реєстрацій клієнтів',
+                                labels={'bucket': 'Дата', 'count': 'Кількість'})
+                    fig.update_traces(mode='lines+markers', line_color='#0877A1')
+                    fig.update_layout(
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)',
+                        font=dict(color='white'),
+                        xaxis=dict(gridcolor='rgba(255,255,255,0.1)'),
+                        yaxis=dict(gridcolor='rgba(255,255,255,0.1)')
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("За цей період реєстрацій немає")
+            
+            # Склад нових клієнтів за кластерами
+            if data['cluster_mix']:
+                mix = pd.DataFrame(data['cluster_mix'])
                 
-                fig = px.line(x=dates, y=registrations,
-                            title='Динаміка реєстрацій клієнтів',
-                            labels={'x': 'Дата', 'y': 'Кількість'})
-                fig.update_traces(mode='lines+markers', line_color='#0877A1')
+                fig = px.area(mix, x='bucket', y='count', color='cluster_name', groupnorm='percent',
+                              title='Склад нових клієнтів за кластерами, %',
+                              labels={'bucket': 'Дата', 'count': 'Частка', 'cluster_name': 'Кластер'},
+                              color_discrete_sequence=['#59253A', '#0877A1', '#2D4159', '#895061', '#78244C'])
                 fig.update_layout(
                     plot_bgcolor='rgba(0,0,0,0)',
                     paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color='white'),
-                    xaxis=dict(gridcolor='rgba(255,255,255,0.1)'),
-                    yaxis=dict(gridcolor='rgba(255,255,255,0.1)')
+                    font=dict(color='white')
                 )
                 st.plotly_chart(fig, use_container_width=True)
             
-            # Теплова карта активності
+            # Теплова карта характеристик кластерів
             st.divider()
             st.markdown("### 🔥 Карта активності кластерів")
             
-            # Генеруємо дані для теплової карти
-            clusters = ['Преміум', 'Економні', 'Молоді', 'Сімейні', 'Випадкові']
-            metrics = ['Дохід', 'Витрати', 'Частота', 'Лояльність', 'Online']
-            
-            heatmap_data = np.random.rand(5, 5) * 100
+            # Середні фіч кластерів (центроїди моделі); колір — положення
+            # кластера між мінімумом та максимумом фічі (0-100)
+            feature_labels = {
+                'income': 'Дохід', 'age': 'Вік', 'total_spent': 'Витрати',
+                'total_purchases': 'Покупки', 'web_visits': 'Online',
+                'has_children': 'Діти', 'recency': 'Давність покупки'
+            }
+            means = pd.DataFrame([cluster['features'] for cluster in data['cluster_features']],
+                                 index=[cluster['cluster_name'] for cluster in data['cluster_features']])
+            spread = (means.max() - means.min()).replace(0, 1)
+            heatmap_data = (means - means.min()) / spread * 100
             
             fig = go.Figure(data=go.Heatmap(
-                z=heatmap_data,
-                x=metrics,
-                y=clusters,
+                z=heatmap_data.values,
+                x=[feature_labels.get(name, name) for name in means.columns],
+                y=means.index,
                 colorscale=[[0, '#59253A'], [0.5, '#78244C'], [1, '#0877A1']],
-                text=heatmap_data.round(1),
+                text=means.round(1).values,
                 texttemplate="%{text}",
                 textfont={"size": 12, "color": "white"},
             ))
@@ -933,35 +980,83 @@ elif st.session_state.role == 'admin':
             )
             
             st.plotly_chart(fig, use_container_width=True)
+            st.caption(f"Розраховано {datetime.fromisoformat(data['generated_at']).astimezone():%H:%M:%S}"
+                       f"{' (з кешу)' if data['cached'] else ''}")
+        elif response is not None:
+            st.error(response.json().get('error', 'Не вдалося отримати аналітику'))
     
     # КЛІЄНТИ
     elif st.session_state.get('admin_page') == 'clients':
         st.title("👥 Управління клієнтами")
         
-        response = make_request('GET', '/admin/clients')
+        response = make_request('GET', '/admin/analytics')
+        if response and response.status_code == 200:
+            st.metric("Всього зареєстровано", response.json()['summary']['total_clients'])
+        
+        # Фільтри та сортування виконує сервер, сюди приходить лише одна сторінка
+        clusters_response = make_request('GET', '/admin/clusters')
+        cluster_names = ([cluster['name'] for cluster in clusters_response.json()]
+                         if clusters_response and clusters_response.status_code == 200 else [])
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            cluster_filter = st.selectbox("Фільтр по кластеру", ["Всі"] + cluster_names)
+            sort_by = st.selectbox("Сортування", ['id', 'created_at', 'confidence'],
+                                   format_func={'id': 'За реєстрацією', 'created_at': 'За датою',
+                                                'confidence': 'За впевненістю'}.get)
+        with col2:
+            confidence_range = st.slider("Впевненість", 0.0, 1.0, (0.0, 1.0), 0.05)
+            descending = st.checkbox("За спаданням")
+        with col3:
+            created_range = st.date_input("Дата реєстрації", value=())
+            page_size = st.selectbox("На сторінці", [25, 50, 100, 200], index=1)
+        
+        params = {'limit': page_size, 'sort': sort_by, 'order': 'desc' if descending else 'asc'}
+        if cluster_filter != "Всі":
+            params['cluster'] = cluster_filter
+        if confidence_range != (0.0, 1.0):
+            params['min_confidence'], params['max_confidence'] = confidence_range
+        if len(created_range) == 2:
+            params['created_from'] = created_range[0].isoformat()
+            params['created_to'] = created_range[1].isoformat()
+        
+        # Курсори відкритих сторінок; при зміні фільтрів повертаємось на першу
+        if st.session_state.get('clients_query') != params:
+            st.session_state.clients_query = params
+            st.session_state.clients_cursors = [None]
+        cursors = st.session_state.clients_cursors
+        if cursors[-1]:
+            params = dict(params, cursor=cursors[-1])
+        
+        response = make_request('GET', '/admin/clients', params=params)
         if response and response.status_code == 200:
             data = response.json()
             
-            st.metric("Всього зареєстровано", data['total'])
-            
             if data['clients']:
                 df = pd.DataFrame(data['clients'])
                 
-                # Фільтри
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    cluster_filter = st.selectbox("Фільтр по кластеру", 
-                        ["Всі"] + list(df['cluster_name'].dropna().unique()))
-                
-                if cluster_filter != "Всі":
-                    df = df[df['cluster_name'] == cluster_filter]
-                
                 # Стилізована таблиця
                 st.dataframe(
                     df.style.background_gradient(cmap='RdPu'),
                     use_container_width=True,
                     hide_index=True
                 )
+            else:
+                st.info("Клієнтів за цими умовами не знайдено")
+            
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                if len(cursors) > 1 and st.button("⬅️ Попередня"):
+                    cursors.pop()
+                    st.rerun()
+            with col2:
+                st.caption(f"Сторінка {len(cursors)}")
+            with col3:
+                if data['next_cursor'] and st.button("Наступна ➡️"):
+                    cursors.append(data['next_cursor'])
+                    st.rerun()
+        elif response is not None:
+            st.error(response.json().get('error', 'Не вдалося отримати клієнтів'))
     
     # КЛАСТЕРИ
     elif st.session_state.get('admin_page') == 'clusters':
@@ -1026,14 +1121,126 @@ elif st.session_state.role == 'admin':
                             percentage = (cluster['count'] / sum(c['count'] for c in clusters)) * 100 if clusters else 0
                             st.metric("Відсоток", f"{percentage:.1f}%")
         
+        # Сегменти рахує колонкове сховище профілів на сервері
+        st.markdown("### 🔎 Сегменти клієнтів")
+        
+        segment_columns = {
+            'cluster_name': 'Кластер', 'age_group': 'Вік', 'income_level': 'Дохід',
+            'education': 'Освіта', 'marital_status': 'Сімейний стан', 'has_children': 'Діти',
+            'price_sensitivity': 'Чутливість до ціни', 'online_shopping': 'Онлайн покупки',
+            'brand_loyalty': 'Лояльність брендам', 'innovation': 'Інтерес до новинок',
+            'social_influence': 'Вплив рекомендацій', 'quality_importance': 'Важливість якості'
+        }
+        histogram_columns = {'cluster_confidence': 'Впевненість'}
+        histogram_columns.update(list(segment_columns.items())[6:])
+        cluster_names = ([cluster['name'] for cluster in clusters]
+                         if response and response.status_code == 200 else [])
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            group_by = st.selectbox("Групувати за", list(segment_columns),
+                                    format_func=segment_columns.get)
+            histogram = st.selectbox("Гістограма", list(histogram_columns),
+                                     format_func=histogram_columns.get)
+        with col2:
+            segment_cluster = st.selectbox("Кластер", ["Всі"] + cluster_names, key='segment_cluster')
+            segment_income = st.selectbox("Дохід", ["Всі", "low", "medium", "high", "very_high"],
+                                          key='segment_income')
+        with col3:
+            segment_confidence = st.slider("Впевненість", 0.0, 1.0, (0.0, 1.0), 0.05,
+                                           key='segment_confidence')
+            segment_created = st.date_input("Дата реєстрації", value=(), key='segment_created')
+        
+        params = {'group_by': group_by, 'histogram': histogram}
+        if segment_cluster != "Всі":
+            params['cluster'] = segment_cluster
+        if segment_income != "Всі":
+            params['income_level'] = segment_income
+        if segment_confidence != (0.0, 1.0):
+            params['min_confidence'], params['max_confidence'] = segment_confidence
+        if len(segment_created) == 2:
+            params['created_from'] = segment_created[0].isoformat()
+            params['created_to'] = segment_created[1].isoformat()
+        
+        segments_response = make_request('GET', '/admin/segments', params=params)
+        if segments_response and segments_response.status_code == 200:
+            segments = segments_response.json()
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Клієнтів у сегменті", segments['total'])
+            with col2:
+                st.metric("Пройшли опитування", segments['completed'])
+            with col3:
+                st.metric("Час запиту", f"{segments['elapsed_ms']:.1f} мс")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                groups = pd.DataFrame([
+                    {'Значення': 'Не вказано' if group['value'] is None else str(group['value']),
+                     'Клієнтів': group['count'],
+                     'Середня впевненість': group['avg_confidence']}
+                    for group in segments['groups']
+                ])
+                if not groups.empty:
+                    fig = px.bar(groups, x='Значення', y='Клієнтів', color='Середня впевненість',
+                                 color_continuous_scale=[[0, COLORS['secondary']], [1, COLORS['info']]],
+                                 title=segment_columns[group_by])
+                    fig.update_layout(
+                        height=400,
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)',
+                        font=dict(color='white')
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+            with col2:
+                bins = pd.DataFrame([
+                    {'Інтервал': f"{item['start']:g}–{item['end']:g}", 'Клієнтів': item['count']}
+                    for item in segments['histogram']['bins']
+                ])
+                fig = px.bar(bins, x='Інтервал', y='Клієнтів',
+                             color_discrete_sequence=[COLORS['accent']],
+                             title=histogram_columns[histogram])
+                fig.update_layout(
+                    height=400,
+                    plot_bgcolor='rgba(0,0,0,0)',
+                    paper_bgcolor='rgba(0,0,0,0)',
+                    font=dict(color='white')
+                )
+                st.plotly_chart(fig, use_container_width=True)
+        elif segments_response is not None:
+            st.error(segments_response.json().get('error', 'Не вдалося отримати сегменти'))
+        
         st.divider()
         
         if st.button("🔄 Перенавчити модель на Kaggle датасеті", type="primary", use_container_width=True):
-            with st.spinner("Перенавчання на 2240 записах..."):
-                response = make_request('POST', '/admin/retrain')
-                if response and response.status_code == 200:
-                    st.success("✅ Модель успішно перенавчена!")
+            response = make_request('POST', '/admin/retrain')
+            if response and response.status_code == 202:
+                job_id = response.json()['job_id']
+                progress = st.progress(0.0, text="Перенавчання на 2240 записах...")
+                
+                # Перенавчання йде у фоні, опитуємо статус задачі
+                job = {'status': 'failed', 'error': 'Немає відповіді сервера'}
+                while True:
+                    status_response = make_request('GET', f'/admin/retrain/{job_id}')
+                    if not status_response or status_response.status_code != 200:
+                        break
+                    job = status_response.json()
+                    progress.progress(job['progress'], text=f"Етап: {job['stage'] or 'очікування'}")
+                    if job['status'] in ('completed', 'failed'):
+                        break
+                    time.sleep(1)
+                
+                if job['status'] == 'completed':
+                    metrics = job['result']
+                    st.success(f"✅ Модель успішно перенавчена! Silhouette: {metrics['silhouette']:.3f}")
+                    if metrics.get('rescore_job_id'):
+                        st.info("🔁 Профілі клієнтів перераховуються новою моделлю у фоні")
                     st.balloons()
+                else:
+                    st.error(f"❌ Помилка перенавчання: {job.get('error')}")
+            elif response and response.status_code == 409:
+                st.warning("⏳ Перенавчання вже виконується")
 
 # Footer
 st.divider()
@@ -0,0 +1,165 @@
+﻿import base64
+import heapq
+import json
+from datetime import date
+
+# ================== СПИСОК КЛІЄНТІВ ДЛЯ АДМІНА ==================
+#
+# Keyset-пагінація: сторінка починається одразу після останнього рядка
+# попередньої, (ключ сортування) > (?, ...), тож кожна сторінка —
+# пошук по індексу з LIMIT незалежно від того, наскільки далеко вона від
+# початку (OFFSET перечитував би всі попередні рядки). Курсор —
+# непрозорий base64 з сортуванням та ключем останнього рядка.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Сортування: назва → стовпці ключа (останній однозначно визначає рядок).
+# Кожен ключ узятий з однієї таблиці; вона стоїть першою в CROSS JOIN
+# (SQLite не змінює такий порядок з'єднання), тож сторінку віддає індекс
+# ключа без сортування, а фільтри перевіряються по дорозі до LIMIT.
+# За впевненістю сортуються лише клієнти, що пройшли опитування.
+CLIENT_SORTS = {
+    'id': ('p.user_id',),
+    'created_at': ('u.created_at', 'u.id'),
+    'confidence': ('p.cluster_confidence', 'p.user_id')
+}
+
+# Допустимі типи значень ключа в курсорі (у порядку стовпців CLIENT_SORTS)
+CURSOR_KEY_TYPES = {
+    'id': ((int,),),
+    'created_at': ((str,), (int,)),
+    'confidence': ((int, float), (int,))
+}
+
+CLIENT_COLUMNS = ('id', 'name', 'email', 'created_at', 'cluster_name', 'cluster_confidence')
+
+
+def encode_cursor(sort, order, key):
+    data = json.dumps([sort, order, list(key)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort, order):
+    """Значення ключа сортування останнього рядка попередньої сторінки"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, cursor_order, key = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError('Некоректний курсор')
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError('Курсор належить іншому сортуванню')
+    if not isinstance(key, list) or len(key) != len(CLIENT_SORTS[sort]):
+        raise ValueError('Некоректний курсор')
+    # Інакше SQLite відхилив би параметр вже під час передачі сторінки потоком
+    for value, types in zip(key, CURSOR_KEY_TYPES[sort]):
+        if isinstance(value, bool) or not isinstance(value, types):
+            raise ValueError('Некоректний курсор')
+    return key
+
+
+def parse_date(value, name):
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f'{name} має бути датою у форматі РРРР-ММ-ДД')
+
+
+def parse_confidence(value, name):
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f'{name} має бути числом')
+    if not 0 <= value <= 1:
+        raise ValueError(f'{name} має бути від 0 до 1')
+    return value
+
+
+def clients_page_query(args):
+    """SQL сторінки клієнтів за параметрами запиту.
+
+    args — словник рядкових параметрів (request.args): limit, cursor,
+    sort, order, cluster, min_confidence, max_confidence, created_from,
+    created_to (дати включно). Повертає (sql, params, limit, sort, order);
+    sql вибирає limit + 1 рядків, зайвий рядок означає наявність наступної
+    сторінки. Некоректні параметри — ValueError з повідомленням для клієнта.
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit має бути цілим числом')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit має бути від 1 до {MAX_PAGE_SIZE}')
+
+    sort = args.get('sort', 'id')
+    if sort not in CLIENT_SORTS:
+        raise ValueError(f'sort має бути одним з: {", ".join(CLIENT_SORTS)}')
+    order = args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        raise ValueError('order має бути asc або desc')
+
+    key = CLIENT_SORTS[sort]
+    outer = key[0].split('.')[0]
+
+    def column(name):
+        # Унарний плюс не дає шукати внутрішню таблицю за індексом фільтра
+        # замість первинного ключа з'єднання
+        return name if name.startswith(outer + '.') else '+' + name
+
+    # Рядок профілю створюється при реєстрації клієнта (у адміна його немає),
+    # тому окремий фільтр за роллю не потрібен
+    conditions, params = ['u.id = p.user_id'], []
+    if args.get('cluster'):
+        conditions.append(f"{column('p.cluster_name')} = ?")
+        params.append(args['cluster'])
+    if args.get('min_confidence'):
+        conditions.append(f"{column('p.cluster_confidence')} >= ?")
+        params.append(parse_confidence(args['min_confidence'], 'min_confidence'))
+    if args.get('max_confidence'):
+        conditions.append(f"{column('p.cluster_confidence')} <= ?")
+        params.append(parse_confidence(args['max_confidence'], 'max_confidence'))
+    if args.get('created_from'):
+        conditions.append(f"{column('u.created_at')} >= ?")
+        params.append(parse_date(args['created_from'], 'created_from'))
+    if args.get('created_to'):
+        conditions.append(f"{column('u.created_at')} < date(?, '+1 day')")
+        params.append(parse_date(args['created_to'], 'created_to'))
+    if sort == 'confidence':
+        conditions.append('p.cluster_confidence IS NOT NULL')
+    if args.get('cursor'):
+        conditions.append(f"({', '.join(key)}) {'>' if order == 'asc' else '<'} "
+                          f"({', '.join('?' * len(key))})")
+        params.extend(decode_cursor(args['cursor'], sort, order))
+
+    direction = order.upper()
+    tables = ('users u CROSS JOIN client_profiles p' if outer == 'u'
+              else 'client_profiles p CROSS JOIN users u')
+    sql = f'''
+        SELECT u.id, u.name, u.email, u.created_at,
+               p.cluster_name, p.cluster_confidence
+        FROM {tables}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {', '.join(f'{column} {direction}' for column in key)}
+        LIMIT ?
+    '''
+    params.append(limit + 1)
+    return sql, params, limit, sort, order
+
+
+def sort_key(row, sort):
+    """Значення ключа сортування рядка (у порядку CLIENT_COLUMNS)"""
+    return {'id': (row[0],), 'created_at': (row[3], row[0]), 'confidence': (row[5], row[0])}[sort]
+
+
+def next_cursor(row, sort, order):
+    """Курсор сторінки, що йде після рядка row"""
+    return encode_cursor(sort, order, sort_key(row, sort))
+
+
+def merge_pages(pages, sort, order):
+    """Злиття сторінок шардів в одну (той самий запит і курсор на кожному шарді).
+
+    user_id глобально унікальний, тож ключ однозначно впорядковує рядки
+    всіх шардів, а перші limit + 1 рядків злиття — це сторінка всієї бази.
+    """
+    return heapq.merge(*pages, key=lambda row: sort_key(row, sort), reverse=order == 'desc')
@@ -0,0 +1,138 @@
+﻿import numpy as np
+from sklearn.metrics import silhouette_samples
+
+# ================== МЕТРИКИ ЯКОСТІ КЛАСТЕРИЗАЦІЇ ==================
+#
+# Повний silhouette_score квадратичний за пам'яттю та часом, тому:
+#   * silhouette рахується на стратифікованій вибірці (до sample_per_cluster
+#     точок з кожного кластера) з довірчим інтервалом стратифікованої оцінки;
+#   * Davies–Bouldin, Calinski–Harabasz та інерція по кластерах збираються
+#     потоково з сум по кластерах за один прохід по даних.
+# Davies–Bouldin рахується відносно центроїдів моделі (для збіжного KMeans
+# вони збігаються із середніми кластерів), Calinski–Harabasz — точно.
+
+Z_95 = 1.959963984540054
+
+
+class StreamingClusterStats:
+    """Потокові метрики якості для фіксованих центроїдів"""
+
+    def __init__(self, centers, sample_per_cluster=500, random_state=42):
+        self.centers = np.asarray(centers, dtype=float)
+        k, n_features = self.centers.shape
+        self.sample_per_cluster = sample_per_cluster
+        self.rng = np.random.RandomState(random_state)
+
+        self.count = np.zeros(k, dtype=np.int64)
+        self.sum = np.zeros((k, n_features))
+        self.sum_sq_norm = np.zeros(k)
+        self.sum_dist = np.zeros(k)
+        self.sum_sq_dist = np.zeros(k)
+
+        # Резервуари вибірки: точки з k найменшими випадковими ключами на кластер
+        self.sample_points = [np.empty((0, n_features)) for _ in range(k)]
+        self.sample_keys = [np.empty(0) for _ in range(k)]
+
+    def update(self, X, labels=None):
+        """Додавання частини даних (масштабовані фічі) до статистик"""
+        X = np.asarray(X, dtype=float)
+        sq_dist = ((X[:, None, :] - self.centers) ** 2).sum(axis=2)
+        if labels is None:
+            labels = sq_dist.argmin(axis=1)
+        own_sq_dist = sq_dist[np.arange(len(X)), labels]
+
+        k = len(self.centers)
+        self.count += np.bincount(labels, minlength=k)
+        np.add.at(self.sum, labels, X)
+        self.sum_sq_norm += np.bincount(labels, weights=(X * X).sum(axis=1), minlength=k)
+        self.sum_dist += np.bincount(labels, weights=np.sqrt(own_sq_dist), minlength=k)
+        self.sum_sq_dist += np.bincount(labels, weights=own_sq_dist, minlength=k)
+
+        keys = self.rng.random_sample(len(X))
+        for cluster in np.unique(labels):
+            mask = labels == cluster
+            points = np.vstack([self.sample_points[cluster], X[mask]])
+            point_keys = np.concatenate([self.sample_keys[cluster], keys[mask]])
+            keep = np.argsort(point_keys, kind='stable')[:self.sample_per_cluster]
+            self.sample_points[cluster] = points[keep]
+            self.sample_keys[cluster] = point_keys[keep]
+
+    def inertia(self):
+        """Загальна інерція та інерція по кластерах"""
+        return float(self.sum_sq_dist.sum()), self.sum_sq_dist.tolist()
+
+    def davies_bouldin(self):
+        """Індекс Davies–Bouldin (менше — краще)"""
+        present = self.count > 0
+        if present.sum() < 2:
+            return None
+        scatter = self.sum_dist[present] / self.count[present]
+        centers = self.centers[present]
+        separation = np.sqrt(((centers[:, None, :] - centers) ** 2).sum(axis=2))
+        np.fill_diagonal(separation, np.inf)
+        ratios = (scatter[:, None] + scatter) / separation
+        return float(ratios.max(axis=1).mean())
+
+    def calinski_harabasz(self):
+        """Індекс Calinski–Harabasz (більше — краще)"""
+        present = self.count > 0
+        k = int(present.sum())
+        n = int(self.count.sum())
+        if k < 2 or n <= k:
+            return None
+        counts = self.count[present]
+        means = self.sum[present] / counts[:, None]
+        overall_mean = self.sum.sum(axis=0) / n
+        between = float((counts * ((means - overall_mean) ** 2).sum(axis=1)).sum())
+        within = float((self.sum_sq_norm[present] - counts * (means ** 2).sum(axis=1)).sum())
+        if within <= 0:
+            return None
+        return between * (n - k) / (within * (k - 1))
+
+    def sampled_silhouette(self):
+        """Silhouette на стратифікованій вибірці з 95% довірчим інтервалом"""
+        present = [c for c in range(len(self.centers)) if len(self.sample_points[c])]
+        if len(present) < 2:
+            return None
+
+        X = np.vstack([self.sample_points[c] for c in present])
+        labels = np.concatenate([np.full(len(self.sample_points[c]), c) for c in present])
+        values = silhouette_samples(X, labels)
+
+        # Стратифікована оцінка: середні по кластерах, зважені часткою кластера
+        weights = self.count[present] / self.count[present].sum()
+        means = np.array([values[labels == c].mean() for c in present])
+        variances = np.array([
+            values[labels == c].var(ddof=1) / (labels == c).sum() if (labels == c).sum() > 1 else 0.0
+            for c in present
+        ])
+        estimate = float((weights * means).sum())
+        stderr = float(np.sqrt((weights ** 2 * variances).sum()))
+        return {
+            'value': estimate,
+            'ci_low': estimate - Z_95 * stderr,
+            'ci_high': estimate + Z_95 * stderr,
+            'sample_size': int(len(X))
+        }
+
+    def result(self):
+        """Всі метрики у вигляді словника для збереження з версією моделі"""
+        inertia, per_cluster = self.inertia()
+        return {
+            'n_samples': int(self.count.sum()),
+            'cluster_sizes': self.count.tolist(),
+            'inertia': inertia,
+            'cluster_inertia': per_cluster,
+            'davies_bouldin': self.davies_bouldin(),
+            'calinski_harabasz': self.calinski_harabasz(),
+            'silhouette': self.sampled_silhouette()
+        }
+
+
+def evaluate_clustering(X, centers, labels=None, sample_per_cluster=500, chunk_size=100000):
+    """Метрики якості для матриці в пам'яті (обробляється частинами)"""
+    stats = StreamingClusterStats(centers, sample_per_cluster)
+    for start in range(0, len(X), chunk_size):
+        chunk_labels = None if labels is None else labels[start:start + chunk_size]
+        stats.update(X[start:start + chunk_size], chunk_labels)
+    return stats.result()
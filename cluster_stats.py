@@ -0,0 +1,171 @@
+﻿import math
+import sys
+
+# ================== СТАТИСТИКА КЛАСТЕРІВ ==================
+#
+# Таблиця cluster_stats зберігає для кожного кластера кількість профілів,
+# суму та суму квадратів впевненості, тож статистика кластерів — читання
+# кількох рядків замість GROUP BY по всіх профілях. Кожен, хто змінює
+# кластер профілю, оновлює її в тій самій транзакції через
+# update_cluster_stats: збереження анкети додає один профіль, перерахунок —
+# зведені зміни порції (кілька рядків на порцію з десятків тисяч профілів;
+# тригер на кожен рядок подвоював би час перерахунку). Профілі з
+# кластером, але без впевненості, додають 0 до сум. Похибку округлення
+# сум після багатьох змін та записи в обхід update_cluster_stats
+# виправляє перевірка / перебудова з нуля:
+#
+#   python cluster_stats.py [verify|rebuild]
+#
+# (з SHARD_COUNT > 1 — для кожного шарда: таблиця своя в кожному файлі)
+
+# Відносна похибка сум, яку перевірка вважає збігом
+STATS_TOLERANCE = 1e-6
+
+
+def init_cluster_stats(cursor):
+    """Створення таблиці статистики кластерів"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cluster_stats (
+            cluster_name TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            confidence_sum REAL NOT NULL DEFAULT 0,
+            confidence_sq_sum REAL NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def update_cluster_stats(conn, added=(), removed=()):
+    """Облік змін кластерів у поточній транзакції conn.
+
+    added / removed — пари (назва кластера, впевненість) профілів, що
+    потрапили в кластер або вийшли з нього; профілі без кластера (None)
+    пропускаються. Зміни зводяться по кластерах перед записом.
+    """
+    deltas = {}
+    for sign, pairs in ((1, added), (-1, removed)):
+        for name, confidence in pairs:
+            if name is None:
+                continue
+            confidence = confidence or 0.0
+            count, total, sq_total = deltas.get(name, (0, 0.0, 0.0))
+            deltas[name] = (count + sign, total + sign * confidence,
+                            sq_total + sign * confidence * confidence)
+    conn.executemany('''
+        INSERT INTO cluster_stats (cluster_name, count, confidence_sum, confidence_sq_sum)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(cluster_name) DO UPDATE SET
+            count = count + excluded.count,
+            confidence_sum = confidence_sum + excluded.confidence_sum,
+            confidence_sq_sum = confidence_sq_sum + excluded.confidence_sq_sum,
+            updated_at = CURRENT_TIMESTAMP
+    ''', [(name,) + delta for name, delta in deltas.items() if delta != (0, 0.0, 0.0)])
+
+
+# Статистика, порахована з нуля по client_profiles
+_RECOMPUTE_SQL = '''
+    SELECT cluster_name, COUNT(*), TOTAL(cluster_confidence),
+           TOTAL(cluster_confidence * cluster_confidence)
+    FROM client_profiles
+    WHERE cluster_name IS NOT NULL
+    GROUP BY cluster_name
+'''
+
+
+def rebuild_cluster_stats(cursor):
+    """Заповнення таблиці з нуля (у поточній транзакції)"""
+    cursor.execute('DELETE FROM cluster_stats')
+    cursor.execute(f'''
+        INSERT INTO cluster_stats (cluster_name, count, confidence_sum, confidence_sq_sum)
+        {_RECOMPUTE_SQL}
+    ''')
+
+
+# Суми непорожніх кластерів (план перевіряє migrations.py)
+CLUSTER_TOTALS_SQL = '''
+    SELECT cluster_name, count, confidence_sum, confidence_sq_sum
+    FROM cluster_stats
+    WHERE count > 0
+'''
+
+
+def read_cluster_totals(conn):
+    """Суми непорожніх кластерів: {назва: (count, confidence_sum, confidence_sq_sum)}"""
+    return {row[0]: row[1:] for row in conn.execute(CLUSTER_TOTALS_SQL)}
+
+
+def summarize_cluster_totals(shard_totals):
+    """Статистика кластерів з сум одного або кількох шардів (суми просто додаються)"""
+    merged = {}
+    for totals in shard_totals:
+        for name, values in totals.items():
+            merged[name] = [a + b for a, b in zip(merged.get(name, (0, 0.0, 0.0)), values)]
+
+    clusters = []
+    for name in sorted(merged):
+        count, total, sq_total = merged[name]
+        mean = total / count
+        clusters.append({
+            'name': name,
+            'count': count,
+            'avg_confidence': mean,
+            'std_confidence': math.sqrt(max(sq_total / count - mean * mean, 0.0))
+        })
+    return clusters
+
+
+def read_cluster_stats(conn):
+    """Статистика непорожніх кластерів: [{name, count, avg_confidence, std_confidence}]"""
+    return summarize_cluster_totals([read_cluster_totals(conn)])
+
+
+def verify_cluster_stats(conn, tolerance=STATS_TOLERANCE):
+    """Розбіжності таблиці зі статистикою з нуля: [(кластер, збережено, очікується)]"""
+    stored = {row[0]: row[1:] for row in conn.execute('''
+        SELECT cluster_name, count, confidence_sum, confidence_sq_sum
+        FROM cluster_stats
+        WHERE count != 0 OR confidence_sum != 0
+    ''')}
+    expected = {row[0]: row[1:] for row in conn.execute(_RECOMPUTE_SQL)}
+
+    mismatches = []
+    for name in sorted(stored.keys() | expected.keys()):
+        have = stored.get(name, (0, 0.0, 0.0))
+        want = expected.get(name, (0, 0.0, 0.0))
+        if have[0] != want[0] or not all(
+            math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance)
+            for a, b in zip(have[1:], want[1:])
+        ):
+            mismatches.append((name, have, want))
+    return mismatches
+
+
+if __name__ == '__main__':
+    from db import connect
+    from sharding import shard_paths
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    if command not in ('verify', 'rebuild'):
+        sys.exit('Використання: python cluster_stats.py [verify|rebuild]')
+
+    total = 0
+    for db_path in shard_paths():
+        conn = connect(db_path)
+        try:
+            # Записи блокуються на час перевірки, тож профілі та статистика узгоджені
+            conn.execute('BEGIN IMMEDIATE')
+            mismatches = verify_cluster_stats(conn)
+            for name, have, want in mismatches:
+                print(f"❌ {db_path}: {name}: збережено {have}, очікується {want}")
+            if command == 'rebuild':
+                rebuild_cluster_stats(conn.cursor())
+                print(f"✅ {db_path}: статистику кластерів перебудовано "
+                      f"({len(mismatches)} розбіжностей виправлено)")
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        total += len(mismatches)
+
+    if command == 'verify':
+        print(f"{'❌' if total else '✅'} Розбіжностей: {total}")
+        sys.exit(1 if total else 0)
@@ -0,0 +1,568 @@
+﻿import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from operator import itemgetter
+
+import numpy as np
+
+from client_listing import parse_confidence, parse_date
+
+# ================== КОЛОНКОВЕ СХОВИЩЕ ПРОФІЛІВ ==================
+#
+# Профілі всіх клієнтів у пам'яті процесу як масиви NumPy по стовпцях:
+# текстові стовпці закодовані словниками в int16 (-1 — NULL), шкали
+# анкети — int8 (-1 — немає відповіді), впевненість — float32 (NaN).
+# Групування, гістограми та фільтри адмін-панелі — це маски та
+# np.bincount над масивами замість GROUP BY по таблиці: мілісекунди на
+# мільйонах профілів.
+#
+# Сховище завантажується з шардів при першому запиті, а далі
+# оновлюється тими ж шляхами, що пишуть у БД: реєстрація, анкета та
+# перерахунок профілів. Записи інших процесів (воркерів) підхоплює
+# періодичне перезавантаження у фоні раз на COLUMNAR_RELOAD_INTERVAL
+# секунд. Оновлення, що прийшли під час завантаження, повторюються над
+# новим станом (усі вони ідемпотентні).
+
+# Період фонового перезавантаження з БД, секунд (0 — лише при старті)
+COLUMNAR_RELOAD_INTERVAL = float(os.environ.get('COLUMNAR_RELOAD_INTERVAL', '300'))
+
+# Рядків профілів на один запит при завантаженні
+LOAD_CHUNK_SIZE = 50000
+
+# Текстові стовпці (кодуються словником)
+CATEGORICAL_COLUMNS = ('cluster_name', 'age_group', 'income_level', 'education', 'marital_status')
+
+# Шкали анкети (1–10) та наявність дітей (0/1)
+SCALE_COLUMNS = ('price_sensitivity', 'online_shopping', 'brand_loyalty',
+                 'innovation', 'social_influence', 'quality_importance')
+SMALL_INT_COLUMNS = ('has_children',) + SCALE_COLUMNS
+
+# Стовпці, за якими можна групувати, та діапазони гістограм
+GROUP_COLUMNS = CATEGORICAL_COLUMNS + SMALL_INT_COLUMNS
+HISTOGRAM_RANGES = {'cluster_confidence': (0.0, 1.0),
+                    **{column: (1, 11) for column in SCALE_COLUMNS}}
+DEFAULT_HISTOGRAM_BINS = 10
+MAX_HISTOGRAM_BINS = 100
+
+# Фільтри, що лишають меншу частку рядків, вибирають рядки за номерами
+GATHER_FRACTION = 0.6
+
+# Числові стовпці без NULL (див. _small_int), щоб читатися np.fromiter:
+# -1 — немає відповіді, впевненість -1 стає NaN
+_SMALL_INT_SQL = '''CASE WHEN p.{0} BETWEEN 0 AND 127 AND p.{0} = CAST(p.{0} AS INTEGER)
+                        THEN p.{0} ELSE -1 END'''
+
+_LOAD_QUERY = f'''
+    SELECT u.id, IFNULL(CAST(strftime('%s', u.created_at) AS INTEGER), 0),
+           {', '.join('p.' + column for column in CATEGORICAL_COLUMNS)},
+           {', '.join(_SMALL_INT_SQL.format(column) for column in SMALL_INT_COLUMNS)},
+           IFNULL(p.cluster_confidence, -1.0)
+    FROM users u
+    LEFT JOIN client_profiles p ON p.user_id = u.id
+    WHERE u.role = 'client' AND u.id > ?
+    ORDER BY u.id
+    LIMIT ?
+'''
+
+
+def _small_int(value):
+    """Відповідь шкали як int8: ціле 0–127, інакше -1 (немає або некоректна)"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return -1
+    return value if 0 <= value <= 127 else -1
+
+
+def _epoch(day):
+    """Початок дня (UTC) у секундах, як strftime('%s') у SQLite"""
+    return int(datetime.combine(date.fromisoformat(day), datetime.min.time(),
+                                timezone.utc).timestamp())
+
+
+def segment_filters(args):
+    """Фільтри профілів з параметрів запиту: [(стовпець, операція, значення)].
+
+    cluster або будь-який текстовий стовпець — рівність, has_children (0/1),
+    min_confidence / max_confidence, created_from / created_to (РРРР-ММ-ДД,
+    обидві межі включно). ValueError при некоректному значенні.
+    """
+    filters = []
+    if args.get('cluster'):
+        filters.append(('cluster_name', '==', args['cluster']))
+    for column in CATEGORICAL_COLUMNS[1:]:
+        if args.get(column):
+            filters.append((column, '==', args[column]))
+    if args.get('has_children'):
+        if args['has_children'] not in ('0', '1'):
+            raise ValueError('has_children має бути 0 або 1')
+        filters.append(('has_children', '==', int(args['has_children'])))
+    if args.get('min_confidence'):
+        filters.append(('cluster_confidence', '>=',
+                        parse_confidence(args['min_confidence'], 'min_confidence')))
+    if args.get('max_confidence'):
+        filters.append(('cluster_confidence', '<=',
+                        parse_confidence(args['max_confidence'], 'max_confidence')))
+    if args.get('created_from'):
+        created_from = parse_date(args['created_from'], 'created_from')
+        filters.append(('created_at', '>=', _epoch(created_from)))
+    if args.get('created_to'):
+        created_to = parse_date(args['created_to'], 'created_to')
+        filters.append(('created_at', '<', _epoch(created_to) + 86400))
+    return filters
+
+
+def segment_params(args):
+    """Параметри /api/admin/segments: (group_by, histogram, bins, filters)"""
+    group_by = args.get('group_by', 'cluster_name')
+    if group_by not in GROUP_COLUMNS:
+        raise ValueError(f"group_by має бути одним з: {', '.join(GROUP_COLUMNS)}")
+    histogram = args.get('histogram') or None
+    if histogram is not None and histogram not in HISTOGRAM_RANGES:
+        raise ValueError(f"histogram має бути одним з: {', '.join(HISTOGRAM_RANGES)}")
+    try:
+        bins = int(args.get('bins', DEFAULT_HISTOGRAM_BINS))
+    except ValueError:
+        raise ValueError('bins має бути цілим числом')
+    if not 1 <= bins <= MAX_HISTOGRAM_BINS:
+        raise ValueError(f'bins має бути від 1 до {MAX_HISTOGRAM_BINS}')
+    return group_by, histogram, bins, segment_filters(args)
+
+
+class _Dictionary:
+    """Словник текстового стовпця: значення ↔ код int16 (NULL — -1)"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            if len(self.values) > np.iinfo(np.int16).max:
+                raise OverflowError('Забагато різних значень текстового стовпця')
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode_many(self, values):
+        for value in sorted(set(values) - self.codes.keys() - {None}):
+            self.encode(value)
+        lookup = dict(self.codes)
+        lookup[None] = -1
+        return np.fromiter(map(lookup.__getitem__, values), dtype=np.int16, count=len(values))
+
+
+_DTYPES = {'user_id': np.int64, 'created_at': np.int64, 'cluster_confidence': np.float32,
+           **{column: np.int16 for column in CATEGORICAL_COLUMNS},
+           **{column: np.int8 for column in SMALL_INT_COLUMNS}}
+
+
+def _empty_arrays(capacity):
+    arrays = {column: np.full(capacity, -1, dtype=dtype) for column, dtype in _DTYPES.items()}
+    arrays['user_id'][:] = 0
+    arrays['created_at'][:] = 0
+    arrays['cluster_confidence'][:] = np.nan
+    return arrays
+
+
+class _Columns:
+    """Масиви стовпців (впорядковані за user_id) та словники.
+
+    Масиви мають запас місця; заповнені перші size рядків. Масиви лише
+    замінюються більшими (до збільшення size), тож читач, що взяв size, а
+    потім arrays, завжди має щонайменше size рядків.
+    """
+
+    def __init__(self, arrays, size, dictionaries):
+        self.arrays = arrays
+        self.size = size
+        self.dictionaries = dictionaries
+
+    @classmethod
+    def from_rows(cls, rows, dictionaries):
+        """Стовпці порції рядків _LOAD_QUERY (коди текстових стовпців — зі словників)"""
+        size = len(rows)
+        names = ('user_id', 'created_at') + CATEGORICAL_COLUMNS + SMALL_INT_COLUMNS
+        # Стовпці читаються з рядків по одному, без транспонування всієї порції
+        arrays = {}
+        for index, column in enumerate(names):
+            values = map(itemgetter(index), rows)
+            if column in CATEGORICAL_COLUMNS:
+                arrays[column] = dictionaries[column].encode_many(list(values))
+            else:
+                arrays[column] = np.fromiter(values, dtype=_DTYPES[column], count=size)
+        confidence = np.fromiter(map(itemgetter(len(names)), rows), dtype=np.float32, count=size)
+        confidence[confidence < 0] = np.nan
+        arrays['cluster_confidence'] = confidence
+        return cls(arrays, size, dictionaries)
+
+    @classmethod
+    def concat(cls, parts):
+        """Об'єднання частин (порцій, шардів) з перекодуванням у спільні словники.
+
+        Рядки впорядковуються за user_id: шарди віддають їх окремо.
+        """
+        dictionaries = {column: _Dictionary() for column in CATEGORICAL_COLUMNS}
+        columns = {column: [] for column in _DTYPES}
+        for part in parts:
+            for column, values in part.arrays.items():
+                values = values[:part.size]
+                if column in CATEGORICAL_COLUMNS:
+                    # Код частини → спільний код; останній елемент — для NULL (-1)
+                    remap = np.array([dictionaries[column].encode(value)
+                                      for value in part.dictionaries[column].values] + [-1],
+                                     dtype=np.int16)
+                    values = remap[values]
+                columns[column].append(values)
+        arrays = {column: np.concatenate(values) if values else np.empty(0, dtype=_DTYPES[column])
+                  for column, values in columns.items()}
+        if len(arrays['user_id']) and (np.diff(arrays['user_id']) < 0).any():
+            order = np.argsort(arrays['user_id'], kind='stable')
+            arrays = {column: values[order] for column, values in arrays.items()}
+        return cls(arrays, len(arrays['user_id']), dictionaries)
+
+    def position(self, user_id):
+        """Рядок користувача або None"""
+        user_ids = self.arrays['user_id'][:self.size]
+        row = int(np.searchsorted(user_ids, user_id))
+        return row if row < self.size and user_ids[row] == user_id else None
+
+    def insert(self, user_id, created_at):
+        """Рядок нового користувача (у кінець, якщо id більший за всі наявні)"""
+        size = self.size
+        row = int(np.searchsorted(self.arrays['user_id'][:size], user_id))
+        capacity = len(self.arrays['user_id'])
+        if row == size and size < capacity:
+            arrays = self.arrays
+        else:
+            # Новий масив: запас удвічі або вставка посередині (id з іншого воркера)
+            arrays = _empty_arrays(max(capacity * 2, 1024) if size == capacity else capacity)
+            for column, values in self.arrays.items():
+                arrays[column][:row] = values[:row]
+                arrays[column][row + 1:size + 1] = values[row:size]
+            arrays['cluster_confidence'][row] = np.nan
+            for column in CATEGORICAL_COLUMNS + SMALL_INT_COLUMNS:
+                arrays[column][row] = -1
+        arrays['user_id'][row] = user_id
+        arrays['created_at'][row] = created_at
+        self.arrays = arrays
+        self.size = size + 1
+        return row
+
+
+class ColumnarProfileStore:
+    """Колонкове сховище профілів клієнтів для агрегатів адмін-панелі.
+
+    storage — ShardedStorage (див. sharding.py); профілі читаються з пулів
+    шардів. Читання працюють без блокування над поточним станом; записи
+    (add_client, update_profile, update_clusters) і заміна стану після
+    перезавантаження серіалізуються блокуванням.
+    """
+
+    def __init__(self, storage, reload_interval=COLUMNAR_RELOAD_INTERVAL,
+                 chunk_size=LOAD_CHUNK_SIZE):
+        self.storage = storage
+        self.reload_interval = reload_interval
+        self.chunk_size = chunk_size
+        self._state = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._replay = None
+        self._reloading = False
+        self._loaded_at = None
+        self.stats = {'loads': 0, 'load_ms': 0.0, 'updates': 0, 'last_error': None}
+
+    # ---------- завантаження ----------
+
+    def ensure_loaded(self):
+        """Перше завантаження (синхронно) або перезавантаження у фоні, якщо час"""
+        if self._state is None:
+            with self._load_lock:
+                if self._state is None:
+                    self._load()
+            return
+        if (self.reload_interval > 0 and not self._reloading
+                and time.monotonic() - self._loaded_at >= self.reload_interval):
+            with self._lock:
+                if self._reloading:
+                    return
+                self._reloading = True
+            threading.Thread(target=self._reload, name='columnar-reload', daemon=True).start()
+
+    def reload(self):
+        """Повне перечитування профілів з БД"""
+        with self._load_lock:
+            self._load()
+
+    def _reload(self):
+        try:
+            self.reload()
+        except Exception as e:
+            self.stats['last_error'] = str(e)
+            print(f"❌ Не вдалося перезавантажити колонкове сховище: {e}")
+        finally:
+            self._reloading = False
+
+    def _load(self):
+        start = time.perf_counter()
+        with self._lock:
+            self._replay = []
+        try:
+            state = _Columns.concat(
+                self.storage.fan_out(lambda conn, shard: self._read_shard(conn))
+            )
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            # Оновлення, що прийшли під час читання
+            for apply, args in self._replay:
+                apply(state, *args)
+            self._replay = None
+            self._state = state
+            self._loaded_at = time.monotonic()
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stats['loads'] += 1
+        self.stats['load_ms'] = elapsed
+        self.stats['last_error'] = None
+        print(f"✅ Колонкове сховище профілів: {state.size} клієнтів за {elapsed:.0f} мс")
+
+    def _read_shard(self, conn):
+        """Стовпці профілів шарда; кожна порція одразу перетворюється в масиви"""
+        dictionaries = {column: _Dictionary() for column in CATEGORICAL_COLUMNS}
+        parts = []
+        last_id = 0
+        while True:
+            rows = conn.execute(_LOAD_QUERY, (last_id, self.chunk_size)).fetchall()
+            if rows:
+                parts.append(_Columns.from_rows(rows, dictionaries))
+            if len(rows) < self.chunk_size:
+                return _Columns.concat(parts)
+            last_id = rows[-1][0]
+
+    # ---------- оновлення з шляхів запису ----------
+
+    def _apply(self, apply, *args):
+        """Оновлення поточного стану (і того, що зараз завантажується)"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((apply, args))
+            if self._state is not None:
+                apply(self._state, *args)
+                self.stats['updates'] += 1
+
+    def add_client(self, user_id, created_at=None):
+        """Щойно зареєстрований клієнт (ще без анкети)"""
+        created_at = int(time.time() if created_at is None else created_at)
+        self._apply(self._add_client, user_id, created_at)
+
+    def update_profile(self, user_id, data, cluster_result):
+        """Збережена анкета та її кластер (ті самі значення, що записуються в БД)"""
+        self._apply(self._update_profile, user_id, dict(data), dict(cluster_result))
+
+    def update_clusters(self, user_ids, names, confidences):
+        """Нові кластери порції профілів після перерахунку"""
+        self._apply(self._update_clusters, np.asarray(user_ids, dtype=np.int64),
+                    list(names), np.asarray(confidences, dtype=np.float32))
+
+    @staticmethod
+    def _add_client(state, user_id, created_at):
+        if state.position(user_id) is None:
+            state.insert(user_id, created_at)
+
+    @staticmethod
+    def _update_profile(state, user_id, data, cluster_result):
+        row = state.position(user_id)
+        if row is None:
+            # Клієнт, зареєстрований іншим воркером
+            row = state.insert(user_id, int(time.time()))
+        arrays = state.arrays
+        for column in CATEGORICAL_COLUMNS[1:]:
+            arrays[column][row] = state.dictionaries[column].encode(data.get(column))
+        arrays['has_children'][row] = 1 if data.get('has_children') else 0
+        for column in SCALE_COLUMNS:
+            arrays[column][row] = _small_int(data.get(column))
+        arrays['cluster_name'][row] = state.dictionaries['cluster_name'].encode(
+            cluster_result['cluster_name'])
+        arrays['cluster_confidence'][row] = cluster_result['confidence']
+
+    @staticmethod
+    def _update_clusters(state, user_ids, names, confidences):
+        if not state.size:
+            return
+        stored = state.arrays['user_id'][:state.size]
+        rows = np.searchsorted(stored, user_ids).clip(max=state.size - 1)
+        found = stored[rows] == user_ids
+        codes = state.dictionaries['cluster_name'].encode_many(names)
+        state.arrays['cluster_name'][rows[found]] = codes[found]
+        state.arrays['cluster_confidence'][rows[found]] = confidences[found]
+
+    # ---------- запити ----------
+
+    def _view(self):
+        self.ensure_loaded()
+        state = self._state
+        size = state.size
+        return state, size, state.arrays
+
+    @staticmethod
+    def _mask(state, size, arrays, filters):
+        """Булева маска рядків, що пройшли фільтри (None — фільтрів немає)"""
+        mask = None
+        for column, op, value in filters:
+            values = arrays[column][:size]
+            if column in CATEGORICAL_COLUMNS:
+                code = state.dictionaries[column].codes.get(value)
+                if code is None:
+                    return np.zeros(size, dtype=bool)
+                matches = values == code
+            elif op == '==':
+                matches = values == value
+            elif op == '>=':
+                matches = values >= value
+            elif op == '<=':
+                matches = values <= value
+            elif op == '<':
+                matches = values < value
+            else:
+                raise ValueError(f'Невідома операція фільтра: {op}')
+            mask = matches if mask is None else np.logical_and(mask, matches, out=mask)
+        return mask
+
+    def segments(self, group_by='cluster_name', filters=(), histogram=None,
+                 bins=DEFAULT_HISTOGRAM_BINS, std=False):
+        """Кількість та впевненість профілів, що пройшли фільтри, по групах group_by;
+        гістограма стовпця histogram за тими ж фільтрами.
+
+        Якщо фільтри лишають меншу за GATHER_FRACTION частку рядків, вони
+        вибираються за номерами; інакше відфільтровані рядки отримують ключ 0
+        і відкидаються після np.bincount (вибірка майже всіх рядків повільніша).
+        std — рахувати також стандартне відхилення впевненості.
+        """
+        start = time.perf_counter()
+        state, size, arrays = self._view()
+        mask = self._mask(state, size, arrays, filters)
+
+        def column(name):
+            return arrays[name][:size] if rows is None else arrays[name][rows]
+
+        rows = None
+        if mask is not None and np.count_nonzero(mask) < GATHER_FRACTION * size:
+            rows, mask = np.flatnonzero(mask), None
+
+        # Ключ групи: 0 — відфільтровано, 1 — NULL / немає відповіді, далі код + 2
+        confidence = column('cluster_confidence')
+        keys = column(group_by).astype(np.intp)
+        keys += 2
+        if mask is not None:
+            keys *= mask
+        counts = np.bincount(keys)
+        length = len(counts)
+        weights = np.fmax(confidence, 0.0, dtype=np.float64)
+        sums = np.bincount(keys, weights=weights, minlength=length)
+        if std:
+            weights *= weights
+            sq_sums = np.bincount(keys, weights=weights, minlength=length)
+        # Анкета заповнює стовпці профілю разом з кластером і впевненістю,
+        # тож профілі без впевненості є лише в групі NULL
+        scored = confidence == confidence
+        if mask is not None:
+            scored &= mask
+        completed = int(np.count_nonzero(scored))
+        scored_counts = counts.copy()
+        if length > 1:
+            scored_counts[1] = completed - counts[2:].sum()
+
+        if group_by in CATEGORICAL_COLUMNS:
+            # Словник читається після підрахунку: нові коди лише додаються
+            values = [None, None] + state.dictionaries[group_by].values
+        else:
+            values = [None, None] + list(range(length - 2))
+        groups = []
+        for key in np.flatnonzero(counts[1:]).tolist():
+            key += 1
+            scored = int(scored_counts[key])
+            group = {'value': values[key], 'count': int(counts[key]),
+                     'avg_confidence': float(sums[key] / scored) if scored else None}
+            if std:
+                group['std_confidence'] = (
+                    float(np.sqrt(max(sq_sums[key] / scored - group['avg_confidence'] ** 2, 0.0)))
+                    if scored else None
+                )
+            groups.append(group)
+        groups.sort(key=lambda group: (group['value'] is None, group['value']))
+
+        result = {
+            'total': int(counts[1:].sum()),
+            'completed': completed,
+            'group_by': group_by,
+            'groups': groups,
+            'histogram': None
+        }
+        if histogram is not None:
+            result['histogram'] = {
+                'column': histogram,
+                'bins': self._histogram(column(histogram), mask, histogram, bins)
+            }
+        result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+        return result
+
+    @staticmethod
+    def _histogram(values, mask, column, bins):
+        """Рівні інтервали HISTOGRAM_RANGES[column]; пропущені значення не рахуються"""
+        low, high = HISTOGRAM_RANGES[column]
+        edges = np.linspace(low, high, bins + 1)
+        if values.dtype.kind == 'i':
+            # Лічильники по значеннях шкали (ключ 0 — немає відповіді або
+            # відфільтровано), потім розкладаються по інтервалах
+            keys = values.astype(np.intp)
+            keys += 1
+            if mask is not None:
+                keys *= mask
+            tallies = np.bincount(keys)[1:]
+            present = np.arange(len(tallies))
+            inside = (present >= low) & (present <= high)
+            index = np.minimum(np.searchsorted(edges, present[inside], side='right') - 1, bins - 1)
+            counts = np.bincount(index, weights=tallies[inside], minlength=bins)
+        else:
+            # Номер інтервалу + 1; NaN стає -1 → 0 і не рахується
+            index = np.subtract(values, np.float32(low))
+            index *= np.float32(bins / (high - low))
+            np.fmax(index, np.float32(-1), out=index)
+            np.minimum(index, np.float32(bins - 1), out=index)
+            index += np.float32(1)
+            keys = index.astype(np.intp)
+            if mask is not None:
+                keys *= mask
+            counts = np.bincount(keys, minlength=bins + 1)[1:]
+        return [{'start': float(edges[i]), 'end': float(edges[i + 1]), 'count': int(count)}
+                for i, count in enumerate(counts.tolist())]
+
+    def cluster_stats(self, filters=()):
+        """Статистика кластерів за фільтрами у форматі read_cluster_stats"""
+        return [{'name': group['value'], 'count': group['count'],
+                 'avg_confidence': group['avg_confidence'],
+                 'std_confidence': group['std_confidence']}
+                for group in self.segments('cluster_name', filters, std=True)['groups']
+                if group['value'] is not None and group['avg_confidence'] is not None]
+
+    def info(self):
+        """Розмір та стан сховища для адмін-панелі"""
+        state = self._state
+        info = dict(self.stats)
+        info.update(
+            loaded=state is not None,
+            rows=state.size if state is not None else 0,
+            memory_bytes=(sum(values.nbytes for values in state.arrays.values())
+                          if state is not None else 0),
+            age_seconds=(time.monotonic() - self._loaded_at
+                         if self._loaded_at is not None else None),
+            reload_interval=self.reload_interval,
+            reloading=self._reloading
+        )
+        return info
@@ -0,0 +1,237 @@
+﻿import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+# ================== ПУЛ З'ЄДНАНЬ SQLITE ==================
+#
+# Замість sqlite3.connect на кожен запит обробники беруть з'єднання з
+# пулу. З'єднання живуть довго, тож схема БД, кеш сторінок та кеш
+# підготовлених запитів (cached_statements модуля sqlite3) переживають
+# запит. Кожне нове з'єднання налаштовується:
+#   journal_mode=WAL     — читачі не блокують запис і навпаки;
+#   synchronous=NORMAL   — у WAL безпечно щодо цілісності, fsync лише на checkpoint;
+#   cache_size, mmap_size — кеш сторінок та читання файлу через mmap;
+#   temp_store=MEMORY    — тимчасові таблиці сортувань у пам'яті.
+
+DB_PATH = os.environ.get('DB_PATH', 'profiling.db')
+
+# Розмір пулу (0 — без пулу: нове нетюноване з'єднання на кожен запит, як раніше)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+
+# Скільки секунд запит чекає на вільне з'єднання
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# Скільки секунд з'єднання чекає на блокування запису
+DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 30))
+
+DB_CACHE_SIZE_MB = int(os.environ.get('DB_CACHE_SIZE_MB', 64))
+DB_MMAP_SIZE_MB = int(os.environ.get('DB_MMAP_SIZE_MB', 256))
+
+# Кількість підготовлених запитів, що кешуються на з'єднання
+DB_STATEMENT_CACHE = 256
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Усі з'єднання пулу зайняті довше за DB_POOL_TIMEOUT"""
+
+
+def connect(path=DB_PATH, readonly=False):
+    """Нове налаштоване з'єднання (для пулу та фонових задач).
+
+    readonly=True відкриває файл лише для читання (mode=ro, query_only)
+    і не змінює його режим журналу.
+    """
+    if readonly:
+        conn = sqlite3.connect(
+            f'file:{quote(os.path.abspath(path))}?mode=ro', uri=True,
+            timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.execute('PRAGMA query_only=ON')
+    else:
+        conn = sqlite3.connect(
+            path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_MB * 1024}')
+    conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE_MB * 1024 * 1024}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+class PooledConnection:
+    """Обгортка з'єднання з пулу: close() повертає його в пул, а не закриває"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+
+class ConnectionPool:
+    """Пул довгоживучих з'єднань SQLite, безпечний для потоків"""
+
+    def __init__(self, path=DB_PATH, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, readonly=False):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._closed = False
+        self._reset()
+        self._stats = {
+            'acquired': 0,
+            'waits': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0,
+            'timeouts': 0,
+            'discarded': 0
+        }
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._in_use = 0
+
+    def _check_fork(self):
+        """Після fork з'єднання батьківського процесу не використовуються (і не закриваються)"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._orphaned = self._idle
+                    self._reset()
+
+    def acquire(self):
+        """З'єднання з пулу (обгортка, close() якої повертає його назад)"""
+        self._check_fork()
+        if self.size <= 0:
+            with self._lock:
+                self._stats['acquired'] += 1
+            return connect(self.path, True) if self.readonly else sqlite3.connect(self.path)
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._create_or_wait()
+        with self._lock:
+            self._in_use += 1
+            self._stats['acquired'] += 1
+        return PooledConnection(self, conn)
+
+    def _create_or_wait(self):
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return connect(self.path, self.readonly)
+            except sqlite3.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f"Немає вільних з'єднань з БД за {self.timeout} с")
+        waited = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats['waits'] += 1
+            self._stats['wait_ms_total'] += waited
+            self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], waited)
+        return conn
+
+    def release(self, conn):
+        """Повернення з'єднання; незавершена транзакція відкочується, як при close()"""
+        with self._lock:
+            self._in_use -= 1
+            closed = self._closed
+        if closed:
+            # Пул закрито, поки з'єднання було в роботі
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Зламане з'єднання не повертається в пул
+            with self._lock:
+                self._created -= 1
+                self._stats['discarded'] += 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ... — з'єднання повертається автоматично"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def health(self):
+        """Стан пулу та перевірка з'єднання з БД"""
+        self._check_fork()
+        with self._lock:
+            info = dict(self._stats)
+            info.update(
+                path=self.path,
+                size=self.size,
+                created=self._created,
+                in_use=self._in_use,
+                idle=self._idle.qsize()
+            )
+        start = time.perf_counter()
+        conn = self.acquire()
+        try:
+            conn.execute('SELECT 1').fetchone()
+            info['journal_mode'] = conn.execute('PRAGMA journal_mode').fetchone()[0]
+            info['ping_ms'] = (time.perf_counter() - start) * 1000
+            info['ok'] = True
+        except sqlite3.Error as e:
+            info['ok'] = False
+            info['error'] = str(e)
+        finally:
+            conn.close()
+        return info
+
+    def close_all(self):
+        """Закриття пулу (наприклад, при зупинці): вільні з'єднання закриваються
+        одразу, зайняті — при поверненні"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._created -= 1
+            conn.close()
@@ -0,0 +1,141 @@
+﻿import numpy as np
+
+from inference import FEATURE_NAMES
+
+# ================== СХОВИЩЕ ФІЧ КЛІЄНТІВ ==================
+#
+# Таблиця client_features зберігає для кожного клієнта, що пройшов
+# опитування, вектор 7 фіч моделі (raw) та його масштабовану версію
+# (scaled) як BLOB з little-endian float32 (28 байт на вектор). Порція
+# рядків перетворюється на матрицю одним np.frombuffer над склеєними
+# BLOB, без обчислення фіч з відповідей анкети. Рядки пишуться при
+# збереженні анкети; scaled та model_version оновлює перерахунок профілів
+# після перенавчання.
+
+FEATURE_DTYPE = np.dtype('<f4')
+N_FEATURES = len(FEATURE_NAMES)
+VECTOR_SIZE = N_FEATURES * FEATURE_DTYPE.itemsize
+
+# Кількість рядків, що читаються або пишуться за один запит
+FEATURE_CHUNK_SIZE = 20000
+
+
+def init_feature_store(cursor):
+    """Створення таблиці сховища фіч"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS client_features (
+            user_id INTEGER PRIMARY KEY,
+            raw BLOB NOT NULL,
+            scaled BLOB NOT NULL,
+            model_version TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+
+def to_blobs(matrix):
+    """Рядки матриці фіч (n × 7) як BLOB float32"""
+    data = np.ascontiguousarray(matrix, dtype=FEATURE_DTYPE).tobytes()
+    return [data[start:start + VECTOR_SIZE] for start in range(0, len(data), VECTOR_SIZE)]
+
+
+def from_blobs(blobs):
+    """Матриця фіч (n × 7, float32) з BLOB одним np.frombuffer"""
+    return np.frombuffer(b''.join(blobs), dtype=FEATURE_DTYPE).reshape(-1, N_FEATURES)
+
+
+def scale_features(model, raw):
+    """Фічі в масштабованому просторі моделі (StandardScaler.transform)"""
+    return (np.asarray(raw, dtype=float) - model.mean) / model.scale
+
+
+def write_features(conn, user_ids, raw, model, model_version):
+    """Запис (або заміна) векторів клієнтів у поточній транзакції conn.
+
+    scaled рахується скейлером model; model_version — версія, якою
+    оцінено профілі (None — ще не оцінені, їх підхопить перерахунок).
+    """
+    conn.executemany('''
+        INSERT OR REPLACE INTO client_features (user_id, raw, scaled, model_version)
+        VALUES (?, ?, ?, ?)
+    ''', zip(
+        [int(user_id) for user_id in user_ids], to_blobs(raw),
+        to_blobs(scale_features(model, raw)), [model_version] * len(user_ids)
+    ))
+
+
+def features_chunk_query(column='raw', condition='1'):
+    """Запит однієї порції фіч; параметри: (last_id, *params, chunk_size)"""
+    if column not in ('raw', 'scaled'):
+        raise ValueError(f"Невідома колонка фіч: {column}")
+    return f'''
+        SELECT user_id, {column} FROM client_features
+        WHERE user_id > ? AND {condition}
+        ORDER BY user_id
+        LIMIT ?
+    '''
+
+
+def iter_features(conn, column='raw', condition='1', params=(), chunk_size=FEATURE_CHUNK_SIZE):
+    """Порції (user_ids, матриця float32) у порядку user_id (keyset-пагінація)"""
+    query = features_chunk_query(column, condition)
+    last_id = 0
+    while True:
+        rows = conn.execute(query, (last_id,) + tuple(params) + (chunk_size,)).fetchall()
+        if not rows:
+            return
+        user_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        yield user_ids, from_blobs([row[1] for row in rows])
+        last_id = int(user_ids[-1])
+
+
+def load_features(conn, user_id, column='raw'):
+    """Вектор фіч клієнта (float32) або None, якщо його немає у сховищі"""
+    if column not in ('raw', 'scaled'):
+        raise ValueError(f"Невідома колонка фіч: {column}")
+    row = conn.execute(
+        f'SELECT {column} FROM client_features WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return from_blobs([row[0]])[0] if row else None
+
+
+def backfill_features(conn, segmentation, model, chunk_size=FEATURE_CHUNK_SIZE):
+    """Заповнення сховища для профілів, збережених до його появи.
+
+    Фічі обчислюються з відповідей анкети в SQL (див. rescoring.profile_answers_query).
+    Повертає (кількість доданих векторів, кількість профілів з некоректними відповідями).
+    """
+    from rescoring import profile_answers_query, profile_features
+
+    query = profile_answers_query(segmentation, '''
+        id > ? AND cluster_id IS NOT NULL
+        AND user_id NOT IN (SELECT user_id FROM client_features)
+        ORDER BY id LIMIT ?
+    ''')
+    last_id, added, invalid = 0, 0, 0
+    while True:
+        rows = conn.execute(query, (last_id, chunk_size)).fetchall()
+        if not rows:
+            return added, invalid
+        ids, user_ids, features, valid = profile_features(rows)
+        with conn:
+            write_features(conn, user_ids[valid], features[valid], model, None)
+        last_id = int(ids[-1])
+        added += int(valid.sum())
+        invalid += int(len(rows) - valid.sum())
+
+
+if __name__ == '__main__':
+    import server
+    from db import connect
+
+    server.warmup()
+    for db_path in server.storage.paths:
+        conn = connect(db_path)
+        try:
+            added, invalid = backfill_features(conn, server.segmentation, server.segmentation.model)
+        finally:
+            conn.close()
+        print(f"✅ {db_path}: сховище фіч заповнено: {added} векторів "
+              f"({invalid} профілів з некоректними відповідями)")
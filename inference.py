@@ -0,0 +1,107 @@
+﻿import hashlib
+import numpy as np
+
+# ================== ШВИДКИЙ ІНФЕРЕНС KMEANS ==================
+
+# Порядок 7 фіч моделі (див. answers_to_features та map_user_data_to_features)
+FEATURE_NAMES = (
+    'income', 'age', 'total_spent', 'total_purchases',
+    'web_visits', 'has_children', 'recency'
+)
+
+def answers_to_features(income, age, has_children, sliders):
+    """Векторне обчислення 7 фіч моделі з числових відповідей опитування.
+
+    income, age, has_children — вектори довжини n або скаляри,
+    sliders — матриця (n × 6) значень слайдерів 1-10.
+    """
+    sliders = np.asarray(sliders, dtype=float) / 10.0
+    n = len(sliders)
+    income = np.broadcast_to(np.asarray(income, dtype=float), (n,))
+    age = np.broadcast_to(np.asarray(age, dtype=float), (n,))
+    has_children = np.broadcast_to(np.asarray(has_children, dtype=float), (n,))
+    price_sens, online_shop, brand_loyalty, innovation, social_infl, quality_imp = sliders.T
+
+    # Ті самі формули, що й у AdvancedCustomerSegmentation.map_user_data_to_features
+    total_spent = income * (0.5 + (1 - price_sens) * quality_imp * 0.5) * 0.01
+    total_purchases = (online_shop * 4 + brand_loyalty * 3 + innovation * 2 + social_infl * 1)
+    web_visits = (online_shop * 7 + social_infl * 3 + innovation * 2)
+    recency = 60 - (brand_loyalty * 25 + online_shop * 10 + quality_imp * 5)
+
+    return np.column_stack([
+        income, age, total_spent, total_purchases,
+        web_visits, has_children, recency
+    ])
+
+
+def confidence_from_distances(distances, labels):
+    """Нормалізація впевненості від 0.7 до 0.97 для матриці відстаней (n × k)"""
+    labels = np.asarray(labels)
+    min_dist = distances.min(axis=1)
+    spread = distances.max(axis=1) - min_dist
+    own = distances[np.arange(len(labels)), labels]
+
+    equal = spread <= 0
+    raw_confidence = 1 - (own - min_dist) / np.where(equal, 1.0, spread)
+    confidence = 0.7 + raw_confidence * 0.27  # Масштабуємо до 0.7-0.97
+    # Значення за замовчуванням, якщо всі відстані рівні
+    confidence[equal] = 0.85
+    return np.minimum(np.maximum(confidence, 0.7), 0.97)
+
+
+def fold_scale(scale):
+    """Обернений масштаб скейлера"""
+    return 1.0 / np.asarray(scale, dtype=float)
+
+
+def fold_centers(mean, scale, centers):
+    """Центроїди, перенесені з масштабованого у вихідний простір фіч"""
+    return np.asarray(mean, dtype=float) + np.asarray(centers, dtype=float) * np.asarray(scale, dtype=float)
+
+
+class FusedKMeansKernel:
+    """Згорнутий ланцюжок StandardScaler → KMeans.predict → cdist.
+
+    Середнє та масштаб скейлера вбудовуються в центроїди під час
+    завантаження моделі, тому на запит лишається одна операція NumPy
+    без валідації вхідних даних sklearn:
+
+        (x - mean) / scale - c  =  (x - (mean + c * scale)) / scale
+
+    Згорнуті масиви можна передати готовими (folded_centers, inv_scale),
+    наприклад memory-mapped з артефакту моделі, тоді вони не копіюються.
+    """
+
+    def __init__(self, mean, scale, centers, folded_centers=None, inv_scale=None):
+        mean = np.asarray(mean, dtype=float)
+        scale = np.asarray(scale, dtype=float)
+        centers = np.asarray(centers, dtype=float)
+
+        self.n_clusters, self.n_features = centers.shape
+        self.inv_scale = fold_scale(scale) if inv_scale is None else np.asarray(inv_scale)
+        # Центроїди у вихідному (немасштабованому) просторі фіч
+        self.centers = (fold_centers(mean, scale, centers) if folded_centers is None
+                        else np.asarray(folded_centers))
+        # Відбиток параметрів моделі для прив'язки похідних артефактів
+        self.fingerprint = hashlib.sha1(
+            mean.tobytes() + scale.tobytes() + centers.tobytes()
+        ).hexdigest()[:12]
+
+    @classmethod
+    def from_estimators(cls, scaler, kmeans):
+        """Побудова ядра з навчених StandardScaler та KMeans"""
+        return cls(scaler.mean_, scaler.scale_, kmeans.cluster_centers_)
+
+    def distances(self, features):
+        """Евклідові відстані у масштабованому просторі до всіх центроїдів (n × k)"""
+        X = np.asarray(features, dtype=float).reshape(-1, self.n_features)
+        if not np.isfinite(X).all():
+            raise ValueError("Вхідні фічі містять NaN або нескінченність")
+        diff = (X[:, None, :] - self.centers) * self.inv_scale
+        return np.sqrt(np.einsum('nkf,nkf->nk', diff, diff))
+
+    def predict(self, features):
+        """Мітки кластерів та впевненість для матриці фіч"""
+        distances = self.distances(features)
+        labels = distances.argmin(axis=1)
+        return labels, confidence_from_distances(distances, labels)
@@ -0,0 +1,89 @@
+﻿import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# ================== ФОНОВІ ЗАДАЧІ ==================
+
+class JobRegistry:
+    """Реєстр фонових задач (перенавчання, перерахунок профілів тощо).
+
+    Кожна задача виконується в окремому потоці та отримує функцію
+    report(stage, progress) для оновлення свого статусу. Одночасно може
+    виконуватись лише одна задача кожного типу.
+    """
+
+    def __init__(self, max_history=50):
+        self.max_history = max_history
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, **kwargs):
+        """Запуск func(report, **kwargs) у фоні.
+
+        Повертає id нової задачі або None, якщо задача цього типу вже виконується.
+        """
+        with self._lock:
+            if any(job['kind'] == kind and job['status'] in ('queued', 'running')
+                   for job in self._jobs.values()):
+                return None
+
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {
+                'id': job_id,
+                'kind': kind,
+                'status': 'queued',
+                'stage': None,
+                'progress': 0.0,
+                'created_at': _now(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None
+            }
+            while len(self._jobs) > self.max_history:
+                self._jobs.popitem(last=False)
+
+        thread = threading.Thread(
+            target=self._run, args=(job_id, func, kwargs),
+            name=f'job-{kind}-{job_id}', daemon=True
+        )
+        thread.start()
+        return job_id
+
+    def get(self, job_id):
+        """Копія статусу задачі або None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self, kind=None):
+        """Статуси задач (новіші першими)"""
+        with self._lock:
+            return [dict(job) for job in reversed(self._jobs.values())
+                    if kind is None or job['kind'] == kind]
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _run(self, job_id, func, kwargs):
+        def report(stage, progress=None):
+            fields = {'stage': stage}
+            if progress is not None:
+                fields['progress'] = float(progress)
+            self._update(job_id, **fields)
+
+        self._update(job_id, status='running', started_at=_now())
+        try:
+            result = func(report, **kwargs)
+            self._update(job_id, status='completed', progress=1.0,
+                         result=result, finished_at=_now())
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status='failed', error=str(e), finished_at=_now())
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
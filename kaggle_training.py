@@ -0,0 +1,156 @@
+﻿import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import MiniBatchKMeans
+
+from cluster_metrics import StreamingClusterStats
+
+# ================== НАВЧАННЯ НА KAGGLE ДАТАСЕТІ ==================
+#
+# Файл читається частинами (pandas chunksize) у кілька проходів:
+#   1. StandardScaler.partial_fit — потокові середнє та дисперсія;
+#   2. MiniBatchKMeans.partial_fit — кілька епох міні-батчами;
+#   3. потокові метрики якості фінальної моделі.
+# В пам'яті одночасно лише одна частина файлу, тому споживання пам'яті
+# не залежить від розміру вивантаження. Підбір K (sweep_k) навчає KMeans
+# цілком у пам'яті, тож отримує не весь файл, а рівномірну вибірку
+# фіксованого розміру (reservoir sampling за один прохід).
+
+KAGGLE_DATASET_PATH = 'data/marketing_campaign.csv'
+
+# Розмір вибірки для підбору K
+SWEEP_SAMPLE_SIZE = 50000
+
+# Рік, відносно якого рахується вік (останні записи датасету — 2014)
+REFERENCE_YEAR = 2014
+
+SPENDING_COLUMNS = [
+    'MntWines', 'MntFruits', 'MntMeatProducts',
+    'MntFishProducts', 'MntSweetProducts', 'MntGoldProds'
+]
+PURCHASE_COLUMNS = [
+    'NumDealsPurchases', 'NumWebPurchases',
+    'NumCatalogPurchases', 'NumStorePurchases'
+]
+USED_COLUMNS = (
+    ['Income', 'Year_Birth', 'NumWebVisitsMonth', 'Kidhome', 'Teenhome', 'Recency']
+    + SPENDING_COLUMNS + PURCHASE_COLUMNS
+)
+
+
+def read_chunks(path=KAGGLE_DATASET_PATH, chunksize=50000):
+    """Послідовне читання потрібних колонок файлу частинами"""
+    return pd.read_csv(path, sep='\t', usecols=USED_COLUMNS, chunksize=chunksize)
+
+
+def derive_features(chunk, reference_year=REFERENCE_YEAR):
+    """Векторне обчислення 7 фіч моделі з частини датасету.
+
+    Порядок фіч збігається з map_user_data_to_features: дохід, вік,
+    витрати, покупки, відвідування сайту, діти, давність покупки.
+    Рядки з пропущеними значеннями відкидаються.
+    """
+    features = np.column_stack([
+        chunk['Income'].to_numpy(dtype=float),
+        reference_year - chunk['Year_Birth'].to_numpy(dtype=float),
+        chunk[SPENDING_COLUMNS].to_numpy(dtype=float).sum(axis=1),
+        chunk[PURCHASE_COLUMNS].to_numpy(dtype=float).sum(axis=1),
+        chunk['NumWebVisitsMonth'].to_numpy(dtype=float),
+        chunk['Kidhome'].to_numpy(dtype=float) + chunk['Teenhome'].to_numpy(dtype=float),
+        chunk['Recency'].to_numpy(dtype=float)
+    ])
+    return features[np.isfinite(features).all(axis=1)]
+
+
+def iter_features(path=KAGGLE_DATASET_PATH, chunksize=50000):
+    """Матриці фіч по частинах файлу"""
+    for chunk in read_chunks(path, chunksize):
+        features = derive_features(chunk)
+        if len(features):
+            yield features
+
+
+def sample_features(path=KAGGLE_DATASET_PATH, size=SWEEP_SAMPLE_SIZE, chunksize=50000,
+                    random_state=42):
+    """Рівномірна вибірка не більше size рядків фіч за один прохід файлу.
+
+    Повертає (вибірка, кількість коректних записів у файлі).
+    """
+    rng = np.random.default_rng(random_state)
+    reservoir = None
+    seen = 0
+    for features in iter_features(path, chunksize):
+        if reservoir is None:
+            reservoir = np.empty((size, features.shape[1]))
+        # Перші size рядків заповнюють вибірку
+        fill = min(max(size - seen, 0), len(features))
+        reservoir[seen:seen + fill] = features[:fill]
+        rest = features[fill:]
+        if len(rest):
+            # Рядок з номером i замінює випадковий слот з імовірністю size / (i + 1)
+            index = seen + fill + np.arange(len(rest))
+            slots = (rng.random(len(rest)) * (index + 1)).astype(np.int64)
+            taken = np.flatnonzero(slots < size)
+            # З кількох рядків, що влучили в один слот, лишається останній
+            _, last = np.unique(slots[taken][::-1], return_index=True)
+            taken = taken[len(taken) - 1 - last]
+            reservoir[slots[taken]] = rest[taken]
+        seen += len(features)
+    if reservoir is None:
+        raise ValueError(f"Немає коректних записів у {path}")
+    return reservoir[:min(seen, size)], seen
+
+
+def train_from_dataset(path=KAGGLE_DATASET_PATH, n_clusters=5, chunksize=50000,
+                       batch_size=1024, n_epochs=10, random_state=42, report=None):
+    """Позаядерне навчання StandardScaler + MiniBatchKMeans на файлі датасету.
+
+    Повертає (scaler, kmeans, metrics).
+    """
+    report = report or (lambda stage, progress=None: None)
+
+    # Прохід 1: статистики нормалізації
+    report('scaling', 0.05)
+    scaler = StandardScaler()
+    n_samples = 0
+    for features in iter_features(path, chunksize):
+        scaler.partial_fit(features)
+        n_samples += len(features)
+    if n_samples < n_clusters:
+        raise ValueError(f"Замало коректних записів у {path}: {n_samples}")
+
+    # Прохід 2: міні-батчеве навчання KMeans
+    kmeans = MiniBatchKMeans(
+        n_clusters=n_clusters,
+        init='k-means++',
+        batch_size=batch_size,
+        n_init=3,
+        random_state=random_state
+    )
+    for epoch in range(n_epochs):
+        report('fitting', 0.1 + 0.7 * epoch / n_epochs)
+        for features in iter_features(path, chunksize):
+            X_scaled = scaler.transform(features)
+            for start in range(0, len(X_scaled), batch_size):
+                batch = X_scaled[start:start + batch_size]
+                # Перший виклик ініціалізує центроїди, тому батч має містити не менше K точок
+                if len(batch) >= n_clusters or hasattr(kmeans, 'cluster_centers_'):
+                    kmeans.partial_fit(batch)
+
+    # Прохід 3: метрики якості фінальної моделі
+    report('evaluating', 0.85)
+    stats = StreamingClusterStats(kmeans.cluster_centers_, random_state=random_state)
+    for features in iter_features(path, chunksize):
+        stats.update(scaler.transform(features))
+    quality = stats.result()
+
+    metrics = {
+        'source': path,
+        'n_samples': int(n_samples),
+        'n_clusters': int(n_clusters),
+        'n_epochs': int(n_epochs),
+        'inertia': quality['inertia'],
+        'silhouette': quality['silhouette']['value'] if quality['silhouette'] else None,
+        'quality': quality
+    }
+    return scaler, kmeans, metrics
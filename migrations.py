@@ -0,0 +1,263 @@
+﻿import sys
+
+from analytics import COMPLETED_SQL, TOTAL_CLIENTS_SQL, analytics_counts_query
+from client_listing import clients_page_query, encode_cursor
+from cluster_stats import CLUSTER_TOTALS_SQL, init_cluster_stats, rebuild_cluster_stats
+from db import connect
+from feature_store import features_chunk_query, init_feature_store
+
+# ================== МІГРАЦІЇ СХЕМИ БД ==================
+#
+# Версія схеми зберігається в PRAGMA user_version. Кожна міграція
+# виконується в окремій транзакції BEGIN IMMEDIATE разом з оновленням
+# версії, тож воркери, що стартують одночасно, застосовують її рівно один
+# раз, а перервана міграція не лишає схему напівзмінною. Бази, створені
+# до появи міграцій (user_version = 0), проходять ті самі кроки: всі вони
+# ідемпотентні. Нова зміна схеми — нова функція в кінці MIGRATIONS;
+# застосовані міграції не редагуються.
+#
+# Запуск: python migrations.py [check] (з SHARD_COUNT > 1 — для кожного шарда)
+
+
+def _create_base_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            name TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('client', 'admin')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS client_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            age_group TEXT,
+            income_level TEXT,
+            education TEXT,
+            marital_status TEXT,
+            has_children INTEGER,
+            price_sensitivity INTEGER,
+            online_shopping INTEGER,
+            brand_loyalty INTEGER,
+            innovation INTEGER,
+            social_influence INTEGER,
+            quality_importance INTEGER,
+            cluster_id INTEGER,
+            cluster_name TEXT,
+            cluster_confidence REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+
+def _add_profile_model_version(cursor):
+    # Бази, створені init_db до появи міграцій, вже мають цю колонку
+    cursor.execute('PRAGMA table_info(client_profiles)')
+    if 'model_version' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE client_profiles ADD COLUMN model_version TEXT')
+
+
+def _create_hot_path_indexes(cursor):
+    # Кількість та список клієнтів (WHERE role = 'client')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)')
+    # Лише заповнені профілі: підрахунки та групування за кластером
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_profiles_completed
+        ON client_profiles(cluster_id, cluster_confidence)
+        WHERE cluster_id IS NOT NULL
+    ''')
+    # Статистика кластерів: GROUP BY без сортування і без читання таблиці
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_profiles_cluster_name
+        ON client_profiles(cluster_name, cluster_confidence)
+        WHERE cluster_name IS NOT NULL
+    ''')
+
+
+def _create_client_list_indexes(cursor):
+    # Сторінки списку клієнтів (client_listing.py) віддаються індексом у
+    # порядку ключа сортування; rowid в кінці індексу users — id користувача
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)')
+    # Розширений індекс статистики кластерів (той самий префікс)
+    cursor.execute('DROP INDEX IF EXISTS idx_profiles_cluster_name')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_profiles_cluster_confidence
+        ON client_profiles(cluster_name, cluster_confidence, user_id)
+        WHERE cluster_name IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_profiles_cluster_user
+        ON client_profiles(cluster_name, user_id)
+        WHERE cluster_name IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_profiles_confidence
+        ON client_profiles(cluster_confidence, user_id)
+        WHERE cluster_confidence IS NOT NULL
+    ''')
+
+
+def _create_cluster_stats(cursor):
+    init_cluster_stats(cursor)
+    rebuild_cluster_stats(cursor)
+
+
+# (версія, опис, функція(cursor)) у порядку застосування
+MIGRATIONS = [
+    (1, 'Базова схема: користувачі та профілі клієнтів', _create_base_schema),
+    (2, 'Версія моделі, якою оцінено профіль', _add_profile_model_version),
+    (3, 'Сховище фіч клієнтів', init_feature_store),
+    (4, 'Індекси запитів ендпоінтів', _create_hot_path_indexes),
+    (5, 'Індекси сторінок списку клієнтів', _create_client_list_indexes),
+    (6, 'Статистика кластерів', _create_cluster_stats),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Застосування нових міграцій; повертає список застосованих версій"""
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Інший процес міг застосувати міграцію, поки ми чекали на блокування
+            if schema_version(conn) < version:
+                apply(conn.cursor())
+                conn.execute(f'PRAGMA user_version = {version}')
+                applied.append(version)
+                print(f"🔧 Міграція {version}: {description}")
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    if applied:
+        # Статистика для планувальника по нових індексах
+        conn.execute('PRAGMA optimize')
+    return applied
+
+
+# ================== ПЕРЕВІРКА ПЛАНІВ ЗАПИТІВ ==================
+#
+# Запити ендпоінтів (з тими самими умовами, що й у server.py) з
+# прикладовими параметрами. Перевірка падає, якщо план містить повне
+# сканування таблиці без індексу або тимчасове B-дерево для сортування
+# чи групування. Запити, винесені в модулі (сторінки списку клієнтів,
+# статистика кластерів, аналітика, порції фіч), беруться звідти ж, звідки
+# їх виконує сервер; змінюючи вбудований у server.py запит, онови його і тут.
+
+def _client_page(**args):
+    sql, params = clients_page_query(args)[:2]
+    return sql, tuple(params)
+
+
+HOT_QUERIES = {
+    'login': ('''
+        SELECT u.id, u.name, u.role, p.cluster_id
+        FROM users u
+        LEFT JOIN client_profiles p ON u.id = p.user_id
+        WHERE u.email = ? AND u.password_hash = ?
+    ''', ('admin@system.ua', '')),
+    'check_questionnaire': ('''
+        SELECT cluster_id FROM client_profiles
+        WHERE user_id = ? AND cluster_id IS NOT NULL
+    ''', (1,)),
+    'my_profile': ('''
+        SELECT u.name, p.cluster_id, p.cluster_name, p.cluster_confidence
+        FROM users u
+        LEFT JOIN client_profiles p ON u.id = p.user_id
+        WHERE u.id = ?
+    ''', (1,)),
+    'recommendations': (
+        'SELECT cluster_id FROM client_profiles WHERE user_id = ?', (1,)
+    ),
+    'similar_details': ('''
+        SELECT u.id, u.name, u.email, p.cluster_id, p.cluster_name
+        FROM users u
+        JOIN client_profiles p ON u.id = p.user_id
+        WHERE u.id IN (?, ?)
+    ''', (1, 2)),
+    'admin_clients': _client_page(),
+    'admin_clients_next': _client_page(cursor=encode_cursor('id', 'asc', [1])),
+    'admin_clients_created': _client_page(sort='created_at', order='desc'),
+    'admin_clients_confidence': _client_page(sort='confidence', min_confidence='0.5'),
+    'admin_clients_cluster': _client_page(cluster='Преміум клієнти'),
+    'admin_clients_cluster_confidence': _client_page(cluster='Преміум клієнти', sort='confidence'),
+    'admin_clusters': (CLUSTER_TOTALS_SQL, ()),
+    'admin_analytics_total': (TOTAL_CLIENTS_SQL, ()),
+    'admin_analytics_completed': (COMPLETED_SQL, ()),
+    'admin_analytics_day': analytics_counts_query('day', 90),
+    'admin_analytics_week': analytics_counts_query('week', 90),
+    'feature_chunk': (features_chunk_query('raw', 'model_version IS NOT ?'), (0, '', 1)),
+}
+
+# Кроки планів, прийняті свідомо: {назва запиту: {крок плану: причина}}
+ACCEPTED_PLAN_STEPS = {
+    'admin_clusters': {
+        'SCAN cluster_stats': 'у таблиці лише по рядку на кластер',
+    },
+    'admin_analytics_day': {
+        'USE TEMP B-TREE FOR GROUP BY': 'рядки обмежені вікном дат за idx_users_created, '
+                                        'групи — дні × кластери, результат кешується',
+    },
+    'admin_analytics_week': {
+        'USE TEMP B-TREE FOR GROUP BY': 'рядки обмежені вікном дат за idx_users_created, '
+                                        'групи — тижні × кластери, результат кешується',
+    },
+}
+
+
+def plan_problems(detail):
+    """Причина, з якої рядок плану неприйнятний, або None"""
+    if detail.startswith('SCAN ') and ' USING ' not in detail:
+        return 'повне сканування таблиці'
+    if 'USE TEMP B-TREE' in detail:
+        return 'тимчасове B-дерево'
+    return None
+
+
+def check_query_plans(conn, queries=HOT_QUERIES, accepted=ACCEPTED_PLAN_STEPS):
+    """EXPLAIN QUERY PLAN для кожного запиту: {назва: (план, [проблеми])}"""
+    report = {}
+    for name, (query, params) in queries.items():
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+        allowed = accepted.get(name, {})
+        problems = [f'{detail}: {reason}' for detail in plan if detail not in allowed
+                    for reason in [plan_problems(detail)] if reason]
+        report[name] = (plan, problems)
+    return report
+
+
+if __name__ == '__main__':
+    from sharding import shard_paths
+
+    failed = 0
+    for db_path in shard_paths():
+        conn = connect(db_path)
+        try:
+            if sys.argv[1:] != ['check']:
+                applied = migrate(conn)
+                print(f"✅ {db_path}: схема версії {schema_version(conn)} "
+                      f"(застосовано міграцій: {len(applied)})")
+            report = check_query_plans(conn)
+        finally:
+            conn.close()
+
+        print(f"📁 {db_path}")
+        for name, (plan, problems) in report.items():
+            print(f"{'❌' if problems else '✅'} {name}: {'; '.join(plan)}")
+            for problem in problems:
+                print(f"     {problem}")
+            failed += bool(problems)
+    sys.exit(1 if failed else 0)
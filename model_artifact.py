@@ -0,0 +1,282 @@
+﻿import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from inference import FEATURE_NAMES, fold_centers, fold_scale
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# ================== ФОРМАТ АРТЕФАКТУ МОДЕЛІ ==================
+#
+# Компактний бінарний файл, який читається лише NumPy (без sklearn/scipy):
+#
+#   8 байт   сигнатура b'CPMODEL\0'
+#   4 байти  версія формату (uint32, little-endian)
+#   4 байти  довжина JSON заголовка (uint32, little-endian)
+#   N байт   JSON заголовок: версія моделі, схема фіч, профілі кластерів,
+#            метрики, опис масивів (dtype, shape, offset) та SHA-256 даних
+#   ...      вирівнювання до 64 байт
+#   дані     масиви mean (7), scale (7), centers (K × 7) та вже згорнуті
+#            для FusedKMeansKernel folded_centers (K × 7), inv_scale (7),
+#            float64 LE
+#
+# Зміщення масивів у заголовку відраховуються від початку блоку даних,
+# тому масиви відкриваються через np.memmap без копіювання: воркери на
+# одній машині ділять одні й ті ж сторінки page cache.
+
+MODEL_ARTIFACT_PATH = 'advanced_model.bin'
+
+# На Windows відкритий через mmap файл не можна замінити os.replace
+ARTIFACT_MMAP = os.name != 'nt'
+
+MAGIC = b'CPMODEL\0'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+ARRAY_NAMES = ('mean', 'scale', 'centers')
+FOLDED_ARRAY_NAMES = ('folded_centers', 'inv_scale')
+
+
+class ArtifactError(ValueError):
+    """Пошкоджений або несумісний файл артефакту"""
+
+
+def save_artifact(path, mean, scale, centers, model_version,
+                  cluster_profiles=None, metrics=None, created_at=None):
+    """Запис артефакту моделі (через тимчасовий файл та атомарну заміну)"""
+    arrays = {
+        'mean': np.ascontiguousarray(mean, dtype='<f8'),
+        'scale': np.ascontiguousarray(scale, dtype='<f8'),
+        'centers': np.ascontiguousarray(centers, dtype='<f8'),
+        'folded_centers': np.ascontiguousarray(fold_centers(mean, scale, centers), dtype='<f8'),
+        'inv_scale': np.ascontiguousarray(fold_scale(scale), dtype='<f8')
+    }
+    if arrays['centers'].shape[1] != len(FEATURE_NAMES):
+        raise ArtifactError(f"Очікується {len(FEATURE_NAMES)} фіч, отримано {arrays['centers'].shape[1]}")
+
+    layout = {}
+    payload = bytearray()
+    for name in ARRAY_NAMES + FOLDED_ARRAY_NAMES:
+        array = arrays[name]
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': len(payload)}
+        payload += array.tobytes()
+        payload += b'\0' * (-len(payload) % ALIGNMENT)
+
+    header = {
+        'format_version': FORMAT_VERSION,
+        'model_version': model_version,
+        'created_at': created_at or datetime.now(timezone.utc).isoformat(),
+        'feature_schema': list(FEATURE_NAMES),
+        'n_clusters': int(arrays['centers'].shape[0]),
+        'arrays': layout,
+        'payload_size': len(payload),
+        'checksum': hashlib.sha256(payload).hexdigest(),
+        # Ключі JSON завжди рядки, тому id кластерів зберігаються як рядки
+        'cluster_profiles': {str(k): v for k, v in (cluster_profiles or {}).items()},
+        'metrics': metrics or {}
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    prefix = MAGIC + struct.pack('<II', FORMAT_VERSION, len(header_bytes)) + header_bytes
+    prefix += b'\0' * (-len(prefix) % ALIGNMENT)
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(prefix)
+        f.write(payload)
+    os.replace(path + '.tmp', path)
+
+
+def read_header(f):
+    """Читання та перевірка заголовка; повертає (header, зміщення даних)"""
+    start = f.read(len(MAGIC) + 8)
+    if len(start) < len(MAGIC) + 8 or start[:len(MAGIC)] != MAGIC:
+        raise ArtifactError("Файл не є артефактом моделі")
+
+    format_version, header_size = struct.unpack('<II', start[len(MAGIC):])
+    if format_version != FORMAT_VERSION:
+        raise ArtifactError(f"Непідтримувана версія формату: {format_version}")
+
+    header = json.loads(f.read(header_size).decode('utf-8'))
+    if header.get('feature_schema') != list(FEATURE_NAMES):
+        raise ArtifactError("Схема фіч артефакту не збігається зі схемою сервера")
+
+    data_offset = len(MAGIC) + 8 + header_size
+    data_offset += -data_offset % ALIGNMENT
+    return header, data_offset
+
+
+def load_artifact(path, mmap=False, verify=True):
+    """Завантаження артефакту: повертає (header, {назва масиву: масив}).
+
+    mmap=True відкриває масиви через np.memmap (спільні сторінки між процесами).
+    """
+    with open(path, 'rb') as f:
+        header, data_offset = read_header(f)
+        if not mmap or verify:
+            f.seek(data_offset)
+            payload = f.read(header['payload_size'])
+            if len(payload) != header['payload_size']:
+                raise ArtifactError("Артефакт обрізаний")
+            if verify and hashlib.sha256(payload).hexdigest() != header['checksum']:
+                raise ArtifactError("Контрольна сума артефакту не збігається")
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        if mmap:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r',
+                                     offset=data_offset + spec['offset'], shape=shape)
+        else:
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(payload, dtype=dtype, count=count,
+                                         offset=spec['offset']).reshape(shape)
+    return header, arrays
+
+
+# ================== МІЖПРОЦЕСНЕ БЛОКУВАННЯ ==================
+
+class FileLock:
+    """Ексклюзивне блокування між процесами через файл.
+
+    Реентерабельне в межах процесу: вкладені acquire() з того ж потоку
+    не блокуються, файл відпускається після останнього release().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                _lock_file(fd)
+            except BaseException:
+                os.close(fd)
+                self._thread_lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock_file(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _lock_file(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    # msvcrt.LK_LOCK сам повторює спробу лише 10 секунд, тож чекаємо в циклі
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            time.sleep(0.1)
+
+
+def _unlock_file(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+# ================== ІМПОРТ / ЕКСПОРТ JOBLIB ==================
+
+def params_from_estimators(scaler, kmeans):
+    """Параметри артефакту з навчених StandardScaler та KMeans"""
+    return {'mean': scaler.mean_, 'scale': scaler.scale_, 'centers': kmeans.cluster_centers_}
+
+
+def estimators_from_params(mean, scale, centers):
+    """Відновлення StandardScaler та KMeans з параметрів артефакту (імпортує sklearn)"""
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.cluster import KMeans
+
+    scale = np.array(scale, dtype=float)
+    centers = np.array(centers, dtype=float)
+
+    scaler = StandardScaler()
+    scaler.mean_ = np.array(mean, dtype=float)
+    scaler.scale_ = scale
+    scaler.var_ = scale ** 2
+    scaler.n_features_in_ = len(scale)
+    scaler.n_samples_seen_ = 0
+
+    # Одна ітерація Ллойда на самих центроїдах дає повністю «навчений» KMeans;
+    # центроїди відновлюються побітово, бо sklearn центрує дані під час fit
+    kmeans = KMeans(n_clusters=len(centers), init=centers, n_init=1, max_iter=1)
+    kmeans.fit(centers)
+    kmeans.cluster_centers_ = centers
+    return scaler, kmeans
+
+
+def import_joblib(kmeans_path, scaler_path, artifact_path=MODEL_ARTIFACT_PATH,
+                  cluster_profiles=None, metrics=None):
+    """Конвертація .pkl файлів joblib в артефакт"""
+    import joblib
+    from inference import FusedKMeansKernel
+
+    kmeans = joblib.load(kmeans_path)
+    scaler = joblib.load(scaler_path)
+    params = params_from_estimators(scaler, kmeans)
+    version = FusedKMeansKernel(**params).fingerprint
+    save_artifact(artifact_path, model_version=version,
+                  cluster_profiles=cluster_profiles, metrics=metrics, **params)
+    return version
+
+
+def export_joblib(artifact_path, kmeans_path, scaler_path):
+    """Експорт артефакту у .pkl файли joblib"""
+    import joblib
+
+    _, arrays = load_artifact(artifact_path)
+    scaler, kmeans = estimators_from_params(*(arrays[name] for name in ARRAY_NAMES))
+    joblib.dump(kmeans, kmeans_path)
+    joblib.dump(scaler, scaler_path)
+
+
+if __name__ == '__main__':
+    import sys
+
+    commands = {
+        'import': lambda: print(f"✅ Артефакт створено, версія {import_joblib(*sys.argv[2:])}"),
+        'export': lambda: export_joblib(*sys.argv[2:]),
+        'info': lambda: print(json.dumps(
+            {k: v for k, v in load_artifact(sys.argv[2])[0].items() if k != 'cluster_profiles'},
+            ensure_ascii=False, indent=2
+        ))
+    }
+    if len(sys.argv) < 3 or sys.argv[1] not in commands:
+        print("Використання:")
+        print("  python model_artifact.py import <kmeans.pkl> <scaler.pkl> [artifact]")
+        print("  python model_artifact.py export <artifact> <kmeans.pkl> <scaler.pkl>")
+        print("  python model_artifact.py info <artifact>")
+        sys.exit(1)
+    commands[sys.argv[1]]()
@@ -0,0 +1,271 @@
+﻿import queue
+import threading
+import time
+import numpy as np
+
+# ================== ОНЛАЙН-ОНОВЛЕННЯ ЦЕНТРОЇДІВ ==================
+
+class OnlineCentroidUpdater:
+    """Streaming KMeans: кожна прийнята анкета зсуває свій центроїд.
+
+    Анкети ставляться в чергу з обробника запиту і обробляються фоновим
+    потоком. Центроїд найближчого кластера зсувається до масштабованого
+    вектора фіч з кроком
+
+        lr = max(1 / (prior_count + n_k), min_learning_rate),
+
+    де n_k — кількість анкет, що вже потрапили в кластер. prior_count —
+    вага навченого центроїда у «спостереженнях», min_learning_rate не дає
+    моделі застигнути і дозволяє стежити за зміною аудиторії. Середнє та
+    масштаб скейлера не змінюються.
+
+    Оновлені центроїди публікуються новим знімком моделі не частіше ніж
+    раз на publish_interval секунд (читачі не блокуються, кожна публікація
+    починає новий кеш передбачень) і зберігаються в артефакт моделі раз на
+    checkpoint_interval секунд, звідки їх підхоплюють інші воркери.
+
+    Кожен воркер зсуває центроїди від спільної точки відліку — останнього
+    чекпоінта, який він бачив (з накопиченими лічильниками оновлень у
+    metrics['online']['counts']). Чекпоінт іншого воркера (в артефакті при
+    записі свого або підхоплений перезавантаженням моделі) не відкидає
+    власних незбережених оновлень: зсуви обох зводяться з вагою кількості
+    анкет, як середнє двох потоків від тієї ж точки,
+
+        c = r + ((w + n_o) * d_o + (w + n_m) * d_m) / (w + n_o + n_m),
+
+    де r — центроїд точки відліку, w = prior_count + накопичена кількість
+    оновлень у ній, d_o, n_o та d_m, n_m — зсув і кількість анкет іншого
+    воркера та власні. Якщо модель замінило перенавчання (тут або в іншому
+    воркері), оновлення старої моделі відкидаються і продовжуються вже від
+    нової.
+    """
+
+    def __init__(self, segmentation, prior_count=1000, min_learning_rate=1e-4,
+                 publish_interval=1.0, checkpoint_interval=300.0, max_pending=10000):
+        self.segmentation = segmentation
+        self.prior_count = prior_count
+        self.min_learning_rate = min_learning_rate
+        self.publish_interval = publish_interval
+        self.checkpoint_interval = checkpoint_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        # Точка відліку (модель з останнього баченого чекпоінта), версія
+        # навченої моделі, від якої вона походить, та накопичені в ній лічильники
+        self._base = None
+        self._root = None
+        self._base_counts = None
+        # Центроїди та власні лічильники оновлень від точки відліку
+        self._centers = None
+        self._counts = None
+        self._published = None
+        self._dirty = False
+        self._unsaved = False
+        self._last_publish = 0.0
+        self._last_checkpoint = time.monotonic()
+        self.stats = {
+            'applied': 0,
+            'skipped': 0,
+            'dropped': 0,
+            'published': 0,
+            'checkpoints': 0,
+            'base_version': None,
+            'last_checkpoint_at': None
+        }
+        self._thread = threading.Thread(target=self._run, name='online-centroids', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_data):
+        """Постановка анкети в чергу оновлень (не блокує запит)"""
+        try:
+            self._queue.put_nowait(dict(user_data))
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+
+    def info(self):
+        """Лічильники оновлень для адмін-панелі"""
+        with self._lock:
+            info = dict(self.stats)
+            info['pending'] = self._queue.qsize()
+            info['cluster_updates'] = ((self._base_counts + self._counts).tolist()
+                                       if self._counts is not None else None)
+        return info
+
+    def flush(self):
+        """Публікація та збереження накопичених оновлень (наприклад, перед зупинкою)"""
+        with self._lock:
+            self._drain()
+            self._publish()
+            self._checkpoint()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.publish_interval)
+            except queue.Empty:
+                item = None
+            try:
+                with self._lock:
+                    if item is not None:
+                        self._apply(item)
+                    self._drain()
+                    now = time.monotonic()
+                    if now - self._last_publish >= self.publish_interval:
+                        self._publish()
+                    if now - self._last_checkpoint >= self.checkpoint_interval:
+                        self._checkpoint()
+            except Exception as e:
+                print(f"❌ Помилка онлайн-оновлення центроїдів: {e}")
+
+    def _drain(self):
+        while True:
+            try:
+                self._apply(self._queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _sync_base(self):
+        """Прив'язка до поточної моделі, якщо її замінили ззовні.
+
+        Чекпоінт іншого воркера стає новою точкою відліку разом з власними
+        оновленнями; перенавчена модель скидає стан.
+        """
+        model = self.segmentation.model
+        if model is self._base or model is self._published:
+            return self._base
+        if self._descends(model):
+            centers = self._merge(model)
+            self._rebase(model)
+            self._centers = centers
+            self._dirty = self._dirty or bool(self._counts.any())
+            return model
+        self._rebase(model)
+        self._root = _lineage(model)[0]
+        self._counts = np.zeros(len(self._centers), dtype=np.int64)
+        self._dirty = False
+        self._unsaved = False
+        self.stats['base_version'] = self._root
+        return model
+
+    def _rebase(self, model):
+        """Нова точка відліку: власні лічильники лишаються (їх ще немає в жодному чекпоінті)"""
+        self._base = model
+        self._base_counts = _lineage(model)[1]
+        self._centers = np.array(model.centers, dtype=float)
+        self._published = None
+
+    def _descends(self, model):
+        """Чи є модель чекпоінтом тієї ж навченої моделі, новішим за точку відліку"""
+        if self._base is None:
+            return False
+        root, counts = _lineage(model)
+        return (root == self._root and counts.shape == self._base_counts.shape
+                and bool((counts >= self._base_counts).all()))
+
+    def _merge(self, other):
+        """Власні центроїди, зведені з чекпоінтом other (зважено кількістю анкет)"""
+        reference = np.asarray(self._base.centers, dtype=float)
+        weight = self.prior_count + self._base_counts
+        other_counts = _lineage(other)[1] - self._base_counts
+        other_shift = np.asarray(other.centers, dtype=float) - reference
+        own_shift = self._centers - reference
+        total = weight + other_counts + self._counts
+        return reference + (
+            (weight + other_counts)[:, None] * other_shift
+            + (weight + self._counts)[:, None] * own_shift
+        ) / total[:, None]
+
+    def _apply(self, user_data):
+        base = self._sync_base()
+        try:
+            features = np.asarray(
+                self.segmentation.map_user_data_to_features(user_data), dtype=float
+            )
+        except (AttributeError, TypeError, ValueError):
+            features = None
+        if features is None or not np.isfinite(features).all():
+            self.stats['skipped'] += 1
+            return
+
+        x = (features - base.mean) / base.scale
+        cluster_id = int(((self._centers - x) ** 2).sum(axis=1).argmin())
+        self._counts[cluster_id] += 1
+        seen = self._base_counts[cluster_id] + self._counts[cluster_id]
+        lr = max(1.0 / (self.prior_count + seen), self.min_learning_rate)
+        self._centers[cluster_id] += lr * (x - self._centers[cluster_id])
+        self._dirty = True
+        self.stats['applied'] += 1
+
+    def _snapshot(self, centers, counts):
+        """Знімок з онлайн-оновленими центроїдами (клас і скейлер базової моделі)"""
+        base = self._base
+        metrics = dict(base.metrics)
+        metrics['online'] = {
+            'base_version': self._root,
+            'updates': int(counts.sum()),
+            'counts': counts.tolist()
+        }
+        return type(base)(base.mean, base.scale, centers.copy(), metrics)
+
+    def _publish(self):
+        self._last_publish = time.monotonic()
+        if self._base is not None:
+            # Модель могли замінити ззовні й без нових анкет (чекпоінт іншого воркера)
+            self._sync_base()
+        if not self._dirty:
+            return
+        base = self._base
+        snapshot = self._snapshot(self._centers, self._base_counts + self._counts)
+        if not self.segmentation.publish_model(snapshot, replace=self._published or base):
+            # Модель замінили ззовні: оновлення старої моделі відкидаються
+            self._sync_base()
+            return
+        self._published = snapshot
+        self._dirty = False
+        self._unsaved = True
+        self.stats['published'] += 1
+
+    def _merge_checkpoint(self, current):
+        """Знімок для артефакту: власні оновлення поверх чекпоінтів інших воркерів"""
+        if current is not None and current.version != self._base.version and self._descends(current):
+            centers = self._merge(current)
+            counts = _lineage(current)[1] + self._counts
+        else:
+            centers = self._centers
+            counts = self._base_counts + self._counts
+        return self._snapshot(centers, counts)
+
+    def _checkpoint(self):
+        self._last_checkpoint = time.monotonic()
+        if not self._unsaved or self.segmentation.model is not self._published:
+            return
+        saved = self.segmentation.update_artifact(self._merge_checkpoint)
+        self.stats['checkpoints'] += 1
+        self.stats['last_checkpoint_at'] = saved.created_at
+        print(f"💾 Онлайн-оновлена модель збережена ({saved.version})")
+
+        if saved.version == self._published.version:
+            # Інших чекпоінтів не було: збережено вже опубліковану модель
+            saved = self._published
+        elif not self.segmentation.publish_model(saved, replace=self._published):
+            # Модель замінили ззовні вже після запису чекпоінта
+            self._sync_base()
+            return
+        # Збережений чекпоінт — нова точка відліку
+        self._base = saved
+        self._base_counts = _lineage(saved)[1]
+        self._centers = np.array(saved.centers, dtype=float)
+        self._counts = np.zeros(len(self._centers), dtype=np.int64)
+        self._published = None
+        self._dirty = False
+        self._unsaved = False
+
+
+def _lineage(model):
+    """(версія навченої моделі, накопичені лічильники оновлень за кластерами) знімка"""
+    online = model.metrics.get('online') or {}
+    counts = online.get('counts')
+    if counts is None:
+        counts = np.zeros(len(model.centers), dtype=np.int64)
+    return online.get('base_version', model.version), np.asarray(counts, dtype=np.int64)
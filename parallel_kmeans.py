@@ -0,0 +1,179 @@
+﻿import time
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans
+from threadpoolctl import threadpool_limits
+
+# ================== ПАРАЛЕЛЬНЕ НАВЧАННЯ KMEANS ==================
+#
+# Замість одного KMeans(n_init=20), який перебирає ініціалізації
+# послідовно на одному ядрі, кожна ініціалізація — окремий KMeans(n_init=1).
+# Ініціалізації розподіляються по процесах (joblib/loky), кожна рахується
+# в один потік, тому результат не залежить від кількості процесів.
+#
+# Модель збігається з послідовним KMeans(n_init, random_state) тієї ж
+# версії sklearn: послідовний KMeans бере всі ініціалізації з одного
+# генератора check_random_state(random_state), і кожна k-means++
+# ініціалізація забирає з нього фіксовану кількість чисел. Тож стан
+# генератора перед кожною ініціалізацією відтворюється наперед, а
+# найкраща модель обирається тим самим правилом, що й у sklearn. Інакше
+# зміна TRAINING_N_JOBS перенумеровувала б кластери збережених клієнтів.
+
+
+def init_seeds(random_state, n_init):
+    """Детерміновані seed для кожної ініціалізації (підбір K, див. sweep_k)"""
+    return [int(seed) for seed in np.random.SeedSequence(random_state).generate_state(n_init)]
+
+
+def init_random_states(random_state, n_init, n_clusters):
+    """Генератори в тому стані, в якому їх отримує кожна ініціалізація послідовного KMeans.
+
+    k-means++ бере одне число на перший центр (choice з вагами) та
+    n_local_trials чисел (uniform) на кожен наступний.
+    """
+    from sklearn.utils import check_random_state
+
+    shared = check_random_state(random_state)
+    draws = 1 + (n_clusters - 1) * (2 + int(np.log(n_clusters)))
+    states = []
+    for _ in range(n_init):
+        state = np.random.RandomState()
+        state.set_state(shared.get_state())
+        states.append(state)
+        shared.random_sample(draws)
+    return states
+
+
+def _same_clustering(labels, other, n_clusters):
+    """Однакове розбиття з точністю до перестановки міток (як у sklearn)"""
+    mapping = np.full(n_clusters, -1)
+    mapping[labels] = other
+    return bool((mapping[labels] == other).all())
+
+
+def _fit_single_init(X, n_clusters, random_state, max_iter):
+    """Одна ініціалізація KMeans в одному потоці"""
+    start = time.perf_counter()
+    with threadpool_limits(limits=1):
+        kmeans = KMeans(
+            n_clusters=n_clusters,
+            init='k-means++',
+            n_init=1,
+            max_iter=max_iter,
+            random_state=random_state
+        ).fit(X)
+    return kmeans, time.perf_counter() - start
+
+
+def fit_kmeans_multi_init(X, n_clusters=5, n_init=20, max_iter=300, random_state=42, n_jobs=-1):
+    """Навчання KMeans з n_init ініціалізаціями, розподіленими по процесах.
+
+    Повертає найкращу за інерцією модель та звіт з інерцією і часом
+    кожної ініціалізації.
+    """
+    states = init_random_states(random_state, n_init, n_clusters)
+    start = time.perf_counter()
+    fits = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_single_init)(X, n_clusters, state, max_iter) for state in states
+    )
+    wall_time = time.perf_counter() - start
+
+    # Правило вибору послідовного KMeans: наступна ініціалізація замінює
+    # найкращу, лише якщо інерція менша і розбиття інше
+    best = 0
+    for index, (kmeans, _) in enumerate(fits[1:], start=1):
+        if (kmeans.inertia_ < fits[best][0].inertia_
+                and not _same_clustering(kmeans.labels_, fits[best][0].labels_, n_clusters)):
+            best = index
+
+    report = {
+        'n_init': n_init,
+        'n_jobs': n_jobs,
+        'best_init': best,
+        'wall_time': wall_time,
+        'cpu_time': float(sum(seconds for _, seconds in fits)),
+        'inits': [
+            {
+                'inertia': float(kmeans.inertia_),
+                'n_iter': int(kmeans.n_iter_),
+                'seconds': float(seconds)
+            }
+            for kmeans, seconds in fits
+        ]
+    }
+    return fits[best][0], report
+
+
+# ================== ПАРАЛЕЛЬНИЙ ПІДБІР КІЛЬКОСТІ КЛАСТЕРІВ ==================
+#
+# Кожне значення K — окрема задача joblib в один потік. Масштабована
+# матриця та квадрати норм її рядків рахуються один раз: joblib передає
+# великі масиви процесам через memory-mapped файл, а не копіює їх у кожну
+# задачу. Норми використовує k-means++ (найдорожча частина ініціалізації —
+# відстані від кандидатів до всіх точок), далі — ітерації Ллойда sklearn
+# від отриманих центроїдів.
+
+
+def _fit_k(X, x_squared_norms, n_clusters, seeds, max_iter, sample_per_cluster):
+    """Найкраща з ініціалізацій для одного K та її метрики якості"""
+    from sklearn.cluster import kmeans_plusplus
+    from cluster_metrics import evaluate_clustering
+
+    start = time.perf_counter()
+    best = None
+    with threadpool_limits(limits=1):
+        for seed in seeds:
+            init, _ = kmeans_plusplus(
+                X, n_clusters, x_squared_norms=x_squared_norms, random_state=seed
+            )
+            kmeans = KMeans(n_clusters=n_clusters, init=init, n_init=1, max_iter=max_iter).fit(X)
+            if best is None or kmeans.inertia_ < best.inertia_:
+                best = kmeans
+        fit_seconds = time.perf_counter() - start
+
+        silhouette = evaluate_clustering(
+            X, best.cluster_centers_, best.labels_, sample_per_cluster=sample_per_cluster
+        )['silhouette'] or {}
+    return {
+        'k': n_clusters,
+        'inertia': float(best.inertia_),
+        'silhouette': silhouette.get('value'),
+        'silhouette_ci': [silhouette.get('ci_low'), silhouette.get('ci_high')],
+        'n_iter': int(best.n_iter_),
+        'fit_seconds': fit_seconds,
+        'total_seconds': time.perf_counter() - start
+    }
+
+
+def sweep_k(X, k_values, n_init=10, max_iter=300, random_state=42, n_jobs=-1,
+            sample_per_cluster=500):
+    """Навчання KMeans для кожного K з k_values паралельно по процесах.
+
+    X — масштабована матриця фіч. Для кожного K повертає інерцію,
+    silhouette на стратифікованій вибірці (з довірчим інтервалом) та час
+    навчання. Seed ініціалізацій детерміновані, тому результат не залежить
+    від n_jobs.
+    """
+    X = np.ascontiguousarray(X, dtype=float)
+    x_squared_norms = (X ** 2).sum(axis=1)
+    seeds = init_seeds(random_state, n_init)
+
+    start = time.perf_counter()
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_k)(X, x_squared_norms, k, seeds, max_iter, sample_per_cluster)
+        for k in k_values
+    )
+    wall_time = time.perf_counter() - start
+
+    return {
+        'n_samples': len(X),
+        'n_init': n_init,
+        'n_jobs': n_jobs,
+        'wall_time': wall_time,
+        'cpu_time': float(sum(result['total_seconds'] for result in results)),
+        'best_silhouette_k': max(
+            (result for result in results if result['silhouette'] is not None),
+            key=lambda result: result['silhouette'], default={'k': None}
+        )['k'],
+        'results': results
+    }
@@ -0,0 +1,138 @@
+﻿import time
+import numpy as np
+from db import DB_PATH, connect
+from inference import answers_to_features
+
+# ================== ПЕРЕРАХУНОК ЗБЕРЕЖЕНИХ ПРОФІЛІВ ==================
+
+# Кількість профілів, що читаються, оцінюються та записуються за одну транзакцію
+RESCORE_CHUNK_SIZE = 20000
+
+
+def _slider_sql(column, default=5):
+    """Значення слайдера: число як є, відсутнє — за замовчуванням, інакше NULL (→ NaN)"""
+    return (f"CASE typeof({column}) WHEN 'null' THEN {default} "
+            f"WHEN 'integer' THEN {column} WHEN 'real' THEN {column} END")
+
+
+def _mapping_sql(column, mapping, default):
+    """CASE-вираз, що перекладає категорію анкети у числове значення фічі"""
+    whens = ' '.join(f"WHEN '{key}' THEN {value}" for key, value in mapping.items())
+    return f"CASE {column} {whens} ELSE {default} END"
+
+
+def profile_answers_query(segmentation, condition):
+    """SELECT id, user_id та числових відповідей анкет профілів, що задовольняють condition.
+
+    Категорії перекладаються у числа прямо в SQLite (ті самі значення за
+    замовчуванням, що й у map_user_data_to_features), тому кожен рядок
+    результату — готовий рядок матриці без обробки на рівні Python.
+    """
+    columns = [
+        _mapping_sql('income_level', segmentation.INCOME_MAP, segmentation.INCOME_MAP['medium']),
+        _mapping_sql('age_group', segmentation.AGE_MAP, segmentation.AGE_MAP['25-34']),
+        'COALESCE(has_children, 0) != 0'
+    ] + [_slider_sql(field) for field in segmentation.SLIDER_FIELDS]
+    return f'''
+        SELECT id, COALESCE(user_id, 0), {', '.join(columns)}
+        FROM client_profiles
+        WHERE {condition}
+    '''
+
+
+def profile_features(rows):
+    """Матриця фіч для рядків profile_answers_query.
+
+    Повертає (ids, user_ids, features, valid); нечислові слайдери (NaN)
+    позначаються некоректними, так само як при збереженні анкети.
+    """
+    block = np.array(rows, dtype=float).reshape(len(rows), -1)
+    features = answers_to_features(block[:, 2], block[:, 3], block[:, 4], block[:, 5:])
+    valid = np.isfinite(features).all(axis=1)
+    return block[:, 0].astype(np.int64), block[:, 1].astype(np.int64), features, valid
+
+
+def rescore_profiles(segmentation, db_path=DB_PATH, chunk_size=RESCORE_CHUNK_SIZE,
+                     report=None, on_update=None):
+    """Перерахунок кластерів усіх заповнених профілів поточною моделлю.
+
+    Вектори фіч читаються зі сховища фіч порціями по chunk_size, кожна
+    порція оцінюється однією матричною операцією та записується через
+    executemany в окремій транзакції, тож збереження анкет між порціями
+    не блокується. Профілі та їхні масштабовані вектори позначаються
+    версією моделі; профілі, вже оцінені цією версією, пропускаються, тому
+    перерваний перерахунок можна просто запустити знову. Профілі без
+    вектора у сховищі (збережені до його появи) спочатку доповнюються.
+    report(stage, progress) — необов'язковий колбек прогресу фонової задачі,
+    on_update(user_ids, cluster_names, confidences) — викликається після
+    коміту кожної порції (наприклад, для колонкового сховища профілів).
+    """
+    from cluster_stats import update_cluster_stats
+    from feature_store import backfill_features, iter_features, scale_features, to_blobs
+
+    report = report or (lambda stage, progress=None: None)
+    started = time.perf_counter()
+    # Один знімок моделі на весь перерахунок
+    model = segmentation.model
+    names = {cluster_id: profile['name']
+             for cluster_id, profile in segmentation.cluster_profiles.items()}
+
+    conn = connect(db_path)
+    try:
+        report('backfill', 0.0)
+        backfilled, invalid = backfill_features(conn, segmentation, model, chunk_size)
+
+        max_id = conn.execute('SELECT MAX(user_id) FROM client_features').fetchone()[0] or 0
+        report('rescoring', 0.05)
+
+        rescored = 0
+        for user_ids, raw in iter_features(conn, 'raw', 'model_version IS NOT ?',
+                                           (model.version,), chunk_size):
+            features = raw.astype(float)
+            labels, confidences = segmentation.score_features(model, features)
+            user_ids = user_ids.tolist()
+            versions = [model.version] * len(user_ids)
+            new_names = [names[label] for label in labels.tolist()]
+
+            with conn:
+                # Попередні кластери профілів порції для статистики кластерів
+                previous = {row[0]: row[1:] for row in conn.execute('''
+                    SELECT user_id, cluster_name, cluster_confidence FROM client_profiles
+                    WHERE user_id BETWEEN ? AND ?
+                ''', (user_ids[0], user_ids[-1]))}
+                conn.executemany('''
+                    UPDATE client_profiles
+                    SET cluster_id = ?, cluster_name = ?, cluster_confidence = ?,
+                        model_version = ?
+                    WHERE user_id = ?
+                ''', zip(labels.tolist(), new_names, confidences.tolist(), versions, user_ids))
+                conn.executemany('''
+                    UPDATE client_features
+                    SET scaled = ?, model_version = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                ''', zip(to_blobs(scale_features(model, features)), versions, user_ids))
+                update_cluster_stats(
+                    conn,
+                    added=[(name, confidence) for user_id, name, confidence
+                           in zip(user_ids, new_names, confidences.tolist())
+                           if user_id in previous],
+                    removed=[previous[user_id] for user_id in user_ids if user_id in previous]
+                )
+
+            if on_update is not None:
+                on_update(user_ids, new_names, confidences)
+            rescored += len(user_ids)
+            report('rescoring', 0.05 + 0.95 * (user_ids[-1] / max_id if max_id else 1.0))
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Перераховано {rescored} профілів за {elapsed:.2f} с ({model.version})")
+    return {
+        'model_version': model.version,
+        'rescored': rescored,
+        'backfilled': backfilled,
+        'invalid': invalid,
+        'elapsed': elapsed,
+        'rows_per_second': rescored / elapsed if elapsed else 0.0
+    }
@@ -2,6 +2,7 @@
 import hashlib
 import random
 from datetime import datetime, timedelta
+from cluster_stats import rebuild_cluster_stats
 
 # Подключение к базе данных
 conn = sqlite3.connect('profiling.db')
@@ -10,6 +11,8 @@ cursor = conn.cursor()
 # Очистка существующих данных (кроме админа)
 cursor.execute("DELETE FROM users WHERE role = 'client'")
 cursor.execute("DELETE FROM client_profiles")
+# Вектори фіч тестових клієнтів заповнить перерахунок профілів
+cursor.execute("DELETE FROM client_features")
 
 # Список имен для генерации
 first_names = ["Іван", "Олексій", "Марія", "Анна", "Петро", "Наталія", "Андрій", "Ольга", "Віктор", "Юлія"]
@@ -142,6 +145,9 @@ for i in range(1, 31):
     
     print(f"Додано клієнта {name} ({email}) до кластера {cluster_id} ({cluster_names[cluster_id]})")
 
+# Статистика кластерів рахується заново по тестових профілях
+rebuild_cluster_stats(cursor)
+
 # Сохраняем изменения и закрываем соединение
 conn.commit()
 conn.close()
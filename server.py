@@ -1,18 +1,40 @@
-﻿from flask import Flask, request, jsonify
+﻿from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import sqlite3
-import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
 import hashlib
 import secrets
 import jwt
 from datetime import datetime, timezone
-import joblib
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+import json
 import os
-from scipy.spatial.distance import cdist
+import time
+import atexit
+from inference import FusedKMeansKernel, answers_to_features, confidence_from_distances
+from analytics import (
+    AnalyticsCache, analytics_params, cluster_feature_means, merge_analytics, read_analytics
+)
+from answer_table import AnswerTable, build_answer_table
+from model_artifact import (
+    ARTIFACT_MMAP, MODEL_ARTIFACT_PATH, FileLock, estimators_from_params,
+    load_artifact, params_from_estimators, read_header, save_artifact
+)
+from jobs import JobRegistry
+from client_listing import CLIENT_COLUMNS, clients_page_query, merge_pages, next_cursor
+from cluster_stats import read_cluster_totals, summarize_cluster_totals, update_cluster_stats
+from columnar_store import ColumnarProfileStore, segment_filters, segment_params
+from feature_store import write_features
+from sharding import ShardedStorage
+from similarity_index import SimilarCustomersIndex
+from snapshot import AnalyticsSnapshot
+from write_queue import GroupCommitWriter, WriterOverloaded
+import threading
+
+# sklearn, scipy та joblib імпортуються лише при навчанні, завантаженні .pkl
+# або з INFERENCE_BACKEND=sklearn: модель з артефакту обслуговується згорнутим
+# ядром NumPy
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(32)
@@ -20,12 +42,126 @@ CORS(app)
 
 JWT_SECRET = 'your-secret-key-here-change-in-production'
 
+# Режим запуску: 'eager' — БД та модель ініціалізуються при імпорті модуля,
+# 'lazy' — при першому запиті або явному виклику warmup() (app factory)
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'eager')
+
+# Максимальна кількість анкет в одному пакетному запиті
+MAX_BATCH_SIZE = 50000
+
+# Шлях інференсу: 'fused' (згорнуте ядро NumPy) або 'sklearn'
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'fused')
+
+# Кількість процесів для ініціалізацій KMeans при перенавчанні
+# (0 — класичний послідовний KMeans(n_init=20), -1 — всі ядра)
+TRAINING_N_JOBS = int(os.environ.get('TRAINING_N_JOBS', 0))
+
+# Метрики якості кожної версії моделі (версія → метрики)
+MODEL_METRICS_PATH = 'model_metrics.json'
+
+# Блокування, під яким воркери завантажують, навчають та публікують модель
+MODEL_LOCK = FileLock(MODEL_ARTIFACT_PATH + '.lock')
+
+# Як часто (секунди) воркер перевіряє, чи інший процес не опублікував нову модель
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 2.0))
+
+# Онлайн-оновлення центроїдів з кожної прийнятої анкети (streaming KMeans)
+ONLINE_UPDATES = os.environ.get('ONLINE_UPDATES', '0') == '1'
+
+# Як часто (секунди) онлайн-оновлені центроїди зберігаються в артефакт моделі
+ONLINE_CHECKPOINT_INTERVAL = float(os.environ.get('ONLINE_CHECKPOINT_INTERVAL', 300))
+
+# Найбільша кількість кластерів при підборі K
+MAX_SWEEP_K = 30
+
+# Найбільша кількість схожих клієнтів в одній відповіді
+MAX_SIMILAR_LIMIT = 100
+
+# Розмір LRU кешу передбачень за нормалізованими відповідями анкети
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 8192))
+
+# Коли відповідати на збереження анкети (див. write_queue.py): 'queued', 'commit',
+# 'fsync' — групові коміти одним потоком-записувачем; 'direct' — окрема
+# транзакція в обробнику запиту
+WRITE_ACK = os.environ.get('WRITE_ACK', 'commit')
+
+# Найбільша група анкет в одному коміті та найдовше очікування групи (мс)
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', 256))
+WRITE_BATCH_DELAY_MS = float(os.environ.get('WRITE_BATCH_DELAY_MS', 5))
+
+# Скільки секунд обробник чекає на коміт анкети
+WRITE_ACK_TIMEOUT = 30
+
 # ================== УЛУЧШЕННАЯ МОДЕЛЬ КЛАСТЕРИЗАЦИИ ==================
 
+class ModelSnapshot:
+    """Незмінний знімок навченої моделі.
+
+    Параметри моделі, згорнуте ядро, таблиця відповідей та кеш передбачень
+    публікуються разом заміною одного посилання, тому запити, що вже
+    виконуються, ніколи не бачать напівоновлену пару scaler/kmeans.
+    Після публікації знімок не змінюється. Об'єкти sklearn (scaler, kmeans)
+    є лише у знімків після навчання/joblib або для INFERENCE_BACKEND=sklearn.
+    """
+
+    def __init__(self, mean, scale, centers, metrics=None, scaler=None, kmeans=None,
+                 created_at=None, folded_centers=None, inv_scale=None):
+        self.mean = mean
+        self.scale = scale
+        self.centers = centers
+        self.scaler = scaler
+        self.kmeans = kmeans
+        self.kernel = FusedKMeansKernel(mean, scale, centers, folded_centers, inv_scale)
+        self.version = self.kernel.fingerprint
+        self.metrics = metrics or {}
+        self.created_at = created_at or datetime.now(timezone.utc).isoformat()
+        self.answer_table = None
+        self.cached_predict = None
+
+    @classmethod
+    def from_estimators(cls, scaler, kmeans, metrics=None):
+        """Знімок з навчених StandardScaler та KMeans"""
+        return cls(metrics=metrics, scaler=scaler, kmeans=kmeans,
+                   **params_from_estimators(scaler, kmeans))
+
+
 class AdvancedCustomerSegmentation:
-    def __init__(self):
-        self.scaler = StandardScaler()
-        self.kmeans = None
+    # Маппінг категоріальних відповідей опитування у числові значення
+    INCOME_MAP = {
+        'low': 30000,
+        'medium': 50000,
+        'high': 80000,
+        'very_high': 120000
+    }
+
+    AGE_MAP = {
+        '18-24': 21,
+        '25-34': 30,
+        '35-44': 40,
+        '45-54': 50,
+        '55+': 60
+    }
+
+    # Порядкові номери категорій для індексу таблиці відповідей
+    INCOME_INDEX = {level: i for i, level in enumerate(INCOME_MAP)}
+    AGE_INDEX = {group: i for i, group in enumerate(AGE_MAP)}
+
+    # Поведінкові слайдери опитування (шкала 1-10)
+    SLIDER_FIELDS = (
+        'price_sensitivity', 'online_shopping', 'brand_loyalty',
+        'innovation', 'social_influence', 'quality_importance'
+    )
+
+    def __init__(self, inference_backend=INFERENCE_BACKEND, cache_size=PREDICTION_CACHE_SIZE,
+                 online_updates=ONLINE_UPDATES):
+        if inference_backend not in ('fused', 'sklearn'):
+            raise ValueError(f"Невідомий шлях інференсу: {inference_backend}")
+        self.inference_backend = inference_backend
+        self.cache_size = cache_size
+        self.model = None
+        self._publish_lock = threading.Lock()
+        self._artifact_stamp = None
+        self._next_reload_check = 0.0
         self.cluster_profiles = {
             0: {
                 'name': 'Преміум клієнти',
@@ -54,13 +190,52 @@ class AdvancedCustomerSegmentation:
             }
         }
         self.load_or_train_model()
+        
+        self.online = None
+        if online_updates:
+            from online_updates import OnlineCentroidUpdater
+            
+            self.online = OnlineCentroidUpdater(
+                self, checkpoint_interval=ONLINE_CHECKPOINT_INTERVAL
+            )
+            # Незбережені оновлення записуються при зупинці процесу
+            atexit.register(self.online.flush)
+
+    # Поточна модель читається одним посиланням на знімок
+    scaler = property(lambda self: self.model.scaler)
+    kmeans = property(lambda self: self.model.kmeans)
+    kernel = property(lambda self: self.model.kernel)
+    answer_table = property(lambda self: self.model.answer_table)
 
     def load_or_train_model(self):
-        """Завантаження або тренування моделі на реалістичних даних"""
+        """Завантаження або тренування моделі на реалістичних даних.
+
+        Виконується під міжпроцесним блокуванням: якщо моделі ще немає,
+        навчає та публікує її лише один воркер, решта чекають на блокуванні
+        і завантажують вже готовий артефакт.
+        """
+        with MODEL_LOCK:
+            self._load_or_train_model()
+
+    def _load_or_train_model(self):
+        if os.path.exists(MODEL_ARTIFACT_PATH):
+            try:
+                self.load_artifact_model()
+                return
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Помилка завантаження артефакту: {e}. Пробуємо joblib...")
+        
         if os.path.exists('advanced_kmeans.pkl') and os.path.exists('advanced_scaler.pkl'):
             try:
-                self.kmeans = joblib.load('advanced_kmeans.pkl')
-                self.scaler = joblib.load('advanced_scaler.pkl')
+                import joblib
+                
+                kmeans = joblib.load('advanced_kmeans.pkl')
+                scaler = joblib.load('advanced_scaler.pkl')
+                snapshot = ModelSnapshot.from_estimators(scaler, kmeans)
+                snapshot.metrics = self.load_metrics().get(snapshot.version, {})
+                # Конвертуємо модель у компактний артефакт для наступних запусків
+                self.save_artifact(snapshot)
+                self.publish_model(snapshot)
                 print("✅ Модель завантажена з диску")
             except Exception as e:
                 print(f"⚠️ Помилка завантаження моделі: {e}. Створюємо нову...")
@@ -69,9 +244,131 @@ class AdvancedCustomerSegmentation:
             print("🔄 Створення нової моделі...")
             self.train_model_with_realistic_data()
 
-    def train_model_with_realistic_data(self):
-        """Генерація реалістичних даних на основі характеристик кластерів"""
-        np.random.seed(42)
+    def load_artifact_model(self):
+        """Завантаження та публікація моделі з артефакту (масиви через mmap)"""
+        stat = os.stat(MODEL_ARTIFACT_PATH)
+        header, arrays = load_artifact(MODEL_ARTIFACT_PATH, mmap=ARTIFACT_MMAP)
+        self.publish_model(ModelSnapshot(
+            metrics=header['metrics'], created_at=header['created_at'], **arrays
+        ))
+        self._artifact_stamp = (stat.st_mtime_ns, stat.st_size)
+        print(f"✅ Модель завантажена з артефакту ({header['model_version']})")
+
+    def save_artifact(self, snapshot):
+        """Запис знімка у компактний артефакт моделі"""
+        with MODEL_LOCK:
+            save_artifact(
+                MODEL_ARTIFACT_PATH, snapshot.mean, snapshot.scale, snapshot.centers,
+                model_version=snapshot.version, cluster_profiles=self.cluster_profiles,
+                metrics=snapshot.metrics, created_at=snapshot.created_at
+            )
+            stat = os.stat(MODEL_ARTIFACT_PATH)
+            self._artifact_stamp = (stat.st_mtime_ns, stat.st_size)
+
+    def update_artifact(self, merge):
+        """Злиття з артефактом під міжпроцесним блокуванням.
+        
+        merge(current) отримує модель з артефакту (None, якщо його немає
+        або він пошкоджений) і повертає знімок, який записується замість неї.
+        """
+        with MODEL_LOCK:
+            try:
+                header, arrays = load_artifact(MODEL_ARTIFACT_PATH)
+                current = ModelSnapshot(
+                    metrics=header['metrics'], created_at=header['created_at'], **arrays
+                )
+            except (OSError, ValueError, KeyError):
+                current = None
+            snapshot = merge(current)
+            self.save_artifact(snapshot)
+        return snapshot
+
+    def reload_if_updated(self):
+        """Підхоплення моделі, опублікованої іншим процесом (не частіше MODEL_RELOAD_INTERVAL)"""
+        now = time.monotonic()
+        if now < self._next_reload_check:
+            return False
+        self._next_reload_check = now + MODEL_RELOAD_INTERVAL
+        
+        try:
+            stat = os.stat(MODEL_ARTIFACT_PATH)
+            if (stat.st_mtime_ns, stat.st_size) == self._artifact_stamp:
+                return False
+            
+            with MODEL_LOCK:
+                with open(MODEL_ARTIFACT_PATH, 'rb') as f:
+                    header, _ = read_header(f)
+                if header['model_version'] == self.model.version:
+                    stat = os.stat(MODEL_ARTIFACT_PATH)
+                    self._artifact_stamp = (stat.st_mtime_ns, stat.st_size)
+                    return False
+                self.load_artifact_model()
+                return True
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ Не вдалося перевірити артефакт моделі: {e}")
+            return False
+
+    @staticmethod
+    def load_metrics():
+        """Збережені метрики всіх версій моделі"""
+        try:
+            with open(MODEL_METRICS_PATH, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_metrics(self, version, metrics):
+        """Збереження метрик версії моделі поруч з файлами моделі"""
+        history = self.load_metrics()
+        history[version] = metrics
+        with open(MODEL_METRICS_PATH + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(history, f, ensure_ascii=False, indent=2)
+        os.replace(MODEL_METRICS_PATH + '.tmp', MODEL_METRICS_PATH)
+
+    def publish_model(self, snapshot, replace=None):
+        """Підготовка знімка (ядро, кеш, таблиця відповідей) та атомарна заміна моделі.
+
+        З replace модель замінюється, лише якщо поточна досі replace
+        (інакше повертає False): так онлайн-оновлення не перезапише
+        модель, опубліковану перенавчанням.
+        """
+        if self.inference_backend == 'sklearn' and snapshot.kmeans is None:
+            snapshot.scaler, snapshot.kmeans = estimators_from_params(
+                snapshot.mean, snapshot.scale, snapshot.centers
+            )
+        snapshot.cached_predict = lru_cache(maxsize=self.cache_size)(
+            lambda key: self._predict_answers(snapshot, key)
+        )
+        # Таблиця відповідей використовується лише якщо побудована для цієї моделі
+        snapshot.answer_table = AnswerTable.open(
+            snapshot.version, len(self.INCOME_MAP), len(self.AGE_MAP)
+        )
+        if snapshot.answer_table is not None:
+            print(f"✅ Таблиця відповідей підключена ({snapshot.version})")
+
+        with self._publish_lock:
+            if replace is not None and self.model is not replace:
+                return False
+            self.model = snapshot
+        return True
+
+    def build_answer_table(self):
+        """Побудова таблиці кластерів для всього простору відповідей поточної моделі"""
+        model = self.model
+        paths = build_answer_table(
+            model.kernel, list(self.INCOME_MAP.values()), list(self.AGE_MAP.values())
+        )
+        # Перепублікація знімка, щоб підхопити нову таблицю
+        self.publish_model(ModelSnapshot(
+            model.mean, model.scale, model.centers, model.metrics,
+            model.scaler, model.kmeans, model.created_at
+        ))
+        return paths
+
+    @staticmethod
+    def generate_realistic_data():
+        """Синтетичні дані (2240 × 7) на основі характеристик 5 кластерів"""
+        rng = np.random.RandomState(42)
         n_samples = 2240  # Відповідає розміру Kaggle датасета
         
         # Детальні параметри для кожного кластера
@@ -112,60 +409,140 @@ class AdvancedCustomerSegmentation:
         for cluster_id, params in cluster_params.items():
             cluster_size = n_samples // 5
             cluster_data = np.column_stack([
-                np.random.normal(params['income'][0], params['income'][1], cluster_size),
-                np.random.normal(params['age'][0], params['age'][1], cluster_size),
-                np.random.normal(params['spending'][0], params['spending'][1], cluster_size),
-                np.random.normal(params['purchases'][0], params['purchases'][1], cluster_size),
-                np.random.normal(params['web_visits'][0], params['web_visits'][1], cluster_size),
-                np.random.binomial(2, params['kids'][0]/2, cluster_size),
-                np.random.normal(params['recency'][0], params['recency'][1], cluster_size)
+                rng.normal(params['income'][0], params['income'][1], cluster_size),
+                rng.normal(params['age'][0], params['age'][1], cluster_size),
+                rng.normal(params['spending'][0], params['spending'][1], cluster_size),
+                rng.normal(params['purchases'][0], params['purchases'][1], cluster_size),
+                rng.normal(params['web_visits'][0], params['web_visits'][1], cluster_size),
+                rng.binomial(2, params['kids'][0]/2, cluster_size),
+                rng.normal(params['recency'][0], params['recency'][1], cluster_size)
             ])
             X.append(cluster_data)
 
         X = np.vstack(X)
         X = np.abs(X)  # Уникаем отрицательных значений
+        return X
+
+    def train_model_with_realistic_data(self, report=None, n_jobs=TRAINING_N_JOBS):
+        """Генерація реалістичних даних на основі характеристик кластерів.
+
+        Нова модель навчається в локальних змінних і публікується одним
+        знімком лише після збереження. report(stage, progress) — необов'язковий
+        колбек прогресу фонової задачі. n_jobs != 0 вмикає паралельні
+        ініціалізації KMeans з детермінованими seed. Повертає метрики моделі.
+        """
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.cluster import KMeans
+        from parallel_kmeans import fit_kmeans_multi_init
+        from cluster_metrics import evaluate_clustering
+        
+        report = report or (lambda stage, progress=None: None)
+        report('generating', 0.05)
+        X = self.generate_realistic_data()
         
         # Нормализация данных
-        self.scaler.fit(X)
-        X_scaled = self.scaler.transform(X)
+        scaler = StandardScaler()
+        scaler.fit(X)
+        X_scaled = scaler.transform(X)
         
         # Обучение модели с оптимальными параметрами
-        self.kmeans = KMeans(
-            n_clusters=5,
-            init='k-means++',
-            n_init=20,
-            max_iter=300,
-            random_state=42
-        )
-        self.kmeans.fit(X_scaled)
+        report('fitting', 0.1)
+        init_report = None
+        if n_jobs:
+            kmeans, init_report = fit_kmeans_multi_init(
+                X_scaled, n_clusters=5, n_init=20, max_iter=300,
+                random_state=42, n_jobs=n_jobs
+            )
+            print(f"KMeans: {init_report['n_init']} ініціалізацій за {init_report['wall_time']:.2f} с")
+        else:
+            kmeans = KMeans(
+                n_clusters=5,
+                init='k-means++',
+                n_init=20,
+                max_iter=300,
+                random_state=42
+            )
+            kmeans.fit(X_scaled)
         
-        # Оценка качества модели
-        labels = self.kmeans.labels_
-        score = silhouette_score(X_scaled, labels)
+        # Оценка качества модели (silhouette на стратифікованій вибірці)
+        report('scoring', 0.7)
+        quality = evaluate_clustering(X_scaled, kmeans.cluster_centers_, kmeans.labels_)
+        score = quality['silhouette']['value']
         print(f"Silhouette Score: {score:.3f} (чем ближе к 1, тем лучше)")
+        metrics = {
+            'source': 'synthetic',
+            'silhouette': score,
+            'inertia': float(kmeans.inertia_),
+            'n_samples': int(len(X)),
+            'n_clusters': int(kmeans.n_clusters),
+            'quality': quality
+        }
+        if init_report:
+            metrics['initializations'] = init_report
+        
+        report('saving', 0.9)
+        return self.save_and_publish(scaler, kmeans, metrics)
+
+    def train_model_from_dataset(self, report=None, path=None):
+        """Позаядерне навчання на реальному Kaggle датасеті (або вивантаженні в тій же схемі)"""
+        from kaggle_training import KAGGLE_DATASET_PATH, train_from_dataset
         
-        # Сохранение модели
-        joblib.dump(self.kmeans, 'advanced_kmeans.pkl')
-        joblib.dump(self.scaler, 'advanced_scaler.pkl')
+        report = report or (lambda stage, progress=None: None)
+        scaler, kmeans, metrics = train_from_dataset(path or KAGGLE_DATASET_PATH, report=report)
+        print(f"Inertia: {metrics['inertia']:.1f} на {metrics['n_samples']} записах")
+        
+        report('saving', 0.9)
+        return self.save_and_publish(scaler, kmeans, metrics)
+
+    def sweep_clusters(self, report=None, k_values=range(2, 11), source='synthetic',
+                       n_init=10, n_jobs=-1):
+        """Підбір кількості кластерів: метрики KMeans для кожного K (модель не змінюється)"""
+        from sklearn.preprocessing import StandardScaler
+        from parallel_kmeans import sweep_k
+        
+        report = report or (lambda stage, progress=None: None)
+        report('loading', 0.05)
+        if source == 'kaggle':
+            from kaggle_training import KAGGLE_DATASET_PATH, sample_features
+            
+            # Рівномірна вибірка фіксованого розміру: пам'ять не залежить від розміру файлу
+            X, dataset_rows = sample_features(KAGGLE_DATASET_PATH)
+        else:
+            X = self.generate_realistic_data()
+            dataset_rows = len(X)
+        
+        # Масштабування один раз для всіх K
+        X_scaled = StandardScaler().fit_transform(X)
+        
+        report('fitting', 0.1)
+        result = sweep_k(X_scaled, list(k_values), n_init=n_init, n_jobs=n_jobs)
+        print(f"Підбір K: {len(result['results'])} значень за {result['wall_time']:.2f} с")
+        return dict(result, source=source, dataset_rows=dataset_rows)
+
+    def save_and_publish(self, scaler, kmeans, metrics):
+        """Збереження навченої моделі на диск та публікація нового знімка"""
+        import joblib
+        
+        snapshot = ModelSnapshot.from_estimators(scaler, kmeans, metrics)
+        # Файли моделі пише лише один процес одночасно
+        with MODEL_LOCK:
+            # Через тимчасові файли, щоб не залишити пошкоджений .pkl
+            joblib.dump(kmeans, 'advanced_kmeans.pkl.tmp')
+            joblib.dump(scaler, 'advanced_scaler.pkl.tmp')
+            os.replace('advanced_kmeans.pkl.tmp', 'advanced_kmeans.pkl')
+            os.replace('advanced_scaler.pkl.tmp', 'advanced_scaler.pkl')
+            
+            self.save_artifact(snapshot)
+            self.save_metrics(snapshot.version, metrics)
+        self.publish_model(snapshot)
         print("✅ Модель успішно навчена та збережена")
+        return dict(metrics, model_version=snapshot.version)
 
     def map_user_data_to_features(self, user_data):
         """Точне перетворення відповідей користувача у числові фічі"""
         # Маппінг категоріальних ознак
-        income_map = {
-            'low': 30000,
-            'medium': 50000,
-            'high': 80000,
-            'very_high': 120000
-        }
-        
-        age_map = {
-            '18-24': 21,
-            '25-34': 30,
-            '35-44': 40,
-            '45-54': 50,
-            '55+': 60
-        }
+        income_map = self.INCOME_MAP
+        age_map = self.AGE_MAP
         
         education_map = {
             'Середня': 1,
@@ -217,101 +594,270 @@ class AdvancedCustomerSegmentation:
         
         return features[:7]  # Використовуємо перші 7 для сумісності
 
+    def map_users_data_to_features(self, users_data):
+        """Векторне перетворення списку анкет у матрицю фіч (n × 7).
+
+        Повертає матрицю фіч та маску коректних записів. Записи, які
+        одиночний predict_cluster відхилив би з помилкою (не словник,
+        нечислові слайдери, нерядкові income_level чи age_group),
+        позначаються як некоректні.
+        """
+        n = len(users_data)
+        valid = np.fromiter((isinstance(d, dict) for d in users_data), dtype=bool, count=n)
+        records = [d if ok else {} for d, ok in zip(users_data, valid)]
+        slider_rows = [[d.get(f, 5) for f in self.SLIDER_FIELDS] for d in records]
+
+        # Повна перевірка типів лише якщо у пакеті трапились нечислові значення
+        if not {type(v) for row in slider_rows for v in row} <= {int, float, bool}:
+            numeric = np.fromiter(
+                (all(isinstance(v, (int, float)) for v in row) for row in slider_rows),
+                dtype=bool, count=n
+            )
+            valid &= numeric
+            slider_rows = [row if ok else [5] * len(row) for row, ok in zip(slider_rows, numeric)]
+
+        categories = [(d.get('income_level', 'medium'), d.get('age_group', '25-34'))
+                      for d in records]
+        if not {type(v) for pair in categories for v in pair} <= {str}:
+            # Список чи словник у категорії зламав би пошук у мапі для всього пакета
+            textual = np.fromiter(
+                (all(isinstance(v, str) for v in pair) for pair in categories),
+                dtype=bool, count=n
+            )
+            valid &= textual
+            categories = [pair if ok else ('medium', '25-34')
+                          for pair, ok in zip(categories, textual)]
+
+        income = np.fromiter(
+            (self.INCOME_MAP.get(income_level, 50000) for income_level, _ in categories),
+            dtype=float, count=n
+        )
+        age = np.fromiter(
+            (self.AGE_MAP.get(age_group, 30) for _, age_group in categories),
+            dtype=float, count=n
+        )
+        has_children = np.fromiter(
+            (1.0 if d.get('has_children') else 0.0 for d in records),
+            dtype=float, count=n
+        )
+        sliders = np.array(slider_rows, dtype=float).reshape(n, len(self.SLIDER_FIELDS))
+
+        features = answers_to_features(income, age, has_children, sliders)
+        valid &= np.isfinite(features).all(axis=1)
+        return features, valid
+
+    def build_result(self, cluster_id, confidence):
+        """Формування відповіді для визначеного кластера"""
+        profile = self.cluster_profiles[cluster_id]
+        return {
+            'cluster_id': int(cluster_id),
+            'cluster_name': profile['name'],
+            'description': profile['description'],
+            'confidence': float(confidence),
+            'marketing_strategy': profile['marketing']
+        }
+
+    @staticmethod
+    def fallback_result():
+        """Відповідь при збої визначення кластера"""
+        return {
+            'cluster_id': 0,
+            'cluster_name': 'Не визначено',
+            'description': 'Тимчасовий технічний збій у визначенні кластера',
+            'confidence': 0.75,
+            'marketing_strategy': 'Стандартна стратегія'
+        }
+
+    def answers_key(self, user_data):
+        """Нормалізований ключ анкети для кешу (лише відповіді, що впливають на фічі).
+
+        Повертає None, якщо анкету не можна кешувати (нечислові слайдери тощо).
+        """
+        try:
+            income_level = user_data.get('income_level', 'medium')
+            age_group = user_data.get('age_group', '25-34')
+            sliders = tuple(user_data.get(f, 5) for f in self.SLIDER_FIELDS)
+            if not all(isinstance(v, (int, float)) for v in sliders):
+                return None
+            return (
+                income_level if income_level in self.INCOME_MAP else 'medium',
+                age_group if age_group in self.AGE_MAP else '25-34',
+                bool(user_data.get('has_children'))
+            ) + sliders
+        except (AttributeError, TypeError):
+            return None
+
+    def _predict_answers(self, model, key):
+        """Визначення кластера за нормалізованим ключем (обгортається LRU кешем знімка)"""
+        income_level, age_group, has_children = key[:3]
+        user_data = dict(zip(self.SLIDER_FIELDS, key[3:]))
+        user_data.update(income_level=income_level, age_group=age_group, has_children=has_children)
+        return self._predict(model, user_data)
+
+    def _predict(self, model, user_data):
+        """Визначення кластера без кешу та обробки помилок"""
+        # Перетворення даних користувача
+        features = self.map_user_data_to_features(user_data)
+        
+        if self.inference_backend == 'fused':
+            # Один прохід: мітка, відстані та впевненість
+            labels, confidences = model.kernel.predict(features)
+            return self.build_result(labels[0], confidences[0])
+        
+        from scipy.spatial.distance import cdist
+        
+        features_scaled = model.scaler.transform([features])
+        
+        # Передбачення кластера
+        cluster_id = model.kmeans.predict(features_scaled)[0]
+        
+        # Розрахунок відстаней до всіх центроїдів
+        distances = cdist(features_scaled, model.kmeans.cluster_centers_, 'euclidean')
+        
+        # Нормалізація впевненості від 0.7 до 0.97
+        confidence = confidence_from_distances(distances, [cluster_id])[0]
+        
+        return self.build_result(cluster_id, confidence)
+
     def predict_cluster(self, user_data):
         """Покращений метод визначення кластера з точністю"""
         try:
-            # Перетворення даних користувача
-            features = self.map_user_data_to_features(user_data)
-            features_scaled = self.scaler.transform([features])
+            # Один знімок моделі на весь запит
+            model = self.model
+            key = self.answers_key(user_data)
+            if key is None:
+                return self._predict(model, user_data)
             
-            # Передбачення кластера
-            cluster_id = self.kmeans.predict(features_scaled)[0]
+            table = model.answer_table
+            if table is not None:
+                position = table.index(
+                    self.INCOME_INDEX[key[0]], self.AGE_INDEX[key[1]], key[2], key[3:]
+                )
+                if position is not None:
+                    return self.build_result(*table.lookup(position))
             
-            # Розрахунок відстаней до всіх центроїдів
-            distances = cdist(features_scaled, self.kmeans.cluster_centers_, 'euclidean')[0]
-            
-            # Нормалізація впевненості від 0.7 до 0.97
-            min_dist = np.min(distances)
-            max_dist = np.max(distances)
+            # Копія, щоб виклики не змінювали закешований результат
+            return dict(model.cached_predict(key))
+        except Exception as e:
+            print(f"❌ Помилка передбачення: {e}")
+            return self.fallback_result()
+
+    def prediction_cache_info(self):
+        """Статистика LRU кешу передбачень"""
+        info = self.model.cached_predict.cache_info()
+        total = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'max_size': info.maxsize,
+            'hit_rate': info.hits / total if total else 0.0
+        }
+
+    def observe(self, user_data):
+        """Передача прийнятої анкети онлайн-оновленню центроїдів (якщо увімкнене)"""
+        if self.online is not None:
+            self.online.submit(user_data)
+
+    def score_features(self, model, features):
+        """Мітки кластерів та впевненість для матриці фіч (n × 7) одним проходом"""
+        if self.inference_backend == 'fused':
+            return model.kernel.predict(features)
+        
+        from scipy.spatial.distance import cdist
+        
+        features_scaled = model.scaler.transform(features)
+        distances = cdist(features_scaled, model.kmeans.cluster_centers_, 'euclidean')
+        labels = distances.argmin(axis=1)
+        return labels, confidence_from_distances(distances, labels)
+
+    def rescore_profiles(self, report=None):
+        """Перерахунок збережених профілів клієнтів поточною моделлю"""
+        from rescoring import rescore_profiles
+        
+        report = report or (lambda stage, progress=None: None)
+        totals = {'rescored': 0, 'backfilled': 0, 'invalid': 0, 'elapsed': 0.0}
+        for shard, db_path in enumerate(storage.paths):
+            # Прогрес шарда — його частка загального прогресу
+            def shard_report(stage, progress=None, shard=shard):
+                report(stage, None if progress is None else (shard + progress) / storage.count)
             
-            if max_dist - min_dist > 0:
-                raw_confidence = 1 - ((distances[cluster_id] - min_dist) / (max_dist - min_dist))
-                confidence = 0.7 + raw_confidence * 0.27  # Масштабуємо до 0.7-0.97
-            else:
-                confidence = 0.85  # Значення за замовчуванням, якщо всі відстані рівні
+            result = rescore_profiles(self, db_path=db_path, report=shard_report,
+                                      on_update=profile_columns.update_clusters)
+            analytics_snapshots[shard].note_writes(result['rescored'])
+            for name in totals:
+                totals[name] += result[name]
+        
+        result.update(totals)
+        result['rows_per_second'] = (totals['rescored'] / totals['elapsed']
+                                     if totals['elapsed'] else 0.0)
+        return result
+
+    def predict_clusters(self, users_data):
+        """Пакетне визначення кластерів одним векторизованим проходом"""
+        results = [None] * len(users_data)
+        model = self.model
+        try:
+            features, valid = self.map_users_data_to_features(users_data)
+            rows = np.flatnonzero(valid)
+            if len(rows) == 0:
+                return [self.fallback_result() for _ in results]
             
-            # Гарантуємо розумні межі
-            confidence = max(0.7, min(0.97, confidence))
+            labels, confidences = self.score_features(model, features[rows])
             
-            return {
-                'cluster_id': int(cluster_id),
-                'cluster_name': self.cluster_profiles[cluster_id]['name'],
-                'description': self.cluster_profiles[cluster_id]['description'],
-                'confidence': float(confidence),
-                'marketing_strategy': self.cluster_profiles[cluster_id]['marketing']
-            }
+            for row, cluster_id, confidence in zip(rows, labels, confidences):
+                results[row] = self.build_result(cluster_id, confidence)
         except Exception as e:
-            print(f"❌ Помилка передбачення: {e}")
-            return {
-                'cluster_id': 0,
-                'cluster_name': 'Не визначено',
-                'description': 'Тимчасовий технічний збій у визначенні кластера',
-                'confidence': 0.75,
-                'marketing_strategy': 'Стандартна стратегія'
-            }
+            print(f"❌ Помилка пакетного передбачення: {e}")
+
+        return [result or self.fallback_result() for result in results]
 
 # ================== БАЗА ДАНИХ ==================
 
 def init_db():
-    """Ініціалізація БД (без змін)"""
-    conn = sqlite3.connect('profiling.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            name TEXT NOT NULL,
-            role TEXT NOT NULL CHECK(role IN ('client', 'admin')),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS client_profiles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            age_group TEXT,
-            income_level TEXT,
-            education TEXT,
-            marital_status TEXT,
-            has_children INTEGER,
-            price_sensitivity INTEGER,
-            online_shopping INTEGER,
-            brand_loyalty INTEGER,
-            innovation INTEGER,
-            social_influence INTEGER,
-            quality_importance INTEGER,
-            cluster_id INTEGER,
-            cluster_name TEXT,
-            cluster_confidence REAL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-    ''')
+    """Ініціалізація БД: міграції схеми шардів (див. migrations.py, sharding.py) та адмін"""
+    storage.init()
     
     # Створюємо адміна (без змін)
     admin_pass = hashlib.sha256('admin123'.encode()).hexdigest()
-    cursor.execute('''
-        INSERT OR IGNORE INTO users (email, password_hash, name, role)
-        VALUES ('admin@system.ua', ?, 'Адміністратор', 'admin')
-    ''', (admin_pass,))
+    try:
+        storage.create_user('admin@system.ua', admin_pass, 'Адміністратор', 'admin')
+    except sqlite3.IntegrityError:
+        pass
     
-    conn.commit()
-    conn.close()
     print("✅ База даних готова")
 
+def store_questionnaire(conn, user_id, data, cluster_result, features, model, model_version):
+    """Запис анкети, кластера, статистики кластерів та вектора фіч у поточній транзакції.
+
+    Повертає True, якщо профіль оновлено.
+    """
+    cursor = conn.execute('''
+        UPDATE client_profiles 
+        SET age_group = ?, income_level = ?, education = ?, marital_status = ?,
+            has_children = ?, price_sensitivity = ?, online_shopping = ?,
+            brand_loyalty = ?, innovation = ?, social_influence = ?,
+            quality_importance = ?, cluster_id = ?, cluster_name = ?,
+            cluster_confidence = ?, model_version = ?
+        WHERE user_id = ? AND cluster_id IS NULL
+    ''', (
+        data.get('age_group'), data.get('income_level'), data.get('education'),
+        data.get('marital_status'), 1 if data.get('has_children') else 0,
+        data.get('price_sensitivity'), data.get('online_shopping'),
+        data.get('brand_loyalty'), data.get('innovation'),
+        data.get('social_influence'), data.get('quality_importance'),
+        cluster_result['cluster_id'], cluster_result['cluster_name'],
+        cluster_result['confidence'], model_version, user_id
+    ))
+    if not cursor.rowcount:
+        return False
+    
+    update_cluster_stats(conn, added=[(cluster_result['cluster_name'],
+                                       cluster_result['confidence'])])
+    if features is not None:
+        write_features(conn, [user_id], features, model, model_version)
+    return True
+
 # ================== ТОКЕНИ ==================
 
 def generate_token(user_id, role, name):
@@ -346,32 +892,116 @@ def get_current_user():
 
 # ================== ІНІЦІАЛІЗАЦІЯ ==================
 
-init_db()
-segmentation = AdvancedCustomerSegmentation()
+segmentation = None
+similar_customers = None
+jobs = JobRegistry()
+# Шарди БД та їхні пули з'єднань; з'єднання створюються при першому запиті
+# (див. sharding.py, db.py)
+storage = ShardedStorage()
+# Адмін-запити читають знімки шардів, що оновлюються у фоні (див. snapshot.py)
+analytics_snapshots = [AnalyticsSnapshot(pool, source=path)
+                       for pool, path in zip(storage.pools, storage.paths)]
+# Потоки-записувачі анкет (по одному на шард) запускаються при першій анкеті
+write_queues = None
+if WRITE_ACK != 'direct':
+    write_queues = [GroupCommitWriter(path, ack=WRITE_ACK, max_batch=WRITE_BATCH_SIZE,
+                                      max_delay=WRITE_BATCH_DELAY_MS / 1000)
+                    for path in storage.paths]
+    for writer in write_queues:
+        atexit.register(writer.flush)
+
+def writer_for(user_id):
+    """Записувач шарда користувача (None у режимі WRITE_ACK='direct')"""
+    return write_queues[storage.shard_of(user_id)] if write_queues else None
+
+def admin_acquire(shard):
+    """З'єднання зі знімком шарда для адмін-запитів"""
+    return analytics_snapshots[shard].acquire()
+
+# Агрегати дашборду (див. analytics.py)
+analytics_cache = AnalyticsCache()
+# Профілі в пам'яті по стовпцях для сегментів адмін-панелі (див. columnar_store.py)
+profile_columns = ColumnarProfileStore(storage)
+
+_warmup_lock = threading.Lock()
+_ready = threading.Event()
+startup_timings = {}
+
+def warmup():
+    """Ініціалізація БД та моделі (ідемпотентна, безпечна для потоків).
+
+    У режимі 'lazy' викликається при першому запиті або явно, наприклад
+    з post_fork хука воркера.
+    """
+    global segmentation, similar_customers
+    if _ready.is_set():
+        return
+    
+    with _warmup_lock:
+        if _ready.is_set():
+            return
+        
+        start = time.perf_counter()
+        init_db()
+        db_ready = time.perf_counter()
+        segmentation = AdvancedCustomerSegmentation()
+        # Індекс завантажується з диску при першому пошуку схожих клієнтів
+        similar_customers = SimilarCustomersIndex(segmentation, storage)
+        model_ready = time.perf_counter()
+        
+        startup_timings.update({
+            'db_init_ms': (db_ready - start) * 1000,
+            'model_init_ms': (model_ready - db_ready) * 1000,
+            'ready_at': datetime.now(timezone.utc).isoformat()
+        })
+        _ready.set()
+
+def create_app(warm=False):
+    """App factory: повертає застосунок без ініціалізації БД та моделі.
+
+    Ініціалізація відбудеться при першому запиті або відразу з warm=True.
+    """
+    if warm:
+        warmup()
+    return app
+
+@app.before_request
+def ensure_warm():
+    """Відкладена ініціалізація при першому запиті (крім перевірки готовності)"""
+    if not _ready.is_set() and request.endpoint != 'readiness':
+        warmup()
+    if _ready.is_set():
+        # Модель могла бути перенавчена в іншому воркері
+        segmentation.reload_if_updated()
+
+if STARTUP_MODE == 'eager':
+    warmup()
 
 # ================== API ENDPOINTS ==================
 
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """Перевірка готовності: БД та модель ініціалізовані"""
+    if not _ready.is_set():
+        return jsonify({'ready': False, 'startup_mode': STARTUP_MODE}), 503
+    
+    return jsonify({
+        'ready': True,
+        'startup_mode': STARTUP_MODE,
+        'model_version': segmentation.model.version,
+        'timings': startup_timings
+    })
+
 @app.route('/api/register', methods=['POST'])
 def register():
-    """Реєстрація (без змін)"""
+    """Реєстрація (email перевіряється довідником шардів, див. sharding.py)"""
     data = request.json
-    conn = sqlite3.connect('profiling.db')
-    cursor = conn.cursor()
     
     try:
         password_hash = hashlib.sha256(data['password'].encode()).hexdigest()
-        cursor.execute('''
-            INSERT INTO users (email, password_hash, name, role)
-            VALUES (?, ?, ?, 'client')
-        ''', (data['email'], password_hash, data['name']))
-        
-        user_id = cursor.lastrowid
-        
-        cursor.execute('''
-            INSERT INTO client_profiles (user_id) VALUES (?)
-        ''', (user_id,))
-        
-        conn.commit()
+        user_id = storage.create_user(data['email'], password_hash, data['name'])
+        analytics_snapshots[storage.shard_of(user_id)].note_writes()
+        profile_columns.add_client(user_id)
         
         token = generate_token(user_id, 'client', data['name'])
         
@@ -384,14 +1014,14 @@ def register():
         })
     except sqlite3.IntegrityError:
         return jsonify({'error': 'Email вже існує'}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/login', methods=['POST'])
 def login():
-    """Вхід (без змін)"""
+    """Вхід (шард користувача знаходить довідник за email)"""
     data = request.json
-    conn = sqlite3.connect('profiling.db')
+    conn = storage.acquire_for_email(data['email'])
+    if conn is None:
+        return jsonify({'error': 'Невірні дані'}), 401
     cursor = conn.cursor()
     
     password_hash = hashlib.sha256(data['password'].encode()).hexdigest()
@@ -425,7 +1055,7 @@ def check_questionnaire():
     if not user:
         return jsonify({'error': 'Неавторизований'}), 401
     
-    conn = sqlite3.connect('profiling.db')
+    conn = storage.acquire(user['user_id'])
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -436,52 +1066,206 @@ def check_questionnaire():
     result = cursor.fetchone()
     conn.close()
     
-    return jsonify({'completed': result is not None})
+    # Прийнята анкета, що ще чекає на груповий коміт
+    writer = writer_for(user['user_id'])
+    pending = writer is not None and writer.is_pending(user['user_id'])
+    return jsonify({'completed': result is not None or pending})
 
 @app.route('/api/questionnaire', methods=['POST'])
 def submit_questionnaire():
-    """Збереження опитування (інтерфейс без змін, логіка покращена)"""
+    """Збереження опитування: кластер рахується одразу, запис — груповим комітом"""
     user = get_current_user()
     if not user:
         return jsonify({'error': 'Неавторизований'}), 401
+    user_id = user['user_id']
+    writer = writer_for(user_id)
+    
+    # Некоректне тіло запиту відхиляється до резервування анкети
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Некоректні дані анкети'}), 400
     
-    conn = sqlite3.connect('profiling.db')
+    conn = storage.acquire(user_id)
     cursor = conn.cursor()
     
     cursor.execute('''
         SELECT cluster_id FROM client_profiles WHERE user_id = ? AND cluster_id IS NOT NULL
-    ''', (user['user_id'],))
+    ''', (user_id,))
+    completed = cursor.fetchone()
+    conn.close()
     
-    if cursor.fetchone():
-        conn.close()
+    if completed:
         return jsonify({'error': 'Опитування вже пройдено'}), 400
     
-    data = request.json
-    cluster_result = segmentation.predict_cluster(data)
+    # Анкета цього користувача вже в черзі на запис
+    if writer is not None and not writer.reserve(user_id):
+        return jsonify({'error': 'Опитування вже пройдено'}), 400
     
-    cursor.execute('''
-        UPDATE client_profiles 
-        SET age_group = ?, income_level = ?, education = ?, marital_status = ?,
-            has_children = ?, price_sensitivity = ?, online_shopping = ?,
-            brand_loyalty = ?, innovation = ?, social_influence = ?,
-            quality_importance = ?, cluster_id = ?, cluster_name = ?,
-            cluster_confidence = ?
-        WHERE user_id = ?
-    ''', (
-        data.get('age_group'), data.get('income_level'), data.get('education'),
-        data.get('marital_status'), 1 if data.get('has_children') else 0,
-        data.get('price_sensitivity'), data.get('online_shopping'),
-        data.get('brand_loyalty'), data.get('innovation'),
-        data.get('social_influence'), data.get('quality_importance'),
-        cluster_result['cluster_id'], cluster_result['cluster_name'],
-        cluster_result['confidence'], user['user_id']
-    ))
+    # Резервування знімається на кожному шляху, що не передав запис записувачу
+    submitted = False
+    try:
+        model = segmentation.model
+        model_version = model.version
+        cluster_result = segmentation.predict_cluster(data)
+        
+        # Вектор фіч у сховище (анкети з некоректними відповідями не зберігаються)
+        try:
+            features = np.array([segmentation.map_user_data_to_features(data)], dtype=float)
+        except (AttributeError, TypeError, ValueError):
+            features = None
+        if features is not None and not np.isfinite(features).all():
+            features = None
+        
+        def store(conn):
+            return store_questionnaire(conn, user_id, data, cluster_result, features,
+                                       model, model_version)
+        
+        def after_commit(stored):
+            if stored:
+                segmentation.observe(data)
+                if features is not None:
+                    # Той самий вектор, що записано у сховище фіч, без читання з БД
+                    similar_customers.add(user_id, features[0])
+                profile_columns.update_profile(user_id, data, cluster_result)
+                analytics_snapshots[storage.shard_of(user_id)].note_writes()
+        
+        if writer is None:
+            conn = storage.acquire(user_id)
+            stored = store(conn)
+            conn.commit()
+            conn.close()
+            after_commit(stored)
+        else:
+            stored = True
+            try:
+                future = writer.submit(user_id, store, after_commit)
+            except WriterOverloaded:
+                return jsonify({'error': 'Сервер перевантажений, спробуйте пізніше'}), 503
+            submitted = True
+            if writer.ack != 'queued':
+                try:
+                    stored = future.result(timeout=WRITE_ACK_TIMEOUT)
+                except FutureTimeoutError:
+                    # Запис лишається в черзі й буде закомічений: повтор не потрібен
+                    return jsonify({'success': True, 'pending': True,
+                                    'profile': cluster_result}), 202
+                except Exception as e:
+                    print(f"❌ Анкету {user_id} не збережено: {e}")
+                    return jsonify({'error': 'Не вдалося зберегти анкету, спробуйте ще раз'}), 500
+    finally:
+        if writer is not None and not submitted:
+            writer.release(user_id)
     
-    conn.commit()
-    conn.close()
+    # Паралельний запит цього ж користувача встиг зберегти анкету раніше
+    if not stored:
+        return jsonify({'error': 'Опитування вже пройдено'}), 400
     
     return jsonify({'success': True, 'profile': cluster_result})
 
+@app.route('/api/predict/batch', methods=['POST'])
+def predict_batch():
+    """Пакетне визначення кластерів для імпорту клієнтів з CRM"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    data = request.json
+    records = data.get('records') if isinstance(data, dict) else data
+    
+    if not isinstance(records, list):
+        return jsonify({'error': 'Очікується список анкет у полі records'}), 400
+    if len(records) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Максимум {MAX_BATCH_SIZE} анкет за один запит'}), 413
+    
+    results = segmentation.predict_clusters(records)
+    return jsonify({'results': results, 'total': len(results)})
+
+@app.route('/api/similar/<int:user_id>', methods=['GET'])
+def get_similar_customers(user_id):
+    """Найближчі до клієнта профілі в масштабованому просторі фіч (lookalike аудиторії)"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    limit = request.args.get('limit', 10, type=int)
+    if not 1 <= limit <= MAX_SIMILAR_LIMIT:
+        return jsonify({'error': f'limit має бути від 1 до {MAX_SIMILAR_LIMIT}'}), 400
+    
+    features = similar_customers.profile_features(user_id)
+    if features is None:
+        return jsonify({'error': 'Клієнт ще не пройшов опитування'}), 404
+    
+    neighbours = similar_customers.query(features, k=limit, exclude=user_id)
+    
+    # Дані сусідів читаються з їхніх шардів паралельно
+    groups = storage.group_by_shard([neighbour_id for neighbour_id, _ in neighbours])
+    
+    def read_details(conn, shard):
+        placeholders = ','.join('?' * len(groups[shard]))
+        return conn.execute(f'''
+            SELECT u.id, u.name, u.email, p.cluster_id, p.cluster_name
+            FROM users u
+            JOIN client_profiles p ON u.id = p.user_id
+            WHERE u.id IN ({placeholders})
+        ''', groups[shard]).fetchall()
+    
+    details = {row[0]: row for rows in storage.fan_out(read_details, groups)
+               for row in rows}
+    
+    similar = []
+    for neighbour_id, distance in neighbours:
+        row = details.get(neighbour_id)
+        if row:
+            similar.append({
+                'user_id': neighbour_id, 'name': row[1], 'email': row[2],
+                'cluster_id': row[3], 'cluster_name': row[4],
+                'distance': distance
+            })
+    
+    return jsonify({'user_id': user_id, 'similar': similar, 'total': len(similar)})
+
+@app.route('/api/admin/model', methods=['GET'])
+def get_model_info():
+    """Поточна версія моделі та її метрики якості"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    model = segmentation.model
+    return jsonify({
+        'version': model.version,
+        'created_at': model.created_at,
+        'inference_backend': segmentation.inference_backend,
+        'answer_table': model.answer_table is not None,
+        'online_updates': segmentation.online.info() if segmentation.online else None,
+        'metrics': model.metrics
+    })
+
+@app.route('/api/admin/model/cache', methods=['GET'])
+def get_prediction_cache():
+    """Статистика кешу передбачень"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    return jsonify(segmentation.prediction_cache_info())
+
+@app.route('/api/admin/db', methods=['GET'])
+def get_db_health():
+    """Стан пулу з'єднань з БД: зайняті та вільні з'єднання, очікування, пінг"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    health = storage.health()
+    if write_queues is None:
+        health['write_queue'] = None
+    elif storage.sharded:
+        health['write_queue'] = [writer.info() for writer in write_queues]
+    else:
+        health['write_queue'] = write_queues[0].info()
+    return jsonify(health)
+
 @app.route('/api/my-profile', methods=['GET'])
 def get_my_profile():
     """Отримання профілю (без змін)"""
@@ -489,7 +1273,7 @@ def get_my_profile():
     if not user:
         return jsonify({'error': 'Неавторизований'}), 401
     
-    conn = sqlite3.connect('profiling.db')
+    conn = storage.acquire(user['user_id'])
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -528,7 +1312,7 @@ def get_recommendations():
     if not user:
         return jsonify({'error': 'Неавторизований'}), 401
     
-    conn = sqlite3.connect('profiling.db')
+    conn = storage.acquire(user['user_id'])
     cursor = conn.cursor()
     
     cursor.execute('SELECT cluster_id FROM client_profiles WHERE user_id = ?', (user['user_id'],))
@@ -559,91 +1343,298 @@ def get_recommendations():
 
 @app.route('/api/admin/clients', methods=['GET'])
 def get_all_clients():
-    """Всі клієнти для адміна (без змін)"""
+    """Сторінка клієнтів для адміна: фільтри, сортування та keyset-курсор.
+
+    Параметри: limit (до MAX_PAGE_SIZE), cursor (next_cursor попередньої
+    сторінки), sort (id, created_at, confidence), order (asc, desc), cluster,
+    min_confidence, max_confidence, created_from, created_to (РРРР-ММ-ДД).
+    Рядки сторінки передаються потоком по мірі читання зі знімка БД; при
+    кількох шардах сторінки шардів читаються паралельно та зливаються.
+    """
     user = get_current_user()
     if not user or user['role'] != 'admin':
         return jsonify({'error': 'Тільки для адміна'}), 403
     
-    conn = sqlite3.connect('profiling.db')
-    cursor = conn.cursor()
+    try:
+        query, params, limit, sort, order = clients_page_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    cursor.execute('''
-        SELECT u.id, u.name, u.email, u.created_at,
-               p.cluster_name, p.cluster_confidence
-        FROM users u
-        LEFT JOIN client_profiles p ON u.id = p.user_id
-        WHERE u.role = 'client'
-    ''')
-    
-    clients = []
-    for row in cursor.fetchall():
-        clients.append({
-            'id': row[0], 'name': row[1], 'email': row[2],
-            'created_at': row[3], 'cluster_name': row[4],
-            'cluster_confidence': row[5]
-        })
+    def read_page(conn, shard):
+        return conn.execute(query, params).fetchall()
     
-    conn.close()
-    return jsonify({'clients': clients, 'total': len(clients)})
+    def generate():
+        if storage.sharded:
+            conn = None
+            rows = merge_pages(storage.fan_out(read_page, acquire=admin_acquire), sort, order)
+        else:
+            conn = admin_acquire(0)
+            rows = conn.execute(query, params)
+        try:
+            yield '{"clients": ['
+            last = None
+            for count, row in enumerate(rows):
+                if count == limit:
+                    # Зайвий рядок: існує наступна сторінка
+                    break
+                yield (',' if last else '') + json.dumps(dict(zip(CLIENT_COLUMNS, row)),
+                                                         ensure_ascii=False)
+                last = row
+            has_more = last is not None and count == limit
+            yield '], ' + json.dumps({
+                'limit': limit,
+                'sort': sort,
+                'order': order,
+                'next_cursor': next_cursor(last, sort, order) if has_more else None
+            })[1:]
+        finally:
+            if conn is not None:
+                conn.close()
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/api/admin/clusters', methods=['GET'])
 def get_clusters():
-    """Статистика кластерів (без змін)"""
+    """Статистика кластерів з cluster_stats (оновлюється при записі, див. cluster_stats.py).
+
+    З фільтрами (cluster, income_level, ..., min_confidence, created_from, ...,
+    див. columnar_store.segment_filters) рахується колонковим сховищем профілів.
+    """
     user = get_current_user()
     if not user or user['role'] != 'admin':
         return jsonify({'error': 'Тільки для адміна'}), 403
     
-    conn = sqlite3.connect('profiling.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT cluster_name, COUNT(*), AVG(cluster_confidence)
-        FROM client_profiles
-        WHERE cluster_name IS NOT NULL
-        GROUP BY cluster_name
-    ''')
-    
-    clusters = []
-    for row in cursor.fetchall():
-        clusters.append({
-            'name': row[0], 'count': row[1],
-            'avg_confidence': row[2] or 0
-        })
+    try:
+        filters = segment_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if filters:
+        return jsonify(profile_columns.cluster_stats(filters))
     
-    conn.close()
-    return jsonify(clusters)
+    # Суми кластерів з усіх шардів додаються
+    totals = storage.fan_out(lambda conn, shard: read_cluster_totals(conn), acquire=admin_acquire)
+    return jsonify(summarize_cluster_totals(totals))
 
 @app.route('/api/admin/analytics', methods=['GET'])
 def get_analytics():
-    """Аналітика (без змін)"""
+    """Аналітика дашборду зі знімків шардів: підсумки, реєстрації та склад кластерів
+    за інтервалами, статистика та середні фіч кластерів.
+
+    Параметри: bucket (day, week), days (за скільки останніх днів).
+    Результат кешується до наступних записів (див. analytics.py).
+    """
     user = get_current_user()
     if not user or user['role'] != 'admin':
         return jsonify({'error': 'Тільки для адміна'}), 403
     
-    conn = sqlite3.connect('profiling.db')
-    cursor = conn.cursor()
+    try:
+        bucket, days = analytics_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    cursor.execute('SELECT COUNT(*) FROM users WHERE role = "client"')
-    total = cursor.fetchone()[0]
+    # Знімки створюються до того, як читається їхня версія
+    for snapshot in analytics_snapshots:
+        snapshot.start()
+    model = segmentation.model
+    version = (model.version,) + tuple(snapshot.version for snapshot in analytics_snapshots)
     
-    conn.close()
+    def compute():
+        result = merge_analytics(storage.fan_out(
+            lambda conn, shard: read_analytics(conn, bucket, days), acquire=admin_acquire
+        ))
+        result['cluster_features'] = cluster_feature_means(model, segmentation.cluster_profiles)
+        return result
     
-    return jsonify({
-        'summary': {
-            'total_clients': total,
-            'kaggle_dataset_size': 2240
-        }
-    })
+    result, cached = analytics_cache.get((bucket, days), version, compute)
+    return jsonify(dict(result, bucket=bucket, days=days, cached=cached))
+
+@app.route('/api/admin/segments', methods=['GET'])
+def get_segments():
+    """Сегменти клієнтів з колонкового сховища профілів (див. columnar_store.py).
+
+    Параметри: group_by (текстовий стовпець, has_children або шкала анкети),
+    histogram (cluster_confidence або шкала) та bins, фільтри як у
+    /api/admin/clusters. Рахується по всіх клієнтах, у тому числі без анкети
+    (група зі значенням null).
+    """
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    try:
+        group_by, histogram, bins, filters = segment_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    result = profile_columns.segments(group_by, filters, histogram, bins)
+    result['store'] = profile_columns.info()
+    return jsonify(result)
+
+@app.route('/api/admin/snapshot', methods=['GET', 'POST'])
+def analytics_snapshot_status():
+    """Застарілість знімка БД для адмін-запитів; POST — оновити знімок зараз"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    try:
+        for snapshot in analytics_snapshots:
+            if request.method == 'POST' and snapshot.enabled:
+                snapshot.refresh()
+            else:
+                snapshot.start()
+    except (sqlite3.Error, OSError) as e:
+        return jsonify({'error': f'Не вдалося оновити знімок: {e}'}), 500
+    
+    infos = [snapshot.info() for snapshot in analytics_snapshots]
+    if not storage.sharded:
+        return jsonify(infos[0])
+    # Дані адмін-панелі не новіші за найстаріший знімок шарда
+    info = dict(max(infos, key=lambda shard: shard['age_seconds'] or 0.0),
+                writes_since=sum(shard['writes_since'] for shard in infos),
+                shards=infos)
+    return jsonify(info)
+
+def retrain_and_rescore(report, train, rescore, **options):
+    """Фонове перенавчання з наступним запуском перерахунку профілів"""
+    result = train(report, **options)
+    if rescore:
+        # None, якщо перерахунок вже виконується
+        result['rescore_job_id'] = jobs.submit('rescore', segmentation.rescore_profiles)
+    return result
 
 @app.route('/api/admin/retrain', methods=['POST'])
 def retrain_model():
-    """Перенавчання моделі (без змін)"""
+    """Запуск перенавчання моделі у фоні"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    
+    # Джерело даних: синтетичні кластери (за замовчуванням) або Kaggle датасет
+    source = data.get('source', 'synthetic')
+    trainers = {
+        'synthetic': segmentation.train_model_with_realistic_data,
+        'kaggle': segmentation.train_model_from_dataset
+    }
+    if source not in trainers:
+        return jsonify({'error': f'Невідоме джерело даних: {source}'}), 400
+    
+    # Кількість процесів для паралельних ініціалізацій KMeans
+    options = {}
+    if source == 'synthetic' and 'n_jobs' in data:
+        try:
+            options['n_jobs'] = int(data['n_jobs'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'n_jobs має бути цілим числом'}), 400
+    
+    # Після перенавчання збережені профілі перераховуються новою моделлю
+    rescore = bool(data.get('rescore', True))
+    
+    job_id = jobs.submit('retrain', retrain_and_rescore,
+                         train=trainers[source], rescore=rescore, **options)
+    if job_id is None:
+        return jsonify({'error': 'Перенавчання вже виконується'}), 409
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'message': 'Перенавчання запущено'
+    }), 202
+
+@app.route('/api/admin/retrain/<job_id>', methods=['GET'])
+def retrain_status(job_id):
+    """Статус фонового перенавчання: етап, прогрес та метрики"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    job = jobs.get(job_id)
+    if not job or job['kind'] != 'retrain':
+        return jsonify({'error': 'Задачу не знайдено'}), 404
+    
+    job['current_model_version'] = segmentation.model.version
+    return jsonify(job)
+
+@app.route('/api/admin/k-sweep', methods=['POST'])
+def start_k_sweep():
+    """Запуск паралельного підбору кількості кластерів у фоні"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    
+    source = data.get('source', 'synthetic')
+    if source not in ('synthetic', 'kaggle'):
+        return jsonify({'error': f'Невідоме джерело даних: {source}'}), 400
+    
+    try:
+        k_min = int(data.get('k_min', 2))
+        k_max = int(data.get('k_max', 10))
+        n_init = int(data.get('n_init', 10))
+        n_jobs = int(data.get('n_jobs', -1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'k_min, k_max, n_init та n_jobs мають бути цілими числами'}), 400
+    if not 2 <= k_min <= k_max <= MAX_SWEEP_K or n_init < 1 or n_jobs == 0:
+        return jsonify({'error': f'Потрібно 2 <= k_min <= k_max <= {MAX_SWEEP_K}, n_init >= 1'}), 400
+    
+    job_id = jobs.submit('k_sweep', segmentation.sweep_clusters,
+                         k_values=range(k_min, k_max + 1), source=source,
+                         n_init=n_init, n_jobs=n_jobs)
+    if job_id is None:
+        return jsonify({'error': 'Підбір K вже виконується'}), 409
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'message': 'Підбір кількості кластерів запущено'
+    }), 202
+
+@app.route('/api/admin/k-sweep/<job_id>', methods=['GET'])
+def k_sweep_status(job_id):
+    """Статус підбору K: інерція, silhouette та час навчання для кожного K"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    job = jobs.get(job_id)
+    if not job or job['kind'] != 'k_sweep':
+        return jsonify({'error': 'Задачу не знайдено'}), 404
+    
+    return jsonify(job)
+
+@app.route('/api/admin/rescore', methods=['POST'])
+def rescore_profiles():
+    """Запуск перерахунку кластерів збережених профілів поточною моделлю"""
+    user = get_current_user()
+    if not user or user['role'] != 'admin':
+        return jsonify({'error': 'Тільки для адміна'}), 403
+    
+    job_id = jobs.submit('rescore', segmentation.rescore_profiles)
+    if job_id is None:
+        return jsonify({'error': 'Перерахунок вже виконується'}), 409
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'message': 'Перерахунок профілів запущено'
+    }), 202
+
+@app.route('/api/admin/rescore/<job_id>', methods=['GET'])
+def rescore_status(job_id):
+    """Статус фонового перерахунку профілів"""
     user = get_current_user()
     if not user or user['role'] != 'admin':
         return jsonify({'error': 'Тільки для адміна'}), 403
     
-    segmentation.train_model_with_realistic_data()
-    return jsonify({'success': True, 'message': 'Модель перенавчена'})
+    job = jobs.get(job_id)
+    if not job or job['kind'] != 'rescore':
+        return jsonify({'error': 'Задачу не знайдено'}), 404
+    
+    job['current_model_version'] = segmentation.model.version
+    return jsonify(job)
 
 if __name__ == '__main__':
     print("\n" + "="*50)
@@ -0,0 +1,309 @@
+﻿import os
+import sys
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import DB_PATH, DB_POOL_SIZE, ConnectionPool, connect
+from migrations import SCHEMA_VERSION, migrate, schema_version
+
+# ================== ШАРДИ БД ==================
+#
+# Таблиці users, client_profiles (і все, що прив'язане до user_id:
+# client_features, cluster_stats) розкладаються на SHARD_COUNT файлів
+# SQLite за хешем user_id. У кожного файлу свій записувач, тож записи
+# різних клієнтів не чекають на одне блокування. Невеликий глобальний
+# довідник (profiling.directory.db) видає user_id та зберігає email → user_id:
+# через нього реєстрація перевіряє унікальність email, а вхід знаходить
+# шард користувача. Агрегати для адміна рахуються на всіх шардах
+# паралельно (fan_out) і зводяться в одну відповідь.
+#
+# SHARD_COUNT=1 (за замовчуванням) — один файл DB_PATH без довідника,
+# як раніше. Перехід з одного файлу на шарди:
+#   python sharding.py reshard profiling.db 4
+# після чого сервер запускається з SHARD_COUNT=4.
+
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 1))
+
+# Мультиплікативний хеш Кнута (32 біти). Шард визначають старші біти хешу:
+# молодші біти добутку повторюють молодші біти user_id, тож остача від
+# ділення на 2, 4, 8 шардів розкладала б id за простим чергуванням
+_HASH_MULTIPLIER = 2654435761
+
+
+def shard_of(user_id, count):
+    """Номер шарда користувача (та сама формула, що й shard_sql)"""
+    return (int(user_id) * _HASH_MULTIPLIER) % 4294967296 * count >> 32
+
+
+def shard_sql(column, count):
+    """SQL-вираз номера шарда для колонки user_id"""
+    return f'(({column} * {_HASH_MULTIPLIER}) % 4294967296 * {count} / 4294967296)'
+
+
+def shard_paths(base=DB_PATH, count=SHARD_COUNT):
+    """Файли шардів: сам base для одного шарда, інакше profiling.shard0.db, ..."""
+    if count == 1:
+        return [base]
+    root, ext = os.path.splitext(base)
+    return [f'{root}.shard{index}{ext}' for index in range(count)]
+
+
+def directory_path(base=DB_PATH):
+    root, ext = os.path.splitext(base)
+    return f'{root}.directory{ext}'
+
+
+def init_directory(cursor):
+    """Таблиці довідника: облікові записи (user_id, email) та кількість шардів"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shard_config (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard_count INTEGER NOT NULL
+        )
+    ''')
+
+
+class ShardedStorage:
+    """Пули з'єднань шардів, маршрутизація за user_id та email, паралельні запити"""
+
+    def __init__(self, base=DB_PATH, count=SHARD_COUNT, pool_size=DB_POOL_SIZE):
+        if count < 1:
+            raise ValueError(f"Кількість шардів має бути додатною: {count}")
+        self.base = base
+        self.count = count
+        self.sharded = count > 1
+        self.paths = shard_paths(base, count)
+        self.pools = [ConnectionPool(path, pool_size) for path in self.paths]
+        self.directory = (ConnectionPool(directory_path(base), pool_size)
+                          if self.sharded else None)
+        self._executor = None
+
+    def shard_of(self, user_id):
+        return shard_of(user_id, self.count) if self.sharded else 0
+
+    def path_for(self, user_id):
+        return self.paths[self.shard_of(user_id)]
+
+    def acquire(self, user_id):
+        """З'єднання з шардом користувача"""
+        return self.pools[self.shard_of(user_id)].acquire()
+
+    def acquire_for_email(self, email):
+        """З'єднання з шардом користувача з цим email (None, якщо його немає)"""
+        if not self.sharded:
+            return self.pools[0].acquire()
+        conn = self.directory.acquire()
+        try:
+            row = conn.execute('SELECT user_id FROM accounts WHERE email = ?', (email,)).fetchone()
+        finally:
+            conn.close()
+        return self.acquire(row[0]) if row else None
+
+    def init(self):
+        """Міграції схеми всіх шардів та перевірка довідника"""
+        if self.sharded and os.path.exists(self.base) and not os.path.exists(self.directory.path):
+            # Нові порожні шарди поруч з однофайловою БД сховали б її дані
+            raise RuntimeError(
+                f"{self.base} ще не розкладено на шарди: "
+                f"python sharding.py reshard {self.base} {self.count}"
+            )
+        for pool in self.pools:
+            conn = pool.acquire()
+            try:
+                migrate(conn)
+            finally:
+                conn.close()
+        if not self.sharded:
+            return
+
+        conn = self.directory.acquire()
+        try:
+            with conn:
+                init_directory(conn.cursor())
+                conn.execute('INSERT OR IGNORE INTO shard_config (id, shard_count) VALUES (1, ?)',
+                             (self.count,))
+            stored = conn.execute('SELECT shard_count FROM shard_config').fetchone()[0]
+        finally:
+            conn.close()
+        if stored != self.count:
+            raise RuntimeError(f"Дані розкладено на {stored} шардів, а SHARD_COUNT={self.count}")
+
+    def create_user(self, email, password_hash, name, role='client'):
+        """Новий користувач (і порожній профіль клієнта); повертає user_id.
+
+        Зайнятий email — sqlite3.IntegrityError.
+        """
+        if not self.sharded:
+            conn = self.pools[0].acquire()
+            try:
+                with conn:
+                    return self._insert_user(conn, None, email, password_hash, name, role)
+            finally:
+                conn.close()
+
+        # user_id видає довідник; унікальність email перевіряється тут же
+        conn = self.directory.acquire()
+        try:
+            with conn:
+                user_id = conn.execute(
+                    'INSERT INTO accounts (email) VALUES (?)', (email,)
+                ).lastrowid
+        finally:
+            conn.close()
+
+        shard = self.acquire(user_id)
+        try:
+            with shard:
+                self._insert_user(shard, user_id, email, password_hash, name, role)
+        except sqlite3.Error:
+            # Запис у довіднику без користувача в шарді звільняється
+            conn = self.directory.acquire()
+            try:
+                with conn:
+                    conn.execute('DELETE FROM accounts WHERE user_id = ?', (user_id,))
+            finally:
+                conn.close()
+            raise
+        finally:
+            shard.close()
+        return user_id
+
+    @staticmethod
+    def _insert_user(conn, user_id, email, password_hash, name, role):
+        user_id = conn.execute('''
+            INSERT INTO users (id, email, password_hash, name, role)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, email, password_hash, name, role)).lastrowid
+        if role == 'client':
+            conn.execute('INSERT INTO client_profiles (user_id) VALUES (?)', (user_id,))
+        return user_id
+
+    def group_by_shard(self, user_ids):
+        """{шард: [user_id, ...]} зі збереженням порядку"""
+        groups = {}
+        for user_id in user_ids:
+            groups.setdefault(self.shard_of(user_id), []).append(user_id)
+        return groups
+
+    def fan_out(self, func, shards=None, acquire=None):
+        """func(conn, shard) на кожному шарді паралельно; результати в порядку шардів.
+
+        acquire(shard) — звідки брати з'єднання (за замовчуванням пул шарда).
+        """
+        shards = list(range(self.count)) if shards is None else list(shards)
+        acquire = acquire or (lambda shard: self.pools[shard].acquire())
+
+        def run(shard):
+            conn = acquire(shard)
+            try:
+                return func(conn, shard)
+            finally:
+                conn.close()
+
+        if len(shards) == 1:
+            return [run(shards[0])]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.count,
+                                                thread_name_prefix='shard')
+        # Запити SQLite відпускають GIL, тож шарди читаються одночасно
+        return list(self._executor.map(run, shards))
+
+    def health(self):
+        """Стан пулів: один шард — як раніше, інакше по шардах і довідник"""
+        if not self.sharded:
+            return self.pools[0].health()
+        shards = [pool.health() for pool in self.pools]
+        directory = self.directory.health()
+        return {
+            'ok': directory['ok'] and all(shard['ok'] for shard in shards),
+            'shard_count': self.count,
+            'shards': shards,
+            'directory': directory
+        }
+
+
+# ================== ПЕРЕРОЗКЛАДАННЯ ==================
+
+def _columns(conn, table):
+    return ', '.join(row[1] for row in conn.execute(f'PRAGMA table_info({table})'))
+
+
+def reshard(source, count, base=None):
+    """Розкладання однофайлової БД source на count шардів і довідник.
+
+    Файли шардів та довідника не повинні існувати. Повертає
+    {кількість рядків users по шардах, час}.
+    """
+    from cluster_stats import rebuild_cluster_stats
+
+    if count < 2:
+        raise ValueError('Для шардів потрібно щонайменше 2 файли')
+    base = base or source
+    paths = shard_paths(base, count)
+    directory = directory_path(base)
+    existing = [path for path in paths + [directory] if os.path.exists(path)]
+    if existing:
+        raise FileExistsError(f"Файли вже існують: {', '.join(existing)}")
+
+    src = connect(source)
+    try:
+        version = schema_version(src)
+    finally:
+        src.close()
+    if version != SCHEMA_VERSION:
+        raise RuntimeError(f"Схема {source} версії {version}, потрібна {SCHEMA_VERSION}: "
+                           f"спершу python migrations.py")
+
+    started = time.perf_counter()
+    counts = []
+    for shard, path in enumerate(paths):
+        conn = connect(path)
+        try:
+            migrate(conn)
+            conn.execute('ATTACH DATABASE ? AS src', (source,))
+            with conn:
+                # Порядок колонок не залежить від історії міграцій джерела
+                for table, key in (('users', 'id'), ('client_profiles', 'user_id'),
+                                   ('client_features', 'user_id')):
+                    columns = _columns(conn, table)
+                    conn.execute(f'''
+                        INSERT INTO {table} ({columns})
+                        SELECT {columns} FROM src.{table}
+                        WHERE {shard_sql(key, count)} = ?
+                    ''', (shard,))
+                rebuild_cluster_stats(conn.cursor())
+            conn.execute('DETACH DATABASE src')
+            conn.execute('ANALYZE')
+            counts.append(conn.execute('SELECT COUNT(*) FROM users').fetchone()[0])
+        finally:
+            conn.close()
+
+    conn = connect(directory)
+    try:
+        conn.execute('ATTACH DATABASE ? AS src', (source,))
+        with conn:
+            init_directory(conn.cursor())
+            conn.execute('INSERT INTO shard_config (id, shard_count) VALUES (1, ?)', (count,))
+            conn.execute('INSERT INTO accounts (user_id, email) SELECT id, email FROM src.users')
+        conn.execute('DETACH DATABASE src')
+    finally:
+        conn.close()
+
+    return {'users_per_shard': counts, 'elapsed': time.perf_counter() - started}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (4, 5) or sys.argv[1] != 'reshard':
+        sys.exit('Використання: python sharding.py reshard <джерело.db> <кількість шардів> [база імен]')
+
+    result = reshard(sys.argv[2], int(sys.argv[3]), sys.argv[4] if len(sys.argv) == 5 else None)
+    print(f"✅ Розкладено на {len(result['users_per_shard'])} шардів за "
+          f"{result['elapsed']:.1f} с: {result['users_per_shard']}")
+    print(f"   Запуск сервера: SHARD_COUNT={len(result['users_per_shard'])}")
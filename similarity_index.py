@@ -0,0 +1,346 @@
+﻿import os
+import pickle
+import threading
+import time
+import numpy as np
+
+from feature_store import (
+    FEATURE_DTYPE, N_FEATURES, backfill_features, iter_features, load_features
+)
+
+# ================== ІНДЕКС СХОЖИХ КЛІЄНТІВ ==================
+#
+# KD-дерево (scipy cKDTree) над фічами всіх заповнених профілів (зі
+# сховища фіч client_features усіх шардів) у масштабованому просторі моделі. Зсув скейлера на відстані не впливає,
+# тому дерево будується над features / scale, а сирі фічі зберігаються
+# поруч: після перенавчання з іншим масштабом дерево перебудовується без
+# звернення до БД. Нові анкети потрапляють у невеликий буфер, який
+# переглядається повним перебором; коли буфер виростає до DELTA_REBUILD_SIZE,
+# дерево перебудовується у фоні та зберігається на диск. Анкети, збережені
+# іншими воркерами, дочитуються з БД у буфер у фоні раз на
+# SIMILARITY_CATCH_UP_INTERVAL секунд (при запитах до індексу).
+
+SIMILARITY_INDEX_PATH = os.environ.get('SIMILARITY_INDEX_PATH', 'similarity_index.pkl')
+
+SIMILARITY_CATCH_UP_INTERVAL = float(os.environ.get('SIMILARITY_CATCH_UP_INTERVAL', '60'))
+
+# Розмір буфера нових профілів, після якого дерево перебудовується
+DELTA_REBUILD_SIZE = 5000
+
+# Скільки user_id підставляється в один запит IN (...) при дочитуванні
+CATCH_UP_CHUNK_SIZE = 5000
+
+
+class _IndexState:
+    """Незмінний стан індексу: дерево над базою та буфер нових профілів"""
+
+    def __init__(self, user_ids, features, scale, tree, delta_ids=None, delta_features=None):
+        self.user_ids = user_ids
+        self.features = features
+        self.scale = scale
+        self.tree = tree
+        self.delta_ids = np.empty(0, dtype=np.int64) if delta_ids is None else delta_ids
+        self.delta_features = (np.empty((0, features.shape[1]), dtype=features.dtype)
+                               if delta_features is None else delta_features)
+        self.delta_scaled = self.delta_features / scale
+
+    @classmethod
+    def build(cls, user_ids, features, scale, delta_ids=None, delta_features=None):
+        from scipy.spatial import cKDTree
+
+        tree = cKDTree(features / scale, leafsize=32, balanced_tree=False)
+        return cls(user_ids, features, scale, tree, delta_ids, delta_features)
+
+    def __len__(self):
+        return len(self.user_ids) + len(self.delta_ids)
+
+
+class SimilarCustomersIndex:
+    """Пошук найближчих клієнтів у масштабованому просторі 7 фіч моделі.
+
+    storage — ShardedStorage (див. sharding.py); фічі читаються з пулів
+    шардів. Індекс завантажується з диску (або будується з БД) при першому
+    запиті. Запити читають поточний стан без блокувань; додавання профілю
+    та перебудова дерева замінюють стан цілком.
+    """
+
+    def __init__(self, segmentation, storage, path=SIMILARITY_INDEX_PATH,
+                 delta_rebuild_size=DELTA_REBUILD_SIZE,
+                 catch_up_interval=SIMILARITY_CATCH_UP_INTERVAL):
+        self.segmentation = segmentation
+        self.storage = storage
+        self.path = path
+        self.delta_rebuild_size = delta_rebuild_size
+        self.catch_up_interval = catch_up_interval
+        self._state = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._catching_up = False
+        self._caught_up_at = None
+
+    def ensure_loaded(self):
+        """Завантаження збереженого індексу з дочитуванням нових профілів або повна побудова.
+
+        Для вже завантаженого індексу, якщо час, запускає фонове дочитування
+        профілів, збережених іншими процесами.
+        """
+        if self._state is not None:
+            if (self.catch_up_interval > 0 and not self._catching_up
+                    and time.monotonic() - self._caught_up_at >= self.catch_up_interval):
+                with self._lock:
+                    if self._catching_up:
+                        return
+                    self._catching_up = True
+                threading.Thread(target=self.catch_up, name='similarity-catch-up',
+                                 daemon=True).start()
+            return
+        with self._lock:
+            if self._state is not None:
+                return
+            state = self._load()
+            if state is None:
+                state = self._build_from_db()
+                self._save(state)
+            else:
+                state = self._catch_up(state)
+            self._state = state
+            self._caught_up_at = time.monotonic()
+            print(f"✅ Індекс схожих клієнтів готовий ({len(state)} профілів)")
+
+    def info(self):
+        """Розмір індексу та буфера нових профілів"""
+        state = self._state
+        return {
+            'loaded': state is not None,
+            'size': len(state) if state is not None else 0,
+            'pending': len(state.delta_ids) if state is not None else 0,
+            'rebuilding': self._rebuilding,
+            'catching_up': self._catching_up
+        }
+
+    def add(self, user_id, features):
+        """Додавання (або оновлення) профілю, що щойно пройшов опитування"""
+        features = np.asarray(features, dtype=float).reshape(1, -1)
+        if self._state is None or not np.isfinite(features).all():
+            # Ще не завантажений індекс прочитає профіль з БД
+            return
+        with self._lock:
+            state = self._state
+            keep = state.delta_ids != user_id
+            self._state = _IndexState(
+                state.user_ids, state.features, state.scale, state.tree,
+                np.append(state.delta_ids[keep], user_id),
+                np.vstack([state.delta_features[keep], features])
+            )
+            rebuild = len(self._state.delta_ids) >= self.delta_rebuild_size
+        if rebuild:
+            self.rebuild_async()
+
+    def refresh_profile(self, user_id):
+        """Перечитування профілю з БД у буфер (якщо індекс вже завантажений)"""
+        if self._state is None:
+            return
+        features = self.profile_features(user_id)
+        if features is not None:
+            self.add(user_id, features)
+
+    def query(self, features, k=10, exclude=None):
+        """k найближчих профілів: список (user_id, відстань), найближчі першими"""
+        self.ensure_loaded()
+        state = self._state
+        scale = np.asarray(self.segmentation.model.scale, dtype=float)
+        if not np.array_equal(scale, state.scale):
+            # Модель перенавчена з іншим масштабом: поки дерево перебудовується,
+            # відповідаємо за попереднім
+            self.rebuild_async()
+
+        point = np.asarray(features, dtype=float).reshape(-1) / state.scale
+        n_base = len(state.user_ids)
+        want = k + (exclude is not None)
+
+        user_ids, distances = np.empty(0, dtype=np.int64), np.empty(0)
+        if n_base:
+            distances, positions = state.tree.query(point, k=min(want, n_base))
+            user_ids = state.user_ids[np.atleast_1d(positions)]
+            distances = np.atleast_1d(distances)
+        if len(state.delta_ids):
+            # Копія профілю в буфері новіша за копію в дереві
+            keep = ~np.isin(user_ids, state.delta_ids)
+            delta_distances = np.sqrt(((state.delta_scaled - point) ** 2).sum(axis=1))
+            nearest = np.argsort(delta_distances)[:want]
+            user_ids = np.concatenate([user_ids[keep], state.delta_ids[nearest]])
+            distances = np.concatenate([distances[keep], delta_distances[nearest]])
+
+        order = np.argsort(distances, kind='stable')
+        return [(int(user_id), float(distance))
+                for user_id, distance in zip(user_ids[order], distances[order])
+                if user_id != exclude][:k]
+
+    def catch_up(self):
+        """Дочитування в буфер профілів, збережених іншими процесами"""
+        try:
+            state = self._state
+            missing = np.setdiff1d(self._filled_ids(),
+                                   np.concatenate([state.user_ids, state.delta_ids]))
+            if not len(missing):
+                return
+            user_ids, features = self._rows_for(missing)
+            with self._lock:
+                # Профілі, додані за цей час через add, вже в буфері
+                current = self._state
+                fresh = ~np.isin(user_ids, current.delta_ids)
+                self._state = _IndexState(
+                    current.user_ids, current.features, current.scale, current.tree,
+                    np.concatenate([current.delta_ids, user_ids[fresh]]),
+                    np.vstack([current.delta_features, features[fresh]])
+                )
+                rebuild = len(self._state.delta_ids) >= self.delta_rebuild_size
+            if rebuild:
+                self.rebuild_async()
+        except Exception as e:
+            print(f"❌ Не вдалося дочитати профілі в індекс схожих клієнтів: {e}")
+        finally:
+            self._caught_up_at = time.monotonic()
+            self._catching_up = False
+
+    def rebuild_async(self):
+        """Перебудова дерева з буфером нових профілів у фоновому потоці"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self.rebuild, name='similarity-rebuild', daemon=True).start()
+
+    def rebuild(self):
+        """Об'єднання буфера з базою, нове дерево у поточному масштабі моделі та збереження"""
+        try:
+            state = self._state
+            in_delta = np.isin(state.user_ids, state.delta_ids)
+            user_ids = np.concatenate([state.user_ids[~in_delta], state.delta_ids])
+            features = np.vstack([state.features[~in_delta], state.delta_features])
+            scale = np.array(self.segmentation.model.scale, dtype=float)
+            rebuilt = _IndexState.build(user_ids, features, scale)
+
+            with self._lock:
+                # Профілі, додані під час побудови, лишаються в буфері
+                current = self._state
+                rest = ~np.isin(current.delta_ids, state.delta_ids)
+                self._state = _IndexState(
+                    rebuilt.user_ids, rebuilt.features, rebuilt.scale, rebuilt.tree,
+                    current.delta_ids[rest], current.delta_features[rest]
+                )
+            self._save(rebuilt)
+        finally:
+            self._rebuilding = False
+
+    def _rows(self, condition='1', params=()):
+        """Користувачі та фічі зі сховищ фіч усіх шардів (порціями за user_id)"""
+        user_ids, features = [], []
+        for pool in self.storage.pools:
+            conn = pool.acquire()
+            try:
+                for chunk_users, chunk_features in iter_features(conn, 'raw', condition, params):
+                    user_ids.append(chunk_users)
+                    features.append(chunk_features)
+            finally:
+                conn.close()
+        if not user_ids:
+            return np.empty(0, dtype=np.int64), np.empty((0, N_FEATURES), dtype=FEATURE_DTYPE)
+        return np.concatenate(user_ids), np.vstack(features)
+
+    def _rows_for(self, user_ids):
+        """Фічі вказаних користувачів (запитами по CATCH_UP_CHUNK_SIZE id)"""
+        chunks = [self._rows(f'user_id IN ({",".join(map(str, chunk.tolist()))})')
+                  for chunk in np.array_split(user_ids, -(-len(user_ids) // CATCH_UP_CHUNK_SIZE))]
+        return np.concatenate([ids for ids, _ in chunks]), np.vstack([rows for _, rows in chunks])
+
+    def _filled_ids(self):
+        """user_id усіх профілів у сховищах фіч шардів"""
+        filled = []
+        for pool in self.storage.pools:
+            conn = pool.acquire()
+            try:
+                filled.append(np.fromiter(
+                    (row[0] for row in conn.execute(
+                        'SELECT user_id FROM client_features'
+                    )), dtype=np.int64
+                ))
+            finally:
+                conn.close()
+        return np.concatenate(filled)
+
+    def profile_features(self, user_id):
+        """Фічі клієнта зі сховища фіч або None, якщо він не пройшов опитування"""
+        conn = self.storage.acquire(user_id)
+        try:
+            return load_features(conn, user_id)
+        finally:
+            conn.close()
+
+    def _build_from_db(self):
+        model = self.segmentation.model
+        for pool in self.storage.pools:
+            conn = pool.acquire()
+            try:
+                # Профілі, збережені до появи сховища фіч
+                backfill_features(conn, self.segmentation, model)
+            finally:
+                conn.close()
+        user_ids, features = self._rows()
+        return _IndexState.build(user_ids, features, np.array(model.scale, dtype=float))
+
+    def _catch_up(self, state):
+        """Профілі, заповнені після збереження індексу, додаються в буфер"""
+        missing = np.setdiff1d(self._filled_ids(), state.user_ids)
+        if not len(missing):
+            return state
+        if len(missing) >= self.delta_rebuild_size:
+            # Пропущено забагато — простіше побудувати заново
+            state = self._build_from_db()
+            self._save(state)
+            return state
+        user_ids, features = self._rows_for(missing)
+        return _IndexState(state.user_ids, state.features, state.scale, state.tree,
+                           user_ids, features)
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+            return _IndexState(data['user_ids'], data['features'], data['scale'], data['tree'])
+        except Exception as e:
+            # Пошкоджений файл (pickle може кинути будь-що) — індекс будується з БД
+            if os.path.exists(self.path):
+                print(f"⚠️ Не вдалося завантажити індекс схожих клієнтів: {e}")
+            return None
+
+    def _save(self, state):
+        """Атомарний запис бази індексу (дерево разом з фічами)"""
+        data = {
+            'user_ids': state.user_ids,
+            'features': state.features,
+            'scale': state.scale,
+            'tree': state.tree
+        }
+        # Свій тимчасовий файл у кожного процесу: воркери можуть перебудовувати одночасно
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+if __name__ == '__main__':
+    import server
+
+    server.warmup()
+    if os.path.exists(SIMILARITY_INDEX_PATH):
+        os.remove(SIMILARITY_INDEX_PATH)
+    # Індекс сервера читає сховища фіч усіх шардів (server.storage.paths)
+    print(f"🔄 Побудова індексу схожих клієнтів ({', '.join(server.storage.paths)})...")
+    server.similar_customers.ensure_loaded()
+    print(f"✅ Індекс збережено: {SIMILARITY_INDEX_PATH}")
@@ -0,0 +1,263 @@
+﻿import glob
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from db import DB_PATH, ConnectionPool, connect
+
+# ================== ЗНІМОК БД ДЛЯ АДМІН-ЗАПИТІВ ==================
+#
+# Адмін-ендпоінти (список клієнтів, кластери, аналітика) читають не
+# робочу БД, а її копію лише для читання. Копія знімається online backup
+# API SQLite (Connection.backup) у новий файл з номером покоління
+# (profiling.snapshot.<pid>-<n>.db) і переводиться в режим журналу DELETE.
+# Після цього адмін-запити отримують з'єднання з нового пулу, а запити, що
+# вже читають старий файл, дочитують його до кінця; старий файл видаляється,
+# щойно його закриють останні читачі. Наявний файл ніколи не замінюється:
+# у Windows os.replace і видалення відкритого файлу неможливі, тож
+# видалення просто повторюється при наступних оновленнях. Свій поточний
+# файл воркер «торкається» (mtime) кожні SNAPSHOT_INTERVAL секунд; файли,
+# яких не торкались довше за STALE_AGE секунд (їхні процеси завершились),
+# прибирає перший знімок нового процесу.
+#
+# Знімок оновлюється фоновим потоком кожні SNAPSHOT_INTERVAL секунд
+# (якщо БД змінилась — PRAGMA data_version) або одразу після
+# SNAPSHOT_WRITES записів, про які повідомляє note_writes(). Довгі
+# аналітичні сканування не тримають позначку читання у WAL робочої БД
+# (яка не дає checkpoint-у скоротити WAL) і не конкурують із записом за
+# її кеш сторінок. Ціна — застарілість даних адмін-панелі, яку показує info().
+
+# Шлях копії (за замовчуванням поруч з БД: profiling.snapshot.db)
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', os.path.splitext(DB_PATH)[0] + '.snapshot.db')
+
+# Як часто (секунди) оновлювати знімок; 0 — без знімка, адмін-запити до робочої БД
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 30))
+
+# Після скількох записів знімок оновлюється раніше (0 — лише за розкладом)
+SNAPSHOT_WRITES = int(os.environ.get('SNAPSHOT_WRITES', 1000))
+
+# Розмір пулу з'єднань до знімка
+SNAPSHOT_POOL_SIZE = 4
+
+# Через скільки секунд без оновлення mtime файл знімка вважається покинутим
+# (але не менше чотирьох інтервалів оновлення)
+STALE_AGE = 3600
+
+# Номери поколінь файлів знімка, унікальні в межах процесу
+_generations = itertools.count(1)
+
+
+def snapshot_path(source):
+    """Шлях знімка для файлу БД (для шардів — profiling.shard0.snapshot.db, ...)"""
+    return SNAPSHOT_PATH if source == DB_PATH else os.path.splitext(source)[0] + '.snapshot.db'
+
+
+class AnalyticsSnapshot:
+    """Копія БД лише для читання, що періодично оновлюється з робочої.
+
+    acquire() повертає з'єднання до знімка (перший знімок робиться при
+    першому запиті) або, якщо знімки вимкнені, з'єднання з пулу fallback.
+    """
+
+    def __init__(self, fallback, source=DB_PATH, path=None,
+                 interval=SNAPSHOT_INTERVAL, max_writes=SNAPSHOT_WRITES,
+                 pool_size=SNAPSHOT_POOL_SIZE):
+        self.fallback = fallback
+        self.source = source
+        self.path = path or snapshot_path(source)
+        self.interval = interval
+        self.max_writes = max_writes
+        self.pool_size = pool_size
+        self.enabled = interval > 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.RLock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._pool = None
+        # Файли попередніх знімків, які ще читають (видаляються при наступних оновленнях)
+        self._retired = []
+        self._writes = 0
+        self._taken_at = None
+        # Змінюється разом з даними, які бачать адмін-запити (для кешів агрегатів)
+        self.version = 0
+        self.stats = {
+            'refreshes': 0,
+            'failures': 0,
+            'last_refresh_ms': 0.0,
+            'last_error': None
+        }
+
+    def acquire(self):
+        """З'єднання для адмін-запиту (close() повертає його в пул)"""
+        if not self.enabled:
+            return self.fallback.acquire()
+        self._ensure_started()
+        while True:
+            pool = self._pool
+            try:
+                return pool.acquire()
+            except sqlite3.Error:
+                # Файл знімка видалено між читанням self._pool і відкриттям
+                if pool is self._pool:
+                    raise
+
+    def note_writes(self, count=1):
+        """Повідомлення про записи в робочу БД; після max_writes знімок оновлюється"""
+        if not count:
+            return
+        if not self.enabled:
+            # Адмін-запити читають робочу БД: записи видно одразу
+            with self._lock:
+                self.version += 1
+            return
+        with self._lock:
+            self._writes += count
+            due = self.max_writes and self._writes >= self.max_writes
+        if due:
+            self._wake.set()
+
+    def start(self):
+        """Перший знімок і фоновий потік оновлення, якщо їх ще немає"""
+        if self.enabled:
+            self._ensure_started()
+
+    def refresh(self):
+        """Оновлення знімка зараз (наприклад, на вимогу адміна)"""
+        if self._ensure_started():
+            return
+        self._refresh()
+
+    def _refresh(self):
+        """Новий знімок робочої БД (блокує лише до завершення копіювання)"""
+        with self._refresh_lock:
+            with self._lock:
+                writes = self._writes
+            start = time.perf_counter()
+            root, ext = os.path.splitext(self.path)
+            path = f'{root}.{os.getpid()}-{next(_generations)}{ext}'
+            try:
+                source = connect(self.source)
+                target = sqlite3.connect(path)
+                try:
+                    # Одним кроком: у WAL копіювання читає узгоджений стан і не блокує запис
+                    source.backup(target)
+                    target.execute('PRAGMA journal_mode=DELETE')
+                finally:
+                    target.close()
+                    source.close()
+            except (sqlite3.Error, OSError) as e:
+                with self._lock:
+                    self.stats['failures'] += 1
+                    self.stats['last_error'] = str(e)
+                if os.path.exists(path):
+                    os.remove(path)
+                raise
+
+            old, self._pool = self._pool, ConnectionPool(path, self.pool_size, readonly=True)
+            if old is not None:
+                # З'єднання, що зараз читають старий файл, закриються при поверненні
+                old.close_all()
+                self._retired.append(old.path)
+            self._remove_retired()
+            with self._lock:
+                self._writes -= writes
+                self._taken_at = time.time()
+                self.version += 1
+                self.stats['refreshes'] += 1
+                self.stats['last_refresh_ms'] = (time.perf_counter() - start) * 1000
+                self.stats['last_error'] = None
+
+    def info(self):
+        """Застарілість та лічильники знімка для адмін-панелі"""
+        with self._lock:
+            info = dict(self.stats)
+            taken_at = self._taken_at if self._pid == os.getpid() else None
+            info.update(
+                enabled=self.enabled,
+                path=self._pool.path if self._pool is not None else self.path,
+                interval=self.interval,
+                max_writes=self.max_writes,
+                writes_since=self._writes,
+                taken_at=(datetime.fromtimestamp(taken_at, timezone.utc).isoformat()
+                          if taken_at else None),
+                age_seconds=time.time() - taken_at if taken_at else None
+            )
+        return info
+
+    def _ensure_started(self):
+        """Перший знімок і фоновий потік (заново в процесі після fork).
+
+        Повертає True, якщо знімок щойно зроблено.
+        """
+        if self._pid == os.getpid():
+            return False
+        with self._refresh_lock:
+            if self._pid == os.getpid():
+                return False
+            with self._lock:
+                self._pool = None
+                self._retired = []
+                self._taken_at = None
+                self._writes = 0
+                self._wake = threading.Event()
+            self._remove_stale()
+            self._refresh()
+            threading.Thread(target=self._run, args=(self._wake,),
+                             name='analytics-snapshot', daemon=True).start()
+            self._pid = os.getpid()
+            return True
+
+    def _run(self, wake):
+        # data_version змінюється, коли БД змінює інше з'єднання (сервер, CLI, інший воркер)
+        conn = connect(self.source)
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        while True:
+            forced = wake.wait(self.interval)
+            wake.clear()
+            with self._refresh_lock:
+                self._remove_retired()
+                self._touch()
+            current = conn.execute('PRAGMA data_version').fetchone()[0]
+            if not forced and current == version:
+                continue
+            try:
+                self._refresh()
+                version = current
+            except (sqlite3.Error, OSError) as e:
+                print(f"❌ Не вдалося оновити знімок БД: {e}")
+
+    def _touch(self):
+        """Позначка для інших процесів, що поточний файл знімка ще використовується"""
+        try:
+            os.utime(self._pool.path)
+        except OSError:
+            pass
+
+    def _remove_retired(self):
+        """Видалення старих файлів знімка, які вже ніхто не читає"""
+        kept = []
+        for path in self._retired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Windows: файл ще відкритий читачем
+                kept.append(path)
+        self._retired = kept
+
+    def _remove_stale(self):
+        """Видалення файлів знімка, покинутих завершеними процесами"""
+        root, ext = os.path.splitext(self.path)
+        max_age = max(STALE_AGE, 4 * self.interval)
+        now = time.time()
+        # Разом зі знімком без номера покоління, як їх знімали раніше
+        for path in glob.glob(f'{glob.escape(root)}.*-*{ext}') + [self.path]:
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,59 @@
+﻿import base64
+import json
+import unittest
+
+from client_listing import clients_page_query, decode_cursor, encode_cursor, next_cursor
+
+
+def raw_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+
+class CursorTest(unittest.TestCase):
+    """Курсор сторінки: відновлення ключа та відхилення підроблених значень"""
+
+    # Рядки у порядку CLIENT_COLUMNS
+    ROWS = {
+        'id': (7, 'Ім\'я', 'a@b.ua', '2024-01-02 03:04:05', 'Кластер', 0.5),
+        'created_at': (8, 'Ім\'я', 'a@b.ua', '2024-01-02 03:04:05', None, None),
+        'confidence': (9, 'Ім\'я', 'a@b.ua', '2024-01-02 03:04:05', 'Кластер', 0.75),
+    }
+
+    def test_round_trip(self):
+        expected = {'id': [7], 'created_at': ['2024-01-02 03:04:05', 8], 'confidence': [0.75, 9]}
+        for sort, row in self.ROWS.items():
+            for order in ('asc', 'desc'):
+                cursor = next_cursor(row, sort, order)
+                self.assertEqual(decode_cursor(cursor, sort, order), expected[sort])
+                sql, params = clients_page_query({'sort': sort, 'order': order,
+                                                  'cursor': cursor})[:2]
+                self.assertEqual(params[:-1], expected[sort])
+
+    def test_tampered_cursor_rejected(self):
+        tampered = [
+            ('id', raw_cursor(['id', 'asc', [[1]]])),
+            ('id', raw_cursor(['id', 'asc', [{'a': 1}]])),
+            ('id', raw_cursor(['id', 'asc', ['1']])),
+            ('id', raw_cursor(['id', 'asc', [True]])),
+            ('id', raw_cursor(['id', 'asc', [None]])),
+            ('id', raw_cursor(['id', 'asc', [1, 2]])),
+            ('id', raw_cursor(['id', 'asc', 1])),
+            ('id', raw_cursor(['created_at', 'asc', ['2024-01-01', 1]])),
+            ('created_at', raw_cursor(['created_at', 'asc', [1, 1]])),
+            ('created_at', raw_cursor(['created_at', 'asc', ['2024-01-01', 1.5]])),
+            ('confidence', raw_cursor(['confidence', 'asc', ['0.5', 1]])),
+            ('id', raw_cursor({'sort': 'id'})),
+            ('id', 'не base64'),
+        ]
+        for sort, cursor in tampered:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    clients_page_query({'sort': sort, 'cursor': cursor})
+
+    def test_encoded_key_accepted(self):
+        cursor = encode_cursor('confidence', 'desc', [1, 3])
+        self.assertEqual(decode_cursor(cursor, 'confidence', 'desc'), [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
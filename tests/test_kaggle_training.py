@@ -0,0 +1,57 @@
+﻿import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from kaggle_training import USED_COLUMNS, derive_features, sample_features
+
+
+class SampleFeaturesTest(unittest.TestCase):
+    """Вибірка для підбору K читає файл частинами і не перевищує заданого розміру"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix='kaggle-test-')
+        cls.path = os.path.join(cls.tmp, 'dataset.csv')
+        rng = np.random.default_rng(0)
+        frame = pd.DataFrame(rng.integers(1, 100, size=(1000, len(USED_COLUMNS))),
+                             columns=USED_COLUMNS)
+        # Номер рядка в доході, щоб упізнавати вибрані рядки
+        frame['Income'] = np.arange(1000)
+        frame.loc[::50, 'Recency'] = np.nan
+        frame.to_csv(cls.path, sep='\t', index=False)
+        cls.features = derive_features(frame)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def test_sample_is_bounded_and_from_file(self):
+        sample, seen = sample_features(self.path, size=100, chunksize=64)
+        self.assertEqual(seen, len(self.features))
+        self.assertEqual(sample.shape, (100, self.features.shape[1]))
+        rows = self.features[np.searchsorted(self.features[:, 0], sample[:, 0])]
+        np.testing.assert_array_equal(rows, sample)
+        self.assertEqual(len(np.unique(sample[:, 0])), 100)
+
+    def test_small_file_is_taken_whole(self):
+        sample, seen = sample_features(self.path, size=5000, chunksize=64)
+        np.testing.assert_array_equal(sample, self.features)
+
+    def test_rows_are_sampled_uniformly(self):
+        hits = np.zeros(1000)
+        for seed in range(100):
+            sample, _ = sample_features(self.path, size=100, chunksize=64, random_state=seed)
+            hits[sample[:, 0].astype(int)] += 1
+        valid = hits[self.features[:, 0].astype(int)]
+        # Кожен коректний рядок потрапляє у вибірку з імовірністю 100 / 980
+        expected = 100 * 100 / len(self.features)
+        self.assertLess(abs(valid[:490].mean() - valid[490:].mean()), 0.1 * expected)
+        self.assertAlmostEqual(valid.mean(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+﻿import hashlib
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from online_updates import OnlineCentroidUpdater
+
+
+class FakeModel:
+    """Мінімальний знімок моделі: центроїди в масштабованому просторі, скейлер (0, 1)"""
+
+    def __init__(self, mean, scale, centers, metrics=None):
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.centers = np.asarray(centers, dtype=float)
+        self.metrics = metrics or {}
+        self.version = hashlib.sha256(self.centers.tobytes()).hexdigest()[:12]
+        self.created_at = self.version
+
+
+class FakeArtifact:
+    """Спільний для «воркерів» артефакт моделі"""
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+
+
+class FakeSegmentation:
+    """Публікація та чекпоінти з тією ж семантикою, що й у server.py"""
+
+    def __init__(self, artifact):
+        self.artifact = artifact
+        self.model = artifact.model
+
+    def map_user_data_to_features(self, user_data):
+        return user_data['x']
+
+    def publish_model(self, snapshot, replace=None):
+        if replace is not None and self.model is not replace:
+            return False
+        self.model = snapshot
+        return True
+
+    def update_artifact(self, merge):
+        with self.artifact.lock:
+            self.artifact.model = merge(self.artifact.model)
+            return self.artifact.model
+
+    def reload(self):
+        self.model = self.artifact.model
+
+
+def make_updater(segmentation):
+    # Без мінімального кроку зсув — точне середнє анкет кластера
+    return OnlineCentroidUpdater(segmentation, prior_count=10, min_learning_rate=0.0,
+                                 publish_interval=3600, checkpoint_interval=3600)
+
+
+def apply(updater, points):
+    """Анкети в чергу та очікування, поки фоновий потік їх застосує"""
+    target = updater.stats['applied'] + len(points)
+    for point in points:
+        updater.submit({'x': point})
+    deadline = time.monotonic() + 10
+    while updater.stats['applied'] < target and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def apply_all(updater, points):
+    apply(updater, points)
+    updater.flush()
+
+
+class OnlineCheckpointMergeTest(unittest.TestCase):
+    """Чекпоінти воркерів зводять оновлення, а не перезаписують одне одного"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.base = FakeModel(np.zeros(2), np.ones(2), [[0.0, 0.0], [10.0, 10.0]])
+        self.first = rng.normal([1.0, 1.0], 0.5, size=(40, 2))
+        self.second = np.vstack([rng.normal([11.0, 9.0], 0.5, size=(30, 2)),
+                                 rng.normal([-1.0, 0.5], 0.5, size=(20, 2))])
+
+        serial = FakeSegmentation(FakeArtifact(self.base))
+        apply_all(make_updater(serial), np.vstack([self.first, self.second]))
+        self.expected = serial.artifact.model
+
+    def assert_matches_serial(self, model):
+        np.testing.assert_allclose(model.centers, self.expected.centers, atol=1e-9)
+        self.assertEqual(model.metrics['online']['counts'], self.expected.metrics['online']['counts'])
+        self.assertEqual(model.metrics['online']['base_version'], self.base.version)
+
+    def test_checkpoints_merge(self):
+        artifact = FakeArtifact(self.base)
+        workers = [FakeSegmentation(artifact), FakeSegmentation(artifact)]
+        updaters = [make_updater(worker) for worker in workers]
+
+        apply_all(updaters[0], self.first)
+        apply_all(updaters[1], self.second)
+        self.assert_matches_serial(artifact.model)
+
+    def test_reload_keeps_unsaved_updates(self):
+        artifact = FakeArtifact(self.base)
+        workers = [FakeSegmentation(artifact), FakeSegmentation(artifact)]
+        updaters = [make_updater(worker) for worker in workers]
+
+        apply(updaters[1], self.second)
+        apply_all(updaters[0], self.first)
+        # Другий воркер підхоплює чекпоінт першого, не зберігши своїх оновлень
+        workers[1].reload()
+        updaters[1].flush()
+        self.assert_matches_serial(artifact.model)
+        self.assert_matches_serial(workers[1].model)
+
+    def test_retrained_model_resets_updates(self):
+        artifact = FakeArtifact(self.base)
+        worker = FakeSegmentation(artifact)
+        updater = make_updater(worker)
+
+        apply(updater, self.first)
+        retrained = FakeModel(np.zeros(2), np.ones(2), [[5.0, 5.0], [20.0, 20.0]])
+        artifact.model = retrained
+        worker.reload()
+        # Незбережені оновлення старої моделі відкидаються, нові йдуть від перенавченої
+        apply_all(updater, self.second)
+        online = artifact.model.metrics['online']
+        self.assertEqual(online['base_version'], retrained.version)
+        self.assertEqual(sum(online['counts']), len(self.second))
+
+
+if __name__ == '__main__':
+    unittest.main()
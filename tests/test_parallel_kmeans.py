@@ -0,0 +1,42 @@
+﻿import unittest
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.datasets import make_blobs
+from sklearn.preprocessing import StandardScaler
+
+from parallel_kmeans import fit_kmeans_multi_init
+
+
+class ParallelKMeansTest(unittest.TestCase):
+    """Паралельні ініціалізації дають ту саму модель, що й послідовний KMeans"""
+
+    def assert_same_model(self, X, n_clusters, n_init, random_state, n_jobs):
+        serial = KMeans(n_clusters=n_clusters, init='k-means++', n_init=n_init,
+                        max_iter=300, random_state=random_state).fit(X)
+        parallel, _ = fit_kmeans_multi_init(X, n_clusters=n_clusters, n_init=n_init,
+                                            max_iter=300, random_state=random_state,
+                                            n_jobs=n_jobs)
+        np.testing.assert_allclose(parallel.cluster_centers_, serial.cluster_centers_,
+                                   rtol=0, atol=1e-9)
+        np.testing.assert_array_equal(parallel.labels_, serial.labels_)
+        self.assertAlmostEqual(parallel.inertia_, serial.inertia_, places=6)
+
+    def test_matches_serial_overlapping_blobs(self):
+        # Кластери, що перекриваються: різні ініціалізації сходяться по-різному
+        X, _ = make_blobs(n_samples=2240, n_features=7, centers=5, cluster_std=3.0,
+                          random_state=0)
+        X = StandardScaler().fit_transform(X)
+        for n_jobs in (1, 2):
+            with self.subTest(n_jobs=n_jobs):
+                self.assert_same_model(X, 5, 20, 42, n_jobs)
+
+    def test_matches_serial_other_parameters(self):
+        X = np.random.default_rng(7).normal(size=(1500, 7))
+        for n_clusters, random_state in ((3, 0), (8, 123)):
+            with self.subTest(n_clusters=n_clusters, random_state=random_state):
+                self.assert_same_model(X, n_clusters, 10, random_state, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
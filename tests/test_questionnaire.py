@@ -0,0 +1,155 @@
+﻿import base64
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+# Тимчасова БД до імпорту server: шляхи читаються з оточення при імпорті.
+# Запуск з кореня репозиторію: python -m unittest discover -s tests -t .
+_TMP = tempfile.mkdtemp(prefix='profiling-test-')
+os.environ['DB_PATH'] = os.path.join(_TMP, 'profiling.db')
+os.environ['SIMILARITY_INDEX_PATH'] = os.path.join(_TMP, 'similarity_index.pkl')
+os.environ['SNAPSHOT_INTERVAL'] = '0'
+os.environ['WRITE_ACK'] = 'commit'
+os.environ['SHARD_COUNT'] = '1'
+
+import server  # noqa: E402
+from similarity_index import SimilarCustomersIndex  # noqa: E402
+
+ANSWERS = {
+    'age_group': '25-34', 'income_level': 'medium', 'education': 'Вища',
+    'marital_status': 'Одружений', 'has_children': False, 'price_sensitivity': 5,
+    'online_shopping': 8, 'brand_loyalty': 6, 'innovation': 7,
+    'social_influence': 6, 'quality_importance': 8
+}
+
+
+def tearDownModule():
+    for writer in server.write_queues or []:
+        writer.flush()
+    shutil.rmtree(_TMP, ignore_errors=True)
+
+
+class QuestionnaireReservationTest(unittest.TestCase):
+    """Відхилена анкета не лишає резервування в записувачі"""
+
+    @classmethod
+    def setUpClass(cls):
+        server.warmup()
+        cls.client = server.app.test_client()
+
+    def register(self, email):
+        response = self.client.post('/api/register', json={
+            'email': email, 'password': 'secret', 'name': 'Тест'
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        return data['user_id'], {'Authorization': f"Bearer {data['token']}"}
+
+    def test_invalid_body_then_valid_retry(self):
+        user_id, headers = self.register('invalid-body@example.com')
+
+        response = self.client.post('/api/questionnaire', data='не json',
+                                    content_type='text/plain', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(server.writer_for(user_id).is_pending(user_id))
+        status = self.client.get('/api/check-questionnaire', headers=headers).get_json()
+        self.assertFalse(status['completed'])
+
+        response = self.client.post('/api/questionnaire', json=ANSWERS, headers=headers)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        status = self.client.get('/api/check-questionnaire', headers=headers).get_json()
+        self.assertTrue(status['completed'])
+
+    def test_second_submission_rejected(self):
+        _, headers = self.register('twice@example.com')
+
+        response = self.client.post('/api/questionnaire', json=ANSWERS, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/api/questionnaire', json=ANSWERS, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class AdminEndpointsTest(unittest.TestCase):
+    """Некоректні дані в запитах адміна відхиляються до початку відповіді"""
+
+    @classmethod
+    def setUpClass(cls):
+        server.warmup()
+        cls.client = server.app.test_client()
+        token = cls.client.post('/api/login', json={
+            'email': 'admin@system.ua', 'password': 'admin123'
+        }).get_json()['token']
+        cls.headers = {'Authorization': f'Bearer {token}'}
+
+    def test_unhashable_category_masks_only_its_record(self):
+        expected = server.segmentation.predict_cluster(ANSWERS)
+        records = [ANSWERS, dict(ANSWERS, income_level=['x']), dict(ANSWERS, age_group={'a': 1})]
+
+        response = self.client.post('/api/predict/batch', json={'records': records},
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual(results[0]['cluster_id'], expected['cluster_id'])
+        self.assertAlmostEqual(results[0]['confidence'], expected['confidence'])
+        self.assertNotEqual(results[0]['cluster_name'], 'Не визначено')
+        fallback = server.segmentation.fallback_result()
+        self.assertEqual(results[1:], [fallback, fallback])
+
+    def test_tampered_cursor_rejected(self):
+        cursor = base64.urlsafe_b64encode(b'["id","asc",[[1]]]').decode().rstrip('=')
+        response = self.client.get(f'/api/admin/clients?cursor={cursor}', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class SimilarityIndexWorkerTest(unittest.TestCase):
+    """Індекс іншого воркера дочитує анкети з БД і переживає пошкоджений файл"""
+
+    @classmethod
+    def setUpClass(cls):
+        server.warmup()
+        cls.client = server.app.test_client()
+
+    def other_worker_index(self, name):
+        return SimilarCustomersIndex(server.segmentation, server.storage,
+                                     path=os.path.join(_TMP, name), catch_up_interval=0)
+
+    def submit(self, email):
+        response = self.client.post('/api/register', json={
+            'email': email, 'password': 'secret', 'name': 'Тест'
+        })
+        data = response.get_json()
+        response = self.client.post('/api/questionnaire', json=ANSWERS,
+                                    headers={'Authorization': f"Bearer {data['token']}"})
+        self.assertEqual(response.status_code, 200)
+        return data['user_id']
+
+    def test_catch_up_reads_other_workers_profiles(self):
+        index = self.other_worker_index('worker.pkl')
+        index.ensure_loaded()
+        user_id = self.submit('other-worker@example.com')
+        self.assertNotIn(user_id, [found for found, _ in index.query(np.zeros(7), k=1000)])
+
+        index.catch_up()
+        found = index.query(server.similar_customers.profile_features(user_id), k=1000)
+        self.assertIn(user_id, [found_id for found_id, _ in found])
+
+    def test_corrupt_file_rebuilt_from_db(self):
+        path = os.path.join(_TMP, 'corrupt.pkl')
+        with open(path, 'wb') as f:
+            # Розпаковується, але не є станом індексу (IndexError при відновленні)
+            pickle.dump({'user_ids': np.arange(2), 'features': np.zeros(2),
+                         'scale': np.ones(7), 'tree': None}, f)
+        self.submit('corrupt-index@example.com')
+        index = SimilarCustomersIndex(server.segmentation, server.storage, path=path)
+        index.ensure_loaded()
+        self.assertGreater(index.info()['size'], 0)
+        with open(path, 'rb') as f:
+            self.assertEqual(pickle.load(f)['features'].shape[1], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
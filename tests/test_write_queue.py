@@ -0,0 +1,91 @@
+﻿import os
+import shutil
+import tempfile
+import unittest
+
+from write_queue import GroupCommitWriter
+
+
+class BrokenRollback:
+    """З'єднання, у якого rollback падає (наприклад, диск від'єднано)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def rollback(self):
+        raise RuntimeError('rollback failed')
+
+
+class FlakyWriter(GroupCommitWriter):
+    """Записувач, перше з'єднання якого не вміє відкочувати транзакцію"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+
+    def _connect(self):
+        self.connections += 1
+        conn = super()._connect()
+        return BrokenRollback(conn) if self.connections == 1 else conn
+
+
+def create_table(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS answers (user_id INTEGER PRIMARY KEY)')
+    return True
+
+
+def insert(user_id):
+    def apply(conn):
+        create_table(conn)
+        conn.execute('INSERT INTO answers (user_id) VALUES (?)', (user_id,))
+        return True
+    return apply
+
+
+def fail(conn):
+    raise ValueError('bad record')
+
+
+class GroupCommitWriterFailureTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'writes.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_failed_commit_fails_futures_and_releases_keys(self):
+        writer = FlakyWriter(self.path, max_delay=0)
+        self.assertTrue(writer.reserve(1))
+        future = writer.submit(1, fail)
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=5)
+        self.assertFalse(writer.is_pending(1))
+        self.assertEqual(writer.info()['pending'], 0)
+
+        # Потік живий, нове з'єднання приймає наступні записи
+        self.assertTrue(writer.reserve(1))
+        self.assertTrue(writer.submit(1, insert(1)).result(timeout=5))
+        self.assertFalse(writer.is_pending(1))
+        self.assertEqual(writer.connections, 2)
+
+    def test_connect_failure_does_not_kill_writer(self):
+        writer = GroupCommitWriter(os.path.join(self.tmp, 'missing', 'writes.db'),
+                                   max_delay=0)
+        self.assertTrue(writer.reserve(1))
+        with self.assertRaises(Exception):
+            writer.submit(1, insert(1)).result(timeout=5)
+        self.assertFalse(writer.is_pending(1))
+
+        os.mkdir(os.path.join(self.tmp, 'missing'))
+        self.assertTrue(writer.reserve(1))
+        self.assertTrue(writer.submit(1, insert(1)).result(timeout=5))
+        self.assertEqual(writer.info()['failed'], 1)
+        self.assertEqual(writer.info()['committed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
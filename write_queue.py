@@ -0,0 +1,224 @@
+﻿import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db import DB_PATH, connect
+
+# ================== ГРУПОВИЙ ЗАПИС АНКЕТ ==================
+#
+# Один потік-записувач з власним з'єднанням забирає записи з черги і
+# комітить їх групами: до max_batch записів або max_delay секунд від
+# першого запису групи. Одна транзакція (і один fsync) на групу замість
+# транзакції на кожен запит, а обробники запитів не змагаються за
+# блокування запису SQLite.
+#
+# Режими підтвердження (ack):
+#   'queued' — обробник відповідає одразу після постановки в чергу
+#              (write-behind; при аварійній зупинці процесу незакомічені
+#              записи втрачаються);
+#   'commit' — відповідь після коміту групи (synchronous=NORMAL: запис
+#              переживе падіння процесу, але не обов'язково вимкнення живлення);
+#   'fsync'  — відповідь після коміту групи з synchronous=FULL (WAL
+#              синхронізується на диск при кожному коміті групи).
+#
+# Ключі записів, що ще не закомічені, тримаються в множині pending: так
+# обробники бачать щойно прийняту анкету до її появи в БД і не приймають
+# її вдруге.
+
+ACK_MODES = ('queued', 'commit', 'fsync')
+
+
+class WriterOverloaded(RuntimeError):
+    """Черга записувача переповнена"""
+
+
+class GroupCommitWriter:
+    """Потік-записувач з груповими комітами.
+
+    submit(key, apply, after_commit) ставить запис у чергу: apply(conn)
+    виконується всередині транзакції групи і повертає результат запису,
+    after_commit(result) — після коміту (поза транзакцією). Повертає
+    concurrent.futures.Future з результатом apply. Якщо коміт групи не
+    вдався, записи групи повторюються поодинці, тож помилка одного запису
+    не скасовує інші. Якщо ж збій стався поза записами (з'єднання не
+    відкрилось, rollback впав), група завершується з помилкою, її ключі
+    звільняються, а потік відкриває нове з'єднання для наступної групи.
+    """
+
+    def __init__(self, path=DB_PATH, ack='commit', max_batch=256, max_delay=0.005,
+                 max_pending=10000):
+        if ack not in ACK_MODES:
+            raise ValueError(f"Невідомий режим підтвердження запису: {ack}")
+        self.path = path
+        self.ack = ack
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._pending = set()
+        self.stats = {
+            'submitted': 0,
+            'committed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'batches': 0,
+            'max_batch': 0,
+            'commit_ms_total': 0.0,
+            'commit_ms_max': 0.0
+        }
+
+    def _ensure_started(self):
+        """Запуск потоку при першому записі (і заново в процесі після fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            self._pending = set()
+            threading.Thread(target=self._run, args=(self._queue,),
+                             name='group-commit-writer', daemon=True).start()
+            self._pid = os.getpid()
+
+    def reserve(self, key):
+        """Позначка ключа як такого, що записується; False, якщо він вже в черзі"""
+        self._ensure_started()
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            return True
+
+    def release(self, key):
+        """Зняття позначки без запису (наприклад, якщо запит відхилено)"""
+        with self._lock:
+            self._pending.discard(key)
+
+    def is_pending(self, key):
+        return key in self._pending
+
+    def submit(self, key, apply, after_commit=None, timeout=1.0):
+        """Постановка запису в чергу (ключ має бути зарезервований)"""
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put((key, apply, after_commit, future), timeout=timeout)
+        except queue.Full:
+            self.release(key)
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise WriterOverloaded('Черга записів переповнена')
+        with self._lock:
+            self.stats['submitted'] += 1
+        return future
+
+    def info(self):
+        """Лічильники записувача для адмін-панелі"""
+        with self._lock:
+            info = dict(self.stats)
+            info.update(
+                ack=self.ack,
+                max_batch_size=self.max_batch,
+                max_delay_ms=self.max_delay * 1000,
+                queued=self._queue.qsize() if self._queue is not None else 0,
+                pending=len(self._pending)
+            )
+        info['avg_batch'] = info['committed'] / info['batches'] if info['batches'] else 0.0
+        return info
+
+    def flush(self, timeout=10.0):
+        """Очікування коміту всього, що вже в черзі (наприклад, перед зупинкою)"""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _connect(self):
+        conn = connect(self.path)
+        if self.ack == 'fsync':
+            conn.execute('PRAGMA synchronous=FULL')
+        return conn
+
+    def _run(self, items):
+        conn = None
+        while True:
+            batch = [items.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(items.get(timeout=remaining) if remaining > 0
+                                 else items.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self._commit(conn, batch)
+            except Exception as e:
+                print(f"❌ Збій групового запису ({len(batch)} записів): {e}")
+                self._fail(batch, e)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+
+    def _fail(self, batch, error):
+        """Завершення групи з помилкою: ключі звільняються, очікувачі отримують виняток"""
+        unresolved = [future for _, _, _, future in batch if not future.done()]
+        with self._lock:
+            self._pending.difference_update(key for key, _, _, _ in batch)
+            self.stats['failed'] += len(unresolved)
+        for future in unresolved:
+            future.set_exception(error)
+
+    def _commit(self, conn, batch):
+        start = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            results = [(apply(conn), None) for _, apply, _, _ in batch]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            results = [self._commit_one(conn, apply) for _, apply, _, _ in batch]
+        elapsed = (time.perf_counter() - start) * 1000
+
+        failed = sum(error is not None for _, error in results)
+        with self._lock:
+            self._pending.difference_update(key for key, _, _, _ in batch)
+            self.stats['committed'] += len(batch) - failed
+            self.stats['failed'] += failed
+            self.stats['batches'] += 1
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+            self.stats['commit_ms_total'] += elapsed
+            self.stats['commit_ms_max'] = max(self.stats['commit_ms_max'], elapsed)
+
+        for (key, _, after_commit, future), (result, error) in zip(batch, results):
+            if error is not None:
+                print(f"❌ Не вдалося записати {key}: {error}")
+                future.set_exception(error)
+                continue
+            if after_commit is not None:
+                try:
+                    after_commit(result)
+                except Exception as e:
+                    print(f"❌ Помилка після запису {key}: {e}")
+            future.set_result(result)
+
+    @staticmethod
+    def _commit_one(conn, apply):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = apply(conn)
+            conn.commit()
+            return result, None
+        except Exception as e:
+            conn.rollback()
+            return None, e